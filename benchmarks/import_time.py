@@ -0,0 +1,61 @@
+# Import time budget of the mems core
+#
+# Imports the parsing and diagnostics modules in a fresh interpreter and
+# fails if that takes longer than the budget or pulls in plotly or jupyter.
+#
+#   python benchmarks/import_time.py --budget 1.0
+#
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+core_modules = ['mems.logreader', 'mems.diagnostics', 'mems.protocol.rosco', 'mems.batch']
+heavy_modules = ['plotly', 'IPython', 'ipywidgets', 'notebook']
+
+probe = '''
+import json, sys, time
+started = time.perf_counter()
+for name in {modules!r}:
+    __import__(name)
+elapsed = time.perf_counter() - started
+print(json.dumps({{'elapsed': elapsed, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def measure(repeat=5):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = probe.format(modules=core_modules, heavy=heavy_modules)
+    runs = []
+
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output))
+
+    return min(r['elapsed'] for r in runs), sorted(set(m for r in runs for m in r['loaded']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check the import time budget of the mems core')
+    parser.add_argument('--budget', type=float, default=1.0, help='seconds allowed for the core imports')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    elapsed, loaded = measure(args.repeat)
+    print(f'core import {elapsed * 1000:.0f} ms (budget {args.budget * 1000:.0f} ms)')
+
+    if loaded:
+        print(f'FAIL: core import loaded {", ".join(loaded)}')
+        return 1
+
+    if elapsed > args.budget:
+        print('FAIL: core import over budget')
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
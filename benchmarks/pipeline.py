@@ -0,0 +1,126 @@
+# Throughput of the parse, convert and diagnose pipeline
+#
+# Writes synthetic readmems and mems-scan logs with mems.synthetic and times
+# each stage of loading and diagnosing them. Every case runs in a fresh
+# interpreter so the peak RSS reported is that of the case alone. Results
+# can be appended to a JSON lines file to follow performance over time.
+#
+#   python benchmarks/pipeline.py --sizes 10000 1000000 10000000
+#   python benchmarks/pipeline.py --formats readmems --output benchmarks/results.jsonl
+#
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+extensions = {'readmems': '.log', 'mems-scan': '.csv'}
+
+probe = '''
+import json, resource, sys, time
+import mems.logreader
+
+filepath, source_format = sys.argv[1], sys.argv[2]
+lr = mems.logreader.LogReader()
+lr.filepath = filepath
+stages = {}
+
+def stage(name, function, *args):
+    started = time.perf_counter()
+    function(*args)
+    stages[name] = time.perf_counter() - started
+
+if source_format == 'readmems':
+    stage('parse', lambda: setattr(lr, 'df', lr.create_dataframe_from_file()))
+    stage('convert', lr.convert_metrics)
+else:
+    stage('read', lr.read_memsscanfile, filepath)
+
+stage('diagnose', lr.diagnostics.analyse_run, lr.df)
+
+print(json.dumps({'rows': len(lr.df), 'stages': stages,
+                  'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+'''
+
+
+# generated logs are kept in the work directory and reused by later runs
+def synthetic_log(directory, source_format, samples, seed=0):
+    import mems.synthetic
+
+    filepath = os.path.join(directory, f'synthetic-{samples}-{seed}{extensions[source_format]}')
+
+    if not os.path.exists(filepath):
+        partial = filepath + '.partial'
+        if source_format == 'readmems':
+            mems.synthetic.SyntheticLog(samples, 1.0, seed).write_readmems(partial)
+        else:
+            mems.synthetic.SyntheticLog(samples, 0.5, seed).write_memsscan(partial)
+        os.replace(partial, filepath)
+
+    return filepath
+
+
+def run_case(filepath, source_format):
+    output = subprocess.run([sys.executable, '-c', probe, filepath, source_format],
+                            cwd=root, capture_output=True, text=True, check=True).stdout
+    result = json.loads(output)
+
+    total = sum(result['stages'].values())
+    result['total'] = total
+    result['rows_per_second'] = result['rows'] / total if total else 0.0
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the parse, convert and diagnose pipeline')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 1000000, 10000000], help='samples per log')
+    parser.add_argument('--formats', nargs='+', default=list(extensions), choices=list(extensions))
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'mems-benchmarks'),
+                        help='directory for the generated logs')
+    parser.add_argument('--output', help='append the results to this JSON lines file')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, root)
+    os.makedirs(args.workdir, exist_ok=True)
+
+    revision = git_revision()
+    date = datetime.datetime.now().isoformat(timespec='seconds')
+    results = []
+
+    print(f'{"format":<10} {"samples":>10} {"rows/s":>12} {"peak MB":>9}  stages (s)')
+
+    for source_format in args.formats:
+        for samples in args.sizes:
+            filepath = synthetic_log(args.workdir, source_format, samples)
+            result = run_case(filepath, source_format)
+
+            stages = ' '.join(f'{name}={seconds:.3f}' for name, seconds in result['stages'].items())
+            print(f'{source_format:<10} {samples:>10} {result["rows_per_second"]:>12,.0f} {result["peak_rss_mb"]:>9.0f}  {stages}')
+
+            results.append(dict(result, format=source_format, samples=samples, file_bytes=os.path.getsize(filepath),
+                                revision=revision, date=date, python=platform.python_version()))
+
+    if args.output:
+        with open(args.output, 'a') as f:
+            for result in results:
+                f.write(json.dumps(result) + '\n')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
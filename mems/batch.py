@@ -0,0 +1,192 @@
+# Analyse a directory of logs in parallel and write one consolidated table
+#
+# Every log is analysed in a process of its own, at most workers at a time.
+# A log that crashes its process, or runs past the timeout and is killed,
+# fails alone and the other logs carry on.
+#
+#   python -m mems.batch ./logs --output results.csv --workers 8 --timeout 120
+#
+import argparse
+import functools
+import multiprocessing
+import multiprocessing.connection
+import os
+import sys
+import time
+
+import pandas as pd
+
+import mems.logreader
+import mems.profiling
+
+
+log_extensions = ['.log', '.csv']
+
+
+def run_worker(function, item, connection):
+    try:
+        outcome = (function(item), None)
+    except Exception as e:
+        outcome = (None, f'{type(e).__name__}: {e}')
+
+    connection.send(outcome)
+    connection.close()
+
+
+# run function(item) for every item in a process of its own, at most workers
+# at a time, and yield (item, result, error, status) as they finish. status
+# is 'ok', 'error' when the function raised or the process died, or
+# 'timeout' when the process ran past timeout seconds and was killed. the
+# timeout is kept by this process, so a worker stuck in C code is stopped too
+def run_isolated(function, items, workers=None, timeout=None):
+    pending = list(reversed(items))
+    workers = workers or os.cpu_count() or 1
+    running = {}
+
+    while pending or running:
+        while pending and len(running) < workers:
+            item = pending.pop()
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=run_worker, args=(function, item, sender), daemon=True)
+            process.start()
+            sender.close()
+
+            deadline = time.monotonic() + timeout if timeout else None
+            running[receiver] = (item, process, deadline)
+
+        deadlines = [deadline for _, _, deadline in running.values() if deadline is not None]
+        wait = max(min(deadlines) - time.monotonic(), 0) if deadlines else None
+        multiprocessing.connection.wait(list(running) + [p.sentinel for _, p, _ in running.values()], wait)
+
+        for receiver, (item, process, deadline) in list(running.items()):
+            outcome = None
+
+            if receiver.poll():
+                try:
+                    result, error = receiver.recv()
+                    outcome = (item, result, error, 'ok' if error is None else 'error')
+                except EOFError:
+                    pass
+
+            if outcome is None and not process.is_alive():
+                outcome = (item, None, f'worker exited with code {process.exitcode}', 'error')
+            elif outcome is None and deadline is not None and time.monotonic() >= deadline:
+                process.kill()
+                outcome = (item, None, f'exceeded {timeout}s', 'timeout')
+            elif outcome is None:
+                continue
+
+            process.join()
+            receiver.close()
+            del running[receiver]
+            yield outcome
+
+
+def log_format(filepath):
+    return 'mems-scan' if filepath.lower().endswith('.csv') else 'readmems'
+
+
+# read one log, run the diagnostics and summarise the channels. runs in a
+# worker process, every failure is returned as part of the result. with
+# profile set the stage timings are appended to that file as JSON lines
+def analyse_file(filepath, profile=None):
+    started = time.perf_counter()
+    result = {'file': filepath,
+              'format': log_format(filepath),
+              'status': 'ok',
+              'error': ''}
+
+    profiler = mems.profiling.Profiler(output=profile, context={'file': filepath}) if profile else None
+
+    try:
+        lr = mems.logreader.LogReader(profiler=profiler)
+
+        if result['format'] == 'mems-scan':
+            lr.read_memsscanfile(filepath)
+        else:
+            lr.read_logfile(filepath)
+
+        lr.diagnostics.analyse_run(lr.df)
+
+        result['rows'] = len(lr.df)
+        result['ecu_version'] = lr.rosco.get_version(lr.version) or lr.version
+        result['faults'] = ';'.join(lr.diagnostics.faults)
+
+        # damaged responses dropped while reading a readmems log
+        for count in ['malformed', 'unpaired', 'resynced']:
+            if count in lr.frame_stats:
+                result[f'frames_{count}'] = lr.frame_stats[count]
+
+        stats = lr.dimension_stats().drop(index='timestamp', errors='ignore')
+        for dimension, row in stats.iterrows():
+            for stat in ['min', 'mean', 'max']:
+                result[f'{dimension}_{stat}'] = row[stat]
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = f'{type(e).__name__}: {e}'
+    finally:
+        if profiler is not None:
+            profiler.close()
+
+    result['elapsed'] = time.perf_counter() - started
+    return result
+
+
+def find_logs(directory):
+    paths = []
+
+    for root, dirs, files in os.walk(directory):
+        for name in files:
+            if os.path.splitext(name)[1].lower() in log_extensions:
+                paths.append(os.path.join(root, name))
+
+    # start the largest logs first so that the pool drains evenly
+    return sorted(paths, key=os.path.getsize, reverse=True)
+
+
+def analyse_directory(directory, workers=None, timeout=None, profile=None):
+    paths = find_logs(directory)
+    results = []
+
+    for path, result, error, status in run_isolated(functools.partial(analyse_file, profile=profile), paths, workers, timeout):
+        if result is None:
+            # the worker died or was killed before returning
+            result = {'file': path, 'format': log_format(path), 'status': status, 'error': error}
+        results.append(result)
+
+    columns = ['file', 'format', 'status', 'error', 'elapsed', 'rows', 'ecu_version', 'faults']
+    df = pd.DataFrame(results)
+    df = df.reindex(columns=columns + [c for c in df.columns if c not in columns])
+
+    return df.sort_values('file', ignore_index=True)
+
+
+def save_results(df, output):
+    if output.lower().endswith('.parquet'):
+        df.to_parquet(output, index=False)
+    else:
+        df.to_csv(output, index=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m mems.batch', description='Analyse a directory of MEMS logs')
+    parser.add_argument('directory', help='directory searched recursively for .log and .csv files')
+    parser.add_argument('-o', '--output', default='mems-batch.csv', help='results table, .csv or .parquet')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('-t', '--timeout', type=float, default=300, help='seconds allowed per log')
+    parser.add_argument('-p', '--profile', help='append per-stage timings of every log to this JSON lines file')
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    df = analyse_directory(args.directory, args.workers, args.timeout, args.profile)
+    save_results(df, args.output)
+
+    elapsed = time.perf_counter() - started
+    failed = int((df['status'] != 'ok').sum()) if len(df) else 0
+    print(f'{len(df)} logs analysed in {elapsed:.1f}s, {failed} failed, results written to {args.output}')
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,190 @@
+# Compact binary log format
+#
+# A fixed 4096 byte header holding JSON (ECU version, the 0x80/0x7D field
+# layout from Rosco._dataframes and the record layout) followed by fixed size
+# records of (monotonic timestamp, 0x80 frame bytes, 0x7D frame bytes), see
+# Rosco.record_dtype. Records are read through numpy.memmap without parsing
+# and time ranges are found by binary search on the timestamps.
+#
+#   python -m mems.binlog ./logs -o ./binlogs
+#
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+import mems.logreader
+import mems.protocol.rosco
+
+
+magic = b'MEMSBIN1'
+header_size = 4096
+
+
+class BinaryLogError(Exception):
+    pass
+
+
+def create_header(version, rosco):
+    header = {'version': version,
+              'dataframes': rosco._dataframes,
+              'record_dtype': [list(field) for field in np.dtype(rosco.record_dtype).descr]}
+
+    encoded = json.dumps(header).encode()
+    if len(magic) + len(encoded) > header_size:
+        raise BinaryLogError('binary log header too large')
+
+    return (magic + encoded).ljust(header_size, b' ')
+
+
+# appends records to a binary log. it has the same interface as the readmems
+# text writer so it can be attached to RoscoClient and the acquisition server
+class BinaryLogWriter(object):
+    def __init__(self, filepath, version=''):
+        self.rosco = mems.protocol.rosco.Rosco()
+        self.dtype = np.dtype(self.rosco.record_dtype)
+        self.f = open(filepath, 'wb')
+        self.f.write(create_header(version, self.rosco))
+
+
+    # the version is only known after the ECU handshake, the fixed size header
+    # is rewritten in place
+    def write_version(self, version):
+        position = self.f.tell()
+        self.f.seek(0)
+        self.f.write(create_header(version, self.rosco))
+        self.f.seek(position)
+
+
+    def write(self, record):
+        self.f.write(np.asarray(record, dtype=self.dtype).tobytes())
+
+
+    def write_records(self, records):
+        self.f.write(np.ascontiguousarray(records, dtype=self.dtype).tobytes())
+
+
+    def close(self):
+        self.f.close()
+
+
+class BinaryLogReader(object):
+    def __init__(self, filepath):
+        self.filepath = filepath
+
+        with open(filepath, 'rb') as f:
+            raw_header = f.read(header_size)
+
+        if not raw_header.startswith(magic):
+            raise BinaryLogError(f'{filepath} is not a binary MEMS log')
+
+        self.header = json.loads(raw_header[len(magic):].decode().strip())
+        self.version = self.header['version']
+        self.dtype = np.dtype([tuple(field) for field in self.header['record_dtype']])
+
+        # a partly written last record, from an interrupted capture, is ignored
+        count = (os.path.getsize(filepath) - header_size) // self.dtype.itemsize
+
+        if count > 0:
+            self.records = np.memmap(filepath, dtype=self.dtype, mode='r', offset=header_size, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=self.dtype)
+
+
+    def __len__(self):
+        return len(self.records)
+
+
+    # index range of the records between start and end seconds from the
+    # first record, found by binary search on the monotonic timestamps
+    def time_range_index(self, start=None, end=None):
+        if len(self.records) == 0:
+            return 0, 0
+
+        timestamps = self.records['timestamp']
+        first = timestamps[0]
+
+        lower = 0 if start is None else int(np.searchsorted(timestamps, first + start, side='left'))
+        upper = len(timestamps) if end is None else int(np.searchsorted(timestamps, first + end, side='right'))
+
+        return lower, upper
+
+
+    def time_range(self, start=None, end=None):
+        lower, upper = self.time_range_index(start, end)
+        return self.records[lower:upper]
+
+
+# convert a readmems text log or mems-scan csv log to the binary format. text
+# logs carry no sample times so each sample is taken to be one second apart
+# as in LogReader.read_logfile
+# a mems-scan column that no frame can hold is refused unless allow_loss is
+# set, then it is left out
+def convert_logfile(source, destination, allow_loss=False):
+    lr = mems.logreader.LogReader()
+    lr.filepath = source
+
+    if source.lower().endswith('.csv'):
+        lr.read_memsscanfile(source)
+
+        lost = lr.rosco.unencoded_columns(lr.df)
+        if lost and not allow_loss:
+            raise ValueError(f'{source} has columns the binary format cannot hold: {", ".join(lost)}')
+        frames80 = lr.rosco.encode_frames(lr.df, '80')
+        frames7d = lr.rosco.encode_frames(lr.df, '7d')
+        timestamps = (lr.df['timestamp'] - lr.df['timestamp'].iloc[0]).dt.total_seconds().to_numpy() if len(lr.df) else []
+        version = lr.rosco._versions.get(lr.version, lr.version)
+    else:
+        blocks = lr.read_frame_blocks()
+        frames80 = blocks['80']
+        frames7d = blocks['7d']
+        timestamps = np.arange(len(frames80), dtype=np.float64)
+        version = lr.version
+
+    records = np.zeros(len(frames80), dtype=np.dtype(lr.rosco.record_dtype))
+    records['timestamp'] = timestamps
+    records['80'] = frames80
+    records['7d'] = frames7d
+
+    writer = BinaryLogWriter(destination, version)
+    writer.write_records(records)
+    writer.close()
+
+    return len(records)
+
+
+def convert_archive(paths, output_directory, allow_loss=False):
+    os.makedirs(output_directory, exist_ok=True)
+    converted = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            names = sorted(os.listdir(path))
+            sources = [os.path.join(path, n) for n in names if os.path.splitext(n)[1].lower() in ['.log', '.csv']]
+        else:
+            sources = [path]
+
+        for source in sources:
+            destination = os.path.join(output_directory, os.path.splitext(os.path.basename(source))[0] + '.memsbin')
+            converted.append((source, destination, convert_logfile(source, destination, allow_loss)))
+
+    return converted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m mems.binlog', description='Convert MEMS logs to the binary log format')
+    parser.add_argument('paths', nargs='+', help='.log/.csv files or directories of them')
+    parser.add_argument('-o', '--output', default='.', help='directory for the .memsbin files')
+    parser.add_argument('--allow-loss', action='store_true', help='leave out mems-scan columns the binary format cannot hold')
+    args = parser.parse_args(argv)
+
+    for source, destination, count in convert_archive(args.paths, args.output, args.allow_loss):
+        print(f'{source} -> {destination} ({count} records)')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+# Cache of converted logs, one memory-mappable .npy file per column
+#
+# Entries are keyed by the content hash of the source log and the parser
+# version, so an edited log or a parser change never returns stale data.
+# The least recently used entries are evicted once the cache grows past
+# max_bytes.
+#
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+
+class LogCache(object):
+    def __init__(self, directory='~/.cache/mems', max_bytes=2 * 1024 ** 3):
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(self.directory, 'stat'), exist_ok=True)
+
+
+    # hash the log contents. the hash is remembered against the file's path,
+    # size and modification time so an unchanged log is not re-read
+    def fingerprint(self, filepath):
+        stat = os.stat(filepath)
+        path = os.path.realpath(filepath)
+        statfile = os.path.join(self.directory, 'stat', hashlib.sha1(path.encode()).hexdigest())
+        signature = f'{stat.st_size} {stat.st_mtime_ns}'
+
+        try:
+            with open(statfile) as f:
+                stored_signature, digest = f.read().rsplit(' ', 1)
+            if stored_signature == signature:
+                return digest
+        except (OSError, ValueError):
+            pass
+
+        h = hashlib.blake2b(digest_size=20)
+        with open(filepath, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        digest = h.hexdigest()
+
+        with open(statfile, 'w') as f:
+            f.write(f'{signature} {digest}')
+
+        return digest
+
+
+    def key(self, filepath, parser_version):
+        return f'{self.fingerprint(filepath)}-{parser_version}'
+
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key)
+
+
+    # returns (dataframe, metadata) or None. the columns are read-only memory
+    # maps of the cached files so nothing is read until it is used
+    def get(self, key):
+        path = self.entry_path(key)
+        metafile = os.path.join(path, 'metadata.json')
+
+        try:
+            with open(metafile) as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        columns = {}
+        for column in metadata['columns']:
+            columns[column['name']] = np.load(os.path.join(path, column['file']), mmap_mode='r')
+
+        # mark the entry as recently used
+        os.utime(metafile)
+
+        df = pd.DataFrame(columns, copy=False)
+        if metadata.get('index_column'):
+            df.index = pd.Index(df[metadata['index_column']], name=metadata.get('index_name'))
+
+        return df, metadata
+
+
+    def put(self, key, df, metadata=None):
+        metadata = dict(metadata or {})
+        metadata['columns'] = []
+
+        if isinstance(df.index, pd.DatetimeIndex) and 'timestamp' in df.columns:
+            metadata['index_column'] = 'timestamp'
+            metadata['index_name'] = df.index.name
+
+        staging = tempfile.mkdtemp(prefix='.staging-', dir=self.directory)
+        try:
+            for n, name in enumerate(df.columns):
+                values = df[name].to_numpy()
+                if values.dtype == object:
+                    continue
+
+                filename = f'c{n}.npy'
+                np.save(os.path.join(staging, filename), np.ascontiguousarray(values))
+                metadata['columns'].append({'name': name, 'file': filename, 'dtype': str(values.dtype)})
+
+            with open(os.path.join(staging, 'metadata.json'), 'w') as f:
+                json.dump(metadata, f)
+
+            os.replace(staging, self.entry_path(key))
+        except OSError:
+            # another process stored the same entry first
+            shutil.rmtree(staging, ignore_errors=True)
+
+        self.evict()
+
+
+    def entries(self):
+        entries = []
+
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            metafile = os.path.join(path, 'metadata.json')
+            if name.startswith('.') or name == 'stat' or not os.path.exists(metafile):
+                continue
+
+            size = sum(e.stat().st_size for e in os.scandir(path))
+            entries.append({'key': name, 'size': size, 'used': os.path.getmtime(metafile)})
+
+        return entries
+
+
+    # remove the least recently used entries until the cache fits in max_bytes
+    def evict(self):
+        entries = sorted(self.entries(), key=lambda e: e['used'])
+        total = sum(e['size'] for e in entries)
+
+        while entries and total > self.max_bytes:
+            entry = entries.pop(0)
+            shutil.rmtree(self.entry_path(entry['key']), ignore_errors=True)
+            total = total - entry['size']
+
+
+    def clear(self):
+        for entry in self.entries():
+            shutil.rmtree(self.entry_path(entry['key']), ignore_errors=True)
@@ -0,0 +1,235 @@
+# Compact in-memory representation of a loaded log
+#
+# The channels are held as the bytes the ECU sent, uint8 or uint16 for the two
+# byte fields, and are only scaled with the protocol conversion table when
+# they are read. Scaled channels are cached until clear_cache is called. A
+# converted channel takes 2 to 4 bytes a sample, its raw bytes 1 or 2.
+#
+# The dtype of a channel when read is that of the conversion table, as for a
+# log loaded with the default 'converted' dtype policy. Columns that have no
+# conversion, or whose values are not exact raw bytes, are packed into the
+# smallest unsigned integer that holds them exactly or are kept as they are.
+#
+#   lr = mems.logreader.LogReader(dtype_policy='compact')
+#   lr.read_logfile('run.log')
+#   lr.channels['engine_speed']
+#   print(lr.memory_usage())
+#
+import numpy as np
+import pandas as pd
+
+
+dtype_policies = ['converted', 'compact']
+
+identity = {'scale': 1, 'offset': 0}
+
+
+# raw values to the units and dtype of a conversion
+def scale_values(values, conversion, dtype=None):
+    dtype = dtype or conversion.get('dtype', values.dtype)
+
+    if conversion['scale'] != 1 or conversion['offset'] != 0:
+        values = values.astype(np.int32) * conversion['scale'] + conversion['offset']
+
+    return values.astype(dtype)
+
+
+# the raw bytes of converted values in the smallest unsigned dtype, or None
+# when the values do not come from whole bytes
+def pack_values(values, conversion=identity):
+    values = np.asarray(values)
+    if values.dtype.kind not in 'iufb':
+        return None
+
+    if values.dtype.kind == 'b':
+        return values.view(np.uint8)
+
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.uint8)
+
+    with np.errstate(invalid='ignore'):
+        raw = np.rint((values.astype(np.float64) - conversion['offset']) / conversion['scale'])
+
+    if not np.isfinite(raw).all():
+        return None
+
+    low, high = raw.min(), raw.max()
+    if low < 0 or high > 0xffff:
+        return None
+
+    raw = raw.astype(np.uint8 if high <= 0xff else np.uint16)
+
+    if not np.array_equal(scale_values(raw, conversion, values.dtype), values):
+        return None
+
+    return raw
+
+
+class CompactFrame(object):
+    # columns maps names to the stored arrays, conversions maps the names of
+    # packed columns to their conversion and dtypes gives the dtype of every
+    # column when read
+    def __init__(self, columns, conversions=None, dtypes=None, index=None):
+        self.raw = columns
+        self.conversions = conversions or {}
+        self.dtypes = dtypes or {name: values.dtype for name, values in columns.items()}
+        self.index = index
+        self.cache = {}
+
+
+    # the readmems and binary log blocks, see LogReader.assemble_dataframe.
+    # fields that appear in both responses take the value from 0x80 and the
+    # two byte fields are combined into one uint16
+    @classmethod
+    def from_blocks(cls, blocks, rosco, timestamps, fields=None):
+        columns = {}
+        for command in ['7d', '80']:
+            for n, field in enumerate(rosco.get_dataframe_fields(command)):
+                if fields is None or field in fields:
+                    columns[field] = np.ascontiguousarray(blocks[command][:, n])
+        columns['timestamp'] = timestamps
+
+        conversions = {}
+        dtypes = {}
+        for field, conversion in rosco._conversions.items():
+            if conversion['width'] == 2 and 'bytes' in conversion and conversion['bytes'][0] in columns:
+                high, low = conversion['bytes']
+                columns[field] = (columns.pop(high).astype(np.uint16) << 8) | columns.pop(low)
+
+            if field in columns:
+                conversions[field] = conversion
+                dtypes[field] = np.dtype(conversion['dtype'])
+
+        frame = cls(columns, conversions)
+        frame.dtypes.update(dtypes)
+        return frame
+
+
+    # pack the columns of a converted frame, such as a mems-scan log
+    @classmethod
+    def from_dataframe(cls, df, conversions_table):
+        columns = {}
+        conversions = {}
+        dtypes = {}
+
+        for name in df.columns:
+            values = df[name].to_numpy()
+            conversion = conversions_table.get(name, identity)
+            raw = pack_values(values, conversion) if name != 'timestamp' else None
+
+            dtypes[name] = values.dtype
+            if raw is None:
+                columns[name] = values
+            else:
+                columns[name] = raw
+                conversions[name] = conversion
+
+        index = None if isinstance(df.index, pd.RangeIndex) else df.index
+        return cls(columns, conversions, dtypes, index)
+
+
+    # join frames of consecutive chunks. a column packed in every chunk stays
+    # packed, otherwise the chunks are read and packed again together.
+    @classmethod
+    def concat(cls, frames, conversions_table):
+        if not frames:
+            return cls({})
+
+        columns = {}
+        conversions = {}
+        dtypes = dict(frames[0].dtypes)
+
+        for name in frames[0].columns:
+            if all(name in f.conversions for f in frames):
+                columns[name] = np.concatenate([f.raw[name] for f in frames])
+                conversions[name] = frames[0].conversions[name]
+                continue
+
+            values = np.concatenate([f.values(name) for f in frames])
+            conversion = conversions_table.get(name, identity)
+            raw = pack_values(values, conversion) if name != 'timestamp' else None
+
+            if raw is None:
+                columns[name] = values
+            else:
+                columns[name] = raw
+                conversions[name] = conversion
+
+        # the chunks keep their index, as with pd.concat
+        index = None
+        if all(f.index is not None for f in frames):
+            index = frames[0].index.append([f.index for f in frames[1:]])
+
+        return cls(columns, conversions, dtypes, index)
+
+
+    @property
+    def columns(self):
+        return pd.Index(list(self.raw))
+
+
+    def __len__(self):
+        return len(next(iter(self.raw.values()))) if self.raw else 0
+
+
+    def __contains__(self, name):
+        return name in self.raw
+
+
+    # a column scaled to its units, cached until clear_cache
+    def values(self, name):
+        if name not in self.conversions:
+            return self.raw[name]
+
+        if name not in self.cache:
+            self.cache[name] = scale_values(self.raw[name], self.conversions[name], self.dtypes[name])
+
+        return self.cache[name]
+
+
+    def __getitem__(self, name):
+        if isinstance(name, list):
+            return self.to_dataframe(name)
+
+        return pd.Series(self.values(name), index=self.index, name=name, copy=False)
+
+
+    def clear_cache(self):
+        self.cache = {}
+
+
+    # the frame the 'converted' dtype policy loads, the scaled columns are
+    # not cached so the frame is the only copy of them. rows is a slice of
+    # the samples, only those are scaled
+    def to_dataframe(self, columns=None, rows=None):
+        columns = list(self.raw) if columns is None else columns
+        rows = slice(None) if rows is None else rows
+        data = {}
+
+        for name in columns:
+            if name in self.cache or name not in self.conversions:
+                data[name] = self.values(name)[rows]
+            else:
+                data[name] = scale_values(self.raw[name][rows], self.conversions[name], self.dtypes[name])
+
+        df = pd.DataFrame(data, copy=False)
+        if self.index is not None:
+            df.index = self.index[rows]
+
+        return df
+
+
+    # bytes held for every column next to the bytes it takes when converted
+    def memory_usage(self):
+        rows = []
+
+        for name, values in self.raw.items():
+            dtype = np.dtype(self.dtypes[name])
+            rows.append({'column': name,
+                         'dtype': str(values.dtype),
+                         'bytes': values.nbytes,
+                         'cached_bytes': self.cache[name].nbytes if name in self.cache else 0,
+                         'converted_dtype': str(dtype),
+                         'converted_bytes': len(values) * dtype.itemsize})
+
+        return pd.DataFrame(rows, columns=['column', 'dtype', 'bytes', 'cached_bytes', 'converted_dtype', 'converted_bytes'])
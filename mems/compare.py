@@ -0,0 +1,357 @@
+# Comparison of two runs, such as before and after a repair
+#
+# Every sample of a run is given a phase from the running, warm and
+# stable_idle subsets of the fault rules: stopped, cold start (the first
+# cold_start seconds of running cold), warm-up, warm idle and warm running.
+# The second run's time is mapped onto the first's, piecewise linearly
+# between the times each phase is first reached, so that the warm-ups line
+# up even when one takes longer. Both runs are then interpolated onto one
+# time grid and compared channel by channel, per phase, and by their faults.
+#
+#   comparison = mems.compare.RunComparison(before, after)
+#   print(comparison.create_report())
+#   comparison.display_graph(['coolant_temperature', 'engine_speed'])
+#
+#   python -m mems.compare before.log after.log
+#
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+import mems.logreader
+import mems.visualization
+import mems.windows
+
+
+phases = ['stopped', 'cold_start', 'warm_up', 'warm_idle', 'warm_running']
+
+# the phases whose onsets align the runs, in the order a run reaches them
+anchor_phases = ['cold_start', 'warm_up', 'warm_idle']
+
+
+# the phase of every sample as an index into phases
+def classify_phases(t, masks, cold_start=120.0):
+    running = masks['running']
+    warm = masks['warm']
+
+    labels = np.zeros(len(t), dtype=np.int8)
+    if not running.any():
+        return labels
+
+    started = t[np.argmax(running)]
+    cold = running & ~warm
+
+    labels[cold & (t < started + cold_start)] = phases.index('cold_start')
+    labels[cold & (t >= started + cold_start)] = phases.index('warm_up')
+    labels[warm & running] = phases.index('warm_running')
+    labels[warm & running & masks['stable_idle']] = phases.index('warm_idle')
+
+    return labels
+
+
+# the first time each phase is reached, NaN for phases never reached
+def phase_onsets(t, labels):
+    onsets = np.full(len(phases), np.nan)
+
+    for n in range(len(phases)):
+        reached = np.flatnonzero(labels == n)
+        if len(reached):
+            onsets[n] = t[reached[0]]
+
+    return onsets
+
+
+# map times of the first run to times of the second. between matching
+# anchors the map is linear, before the first and after the last the runs
+# keep the same pace
+def time_map(t, anchors, other_anchors):
+    if len(anchors) == 0:
+        return t.astype(np.float64)
+
+    mapped = np.interp(t, anchors, other_anchors)
+    mapped = np.where(t < anchors[0], t - anchors[0] + other_anchors[0], mapped)
+    return np.where(t > anchors[-1], t - anchors[-1] + other_anchors[-1], mapped)
+
+
+# the weights that interpolate samples at times t onto grid, computed once
+# and applied to every channel. outside the samples the weights are NaN
+def interpolation_weights(t, grid):
+    if len(t) < 2:
+        return np.zeros(len(grid), dtype=np.int64), np.zeros(len(grid), dtype=np.int64), np.full(len(grid), np.nan)
+
+    upper = np.clip(np.searchsorted(t, grid, side='right'), 1, len(t) - 1)
+    lower = upper - 1
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        span = t[upper] - t[lower]
+        weight = np.where(span > 0, (grid - t[lower]) / span, 0.0)
+
+    weight = np.clip(weight, 0.0, 1.0)
+    weight[(grid < t[0]) | (grid > t[-1])] = np.nan
+
+    return lower, upper, weight
+
+
+# linear for measurements, the previous sample for switches, flags and
+# fault codes, whose values are not on a scale. out is filled when given
+def interpolate(values, lower, upper, weight, hold=False, out=None):
+    result = np.empty(len(weight)) if out is None else out
+
+    if hold:
+        np.copyto(result, np.where(weight < 1.0, values[lower], values[upper]))
+        result[np.isnan(weight)] = np.nan
+    else:
+        # a NaN weight carries through to the result
+        result[:] = values[lower]
+        step = values[upper].astype(np.float64)
+        step -= result
+        step *= weight
+        result += step
+
+    return result
+
+
+def read_log(filepath, dtype_policy='compact'):
+    lr = mems.logreader.LogReader(dtype_policy=dtype_policy)
+    extension = os.path.splitext(filepath)[1].lower()
+
+    if extension == '.csv':
+        lr.read_memsscanfile(filepath)
+    elif extension == '.memsbin':
+        lr.read_binaryfile(filepath)
+    else:
+        lr.read_logfile(filepath)
+
+    return lr
+
+
+class RunComparison(object):
+    # before and after are LogReaders with a loaded log. period is the
+    # spacing of the common time grid in seconds, align is 'phase' or
+    # 'start' to only line up the engine starts
+    def __init__(self, before, after, period=1.0, align='phase', columns=None, cold_start=120.0, names=('before', 'after')):
+        if align not in ['phase', 'start']:
+            raise ValueError(f'unknown alignment {align}, use phase or start')
+
+        self.runs = [before, after]
+        self.names = list(names)
+        self.period = period
+        self.align = align
+        self.cold_start = cold_start
+
+        frames = [run.frame for run in self.runs]
+        shared = [c for c in frames[0].columns if c in frames[1].columns and c != 'timestamp']
+        self.columns = [c for c in (columns or shared) if c in shared]
+
+        self.times = [mems.windows.as_seconds(f['timestamp'].to_numpy()) for f in frames]
+        self.labels = [self.classify(run, frame, t) for run, frame, t in zip(self.runs, frames, self.times)]
+        self.onsets = [phase_onsets(t, labels) for t, labels in zip(self.times, self.labels)]
+
+        self.anchors = self.find_anchors()
+        self.resample(frames)
+
+        self.phase_summary = self.summarise_phases(frames)
+        self.channel_deltas = self.compare_channels()
+        self.fault_diff = self.compare_faults()
+
+
+    def classify(self, run, frame, t):
+        def column(name):
+            return frame[name].to_numpy(dtype=np.float64) if name in frame.columns else None
+
+        masks = run.diagnostics.rules.subset_masks(column, len(frame))
+        return classify_phases(t, masks, self.cold_start)
+
+
+    # matching (before, after) times, the onsets of the phases both runs
+    # reach in the same order, or the engine starts
+    def find_anchors(self):
+        anchors = []
+
+        if self.align == 'start':
+            starts = [np.nanmin(onsets[1:]) if not np.isnan(onsets[1:]).all() else np.nan for onsets in self.onsets]
+            if not np.isnan(starts).any():
+                anchors.append(starts)
+        else:
+            for name in anchor_phases:
+                n = phases.index(name)
+                before, after = self.onsets[0][n], self.onsets[1][n]
+
+                if np.isnan(before) or np.isnan(after):
+                    continue
+                if anchors and (before <= anchors[-1][0] or after <= anchors[-1][1]):
+                    continue
+
+                anchors.append((before, after))
+
+        return np.array(anchors, dtype=np.float64).reshape(-1, 2)
+
+
+    # both runs on the grid of the first run's time, the second run's time
+    # mapped through the anchors
+    def resample(self, frames):
+        t0, t1 = self.times
+        self.grid = np.arange(0.0, t0[-1] + self.period / 2, self.period) if len(t0) else np.zeros(0)
+        mapped = time_map(self.grid, self.anchors[:, 0], self.anchors[:, 1])
+
+        conversions = self.runs[0].rosco._conversions
+        hold = [conversions.get(c, {}).get('unit', '') == '' for c in self.columns]
+        index = pd.Index(self.grid, name='time')
+        aligned = []
+        covered = np.ones(len(self.grid), dtype=bool)
+
+        for frame, t, at in zip(frames, [t0, t1], [self.grid, mapped]):
+            lower, upper, weight = interpolation_weights(t, at)
+            covered &= ~np.isnan(weight)
+
+            # one block, filled a channel at a time
+            values = np.empty((len(self.columns), len(self.grid)))
+            for n, c in enumerate(self.columns):
+                interpolate(frame[c].to_numpy(), lower, upper, weight, hold[n], out=values[n])
+
+            aligned.append(pd.DataFrame(values.T, index=index, columns=self.columns, copy=False))
+
+        self.aligned = aligned
+        self.mapped_time = mapped
+        self.covered = covered
+
+
+    # the second run less the first on the grid, built when asked for
+    @property
+    def deltas(self):
+        return self.aligned[1] - self.aligned[0]
+
+
+    # seconds spent in each phase and the mean of every channel in it
+    def summarise_phases(self, frames):
+        rows = []
+
+        for name, frame, t, labels, onsets in zip(self.names, frames, self.times, self.labels, self.onsets):
+            # each sample lasts until the next, the last one a typical period
+            period = np.median(np.diff(t)) if len(t) > 1 else 0.0
+            dt = np.diff(t, append=t[-1] + period) if len(t) else t
+
+            for n, phase in enumerate(phases):
+                selected = labels == n
+                row = {'run': name, 'phase': phase, 'onset': onsets[n],
+                       'seconds': float(dt[selected].sum()), 'samples': int(selected.sum())}
+
+                for c in self.columns:
+                    values = frame[c].to_numpy(dtype=np.float64)[selected]
+                    row[c] = values.mean() if len(values) else np.nan
+
+                rows.append(row)
+
+        return pd.DataFrame(rows)
+
+
+    # per channel means of both runs and the differences, over the part of
+    # the grid that both runs cover. range is the larger of the two runs'
+    def compare_channels(self):
+        blocks = [a.to_numpy() for a in self.aligned]
+        covered = slice(None) if self.covered.all() else self.covered
+        rows = []
+
+        with np.errstate(invalid='ignore'):
+            for n in range(len(self.columns)):
+                before, after = blocks[0][:, n][covered], blocks[1][:, n][covered]
+                deltas = after - before
+                absolute = np.abs(deltas)
+
+                rows.append([before.mean(), after.mean(), deltas.mean(), absolute.mean(), absolute.max(initial=0.0),
+                             np.sqrt(np.dot(deltas, deltas) / len(deltas)) if len(deltas) else np.nan,
+                             max(np.ptp(before), np.ptp(after)) if len(deltas) else 0.0])
+
+        columns = [f'{self.names[0]}_mean', f'{self.names[1]}_mean', 'mean_delta', 'mean_abs_delta', 'max_abs_delta', 'rms_delta', 'range']
+        return pd.DataFrame(rows, columns=columns, index=pd.Index(self.columns, name='channel'))
+
+
+    def compare_faults(self):
+        faults = []
+        for run in self.runs:
+            if not run.diagnostics.aggregates:
+                run.diagnostics.analyse_run(run.frame)
+            faults.append(list(run.diagnostics.faults))
+
+        return {'fixed': [f for f in faults[0] if f not in faults[1]],
+                'new': [f for f in faults[1] if f not in faults[0]],
+                'unchanged': [f for f in faults[0] if f in faults[1]]}
+
+
+    # the phases of both runs next to each other
+    def phase_table(self):
+        table = self.phase_summary.pivot(index='phase', columns='run', values='seconds').reindex(phases)
+        return table[self.names]
+
+
+    def create_report(self, channels=10):
+        before, after = self.names
+        width = max(12, len(before) + 6, len(after) + 6)
+        lines = [f'Comparison of {before} and {after}, aligned by {self.align}', '']
+
+        lines.append(f'{"phase":<14}{before + " (s)":>{width}}{after + " (s)":>{width}}')
+        for phase, row in self.phase_table().iterrows():
+            lines.append(f'{phase:<14}{row[before]:>{width}.0f}{row[after]:>{width}.0f}')
+        lines.append('')
+
+        for label, key in [('fixed', 'fixed'), ('new', 'new'), ('still present', 'unchanged')]:
+            lines.append(f'faults {label}: {", ".join(self.fault_diff[key]) or "none"}')
+        lines.append('')
+
+        # the channels that changed most relative to their range
+        table = self.channel_deltas
+        ranked = (table['mean_abs_delta'] / table['range'].replace(0, np.nan)).dropna().sort_values(ascending=False).index[:channels]
+
+        lines.append(f'{"channel":<40}{before:>{width}}{after:>{width}}{"delta":>12}{"max |delta|":>14}')
+        for c in ranked:
+            row = table.loc[c]
+            lines.append(f'{c:<40}{row[f"{before}_mean"]:>{width}.2f}{row[f"{after}_mean"]:>{width}.2f}'
+                         f'{row["mean_delta"]:>12.2f}{row["max_abs_delta"]:>14.2f}')
+
+        return '\n'.join(lines)
+
+
+    def create_graph(self, dimensions, title='', y_axis_label='', max_points=4000, method='lttb'):
+        return mems.visualization.create_comparison_graph(self, dimensions, title, y_axis_label, max_points, method)
+
+
+    def display_graph(self, dimensions, title='', y_axis_label='', max_points=4000, method='lttb'):
+        from plotly.offline import iplot
+
+        return iplot(self.create_graph(dimensions, title, y_axis_label, max_points, method))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m mems.compare', description='Compare two MEMS logs')
+    parser.add_argument('before', help='.log, .csv or .memsbin log')
+    parser.add_argument('after', help='.log, .csv or .memsbin log')
+    parser.add_argument('--align', default='phase', choices=['phase', 'start'], help='line up the phases or only the engine starts')
+    parser.add_argument('--period', type=float, default=1.0, help='seconds between the compared samples')
+    parser.add_argument('--channels', type=int, default=10, help='channels listed in the report')
+    parser.add_argument('-o', '--output', help='write the aligned runs and deltas to this .csv or .parquet file')
+    args = parser.parse_args(argv)
+
+    names = [os.path.basename(args.before), os.path.basename(args.after)]
+    if names[0] == names[1]:
+        names = ['before', 'after']
+
+    comparison = RunComparison(read_log(args.before), read_log(args.after), args.period, args.align, names=names)
+    print(comparison.create_report(args.channels))
+
+    if args.output:
+        df = pd.concat([comparison.aligned[0].add_prefix(f'{names[0]}:'),
+                        comparison.aligned[1].add_prefix(f'{names[1]}:'),
+                        comparison.deltas.add_prefix('delta:')], axis=1).reset_index()
+        if args.output.lower().endswith('.parquet'):
+            df.to_parquet(args.output, index=False)
+        else:
+            df.to_csv(args.output, index=False)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
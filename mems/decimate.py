@@ -0,0 +1,113 @@
+# Reduce long series to a point budget for plotting
+#
+# Both methods return the indices of the points to keep so that the same
+# selection can be applied to the x and y values of a trace.
+#
+#  - lttb:   Largest-Triangle-Three-Buckets, keeps the visual shape of the line
+#  - minmax: the minimum and maximum of each bucket, keeps every peak and dip
+#
+import numpy as np
+
+
+def as_numeric(x):
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype('datetime64[ns]').astype(np.int64).astype(np.float64)
+    return x.astype(np.float64)
+
+
+def lttb_indices(x, y, max_points):
+    n = len(y)
+    if max_points >= n or max_points < 3:
+        return np.arange(n)
+
+    x = as_numeric(x)
+    y = np.nan_to_num(np.asarray(y, dtype=np.float64))
+
+    # the first and last points are always kept, the rest are split evenly
+    # into max_points - 2 buckets
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    previous = 0
+    for b in range(max_points - 2):
+        start, end = edges[b], edges[b + 1]
+
+        # average of the next bucket, or the last point for the final bucket
+        if b + 2 < len(edges):
+            next_start, next_end = edges[b + 1], edges[b + 2]
+            average_x = x[next_start:next_end].mean()
+            average_y = y[next_start:next_end].mean()
+        else:
+            average_x = x[n - 1]
+            average_y = y[n - 1]
+
+        # the point forming the largest triangle with the previous selection
+        # and the next bucket's average
+        area = np.abs((x[previous] - average_x) * (y[start:end] - y[previous]) -
+                      (x[previous] - x[start:end]) * (average_y - y[previous]))
+
+        previous = start + int(np.argmax(area))
+        selected[b + 1] = previous
+
+    return selected
+
+
+def minmax_indices(x, y, max_points):
+    n = len(y)
+    if max_points >= n or max_points < 2:
+        return np.arange(n)
+
+    y = np.asarray(y, dtype=np.float64)
+    buckets = max_points // 2
+    size = int(np.ceil(n / buckets))
+
+    padded = np.full(buckets * size, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(buckets, size)
+
+    valid = ~np.isnan(padded).all(axis=1)
+    padded = padded[valid]
+    offsets = np.flatnonzero(valid) * size
+
+    low = offsets + np.nanargmin(padded, axis=1)
+    high = offsets + np.nanargmax(padded, axis=1)
+
+    return np.unique(np.concatenate([low, high, [0, n - 1]]))
+
+
+methods = {'lttb': lttb_indices, 'minmax': minmax_indices}
+
+
+def decimate_indices(x, y, max_points, method='lttb'):
+    if method is None or max_points is None:
+        return np.arange(len(y))
+
+    return methods[method](x, y, max_points)
+
+
+# counts of each bin computed with numpy, so only the bins are sent to plotly
+def histogram(values, bins=50):
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    return np.histogram(values, bins=bins)
+
+
+# the statistics of a box plot, with Tukey fences at 1.5 times the
+# interquartile range
+def box_statistics(values):
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+
+    if len(values) == 0:
+        return None
+
+    q1, median, q3 = np.percentile(values, [25, 50, 75])
+    iqr = q3 - q1
+    inside = values[(values >= q1 - 1.5 * iqr) & (values <= q3 + 1.5 * iqr)]
+
+    return {'q1': q1, 'median': median, 'q3': q3,
+            'lowerfence': inside.min(), 'upperfence': inside.max(),
+            'mean': values.mean()}
@@ -0,0 +1,303 @@
+# Index of the events of a run, built when a log is loaded
+#
+# Every detector works on whole channels with numpy edge detection, the
+# samples where a condition starts and stops holding, so building the index
+# costs a few passes over the channels it reads:
+#
+#  - cranking:          the engine turning below running speed, followed by
+#                       running (cranking) or not (cranking_no_start)
+#  - throttle_blip:     the throttle opened well past closed and shut again
+#                       within blip_seconds
+#  - closed_loop,
+#    open_loop:         changes of loop_indicator
+#  - fault_set,
+#    fault_cleared:     a bit of a fault code channel changing
+#  - battery_dip:       the battery voltage, with the engine turning,
+#                       falling dip_volts below its median while running
+#
+# Events keep the sample offsets of their first and last sample, so the
+# samples around an event are a slice of the loaded log.
+#
+#   lr.events.filter('cranking')
+#   lr.event_window(lr.events[0], before=10, after=30)
+#   lr.display_event_graph(lr.events.filter('battery_dip')[0])
+#
+#   python -m mems.events run.log --type throttle_blip fault_set
+#
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+import mems.windows
+
+
+event_types = ['cranking', 'cranking_no_start', 'throttle_blip', 'closed_loop', 'open_loop',
+               'fault_set', 'fault_cleared', 'battery_dip']
+
+event_columns = ['type', 'channel', 'bit', 'start', 'end', 'timestamp', 'end_timestamp', 'start_time', 'end_time', 'duration', 'value']
+
+# the fault code channels, each bit a fault
+fault_channels = ['coolant_temp_inlet_air_temp_sensor_fault', 'fuel_pump_throttle_pot_circuit_fault', 'fault_codes',
+                  'dtc2', 'dtc3', 'dtc4', 'dtc5']
+
+default_settings = {
+    'running_speed': 400,
+    'blip_degrees': 10.0,
+    'blip_seconds': 5.0,
+    'dip_volts': 1.0,
+}
+
+
+# the (start, end) sample offsets of every run of True in mask, end is one
+# past the last sample of the run
+def runs(mask):
+    edges = np.diff(np.r_[0, mask.astype(np.int8), 0])
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+# ufunc reduced over each run, from its start up to its end
+def reduce_runs(ufunc, values, starts, ends):
+    if len(starts) == 0:
+        return np.zeros(0, dtype=values.dtype)
+
+    bounds = np.c_[starts, ends].ravel()
+    if bounds[-1] == len(values):
+        bounds = bounds[:-1]
+
+    return ufunc.reduceat(values, bounds)[::2]
+
+
+def interval_events(kind, channel, starts, ends, value):
+    return {'type': np.full(len(starts), kind, dtype=object), 'channel': channel, 'bit': -1,
+            'start': starts, 'end': ends, 'value': value}
+
+
+# turning below running speed from standstill, the engine slowing down when
+# it is switched off is not cranking
+def detect_cranking(engine_speed, settings):
+    turning = (engine_speed > 0) & (engine_speed < settings['running_speed'])
+    starts, ends = runs(turning)
+
+    from_rest = (starts == 0) | (engine_speed[np.maximum(starts - 1, 0)] == 0)
+    starts, ends = starts[from_rest], ends[from_rest]
+
+    # the engine started if the sample after cranking is running
+    after = engine_speed[np.minimum(ends, len(engine_speed) - 1)]
+    started = (ends < len(engine_speed)) & (after >= settings['running_speed'])
+
+    events = interval_events('cranking', 'engine_speed', starts, ends, reduce_runs(np.maximum, engine_speed, starts, ends))
+    events['type'][~started] = 'cranking_no_start'
+    return events
+
+
+# the closed throttle is taken as the 5th percentile of the angle, which a
+# run spends most of its time at
+def detect_throttle_blips(throttle_angle, t, settings):
+    closed = np.nanquantile(throttle_angle, 0.05)
+    starts, ends = runs(throttle_angle >= closed + settings['blip_degrees'])
+
+    short = (t[ends - 1] - t[starts]) <= settings['blip_seconds']
+    starts, ends = starts[short], ends[short]
+
+    return interval_events('throttle_blip', 'throttle_angle', starts, ends, reduce_runs(np.maximum, throttle_angle, starts, ends))
+
+
+def change_offsets(values):
+    return np.flatnonzero(values[1:] != values[:-1]) + 1
+
+
+def detect_loop_changes(loop_indicator):
+    changes = change_offsets(loop_indicator)
+    closed = loop_indicator[changes] != 0
+
+    events = interval_events('closed_loop', 'loop_indicator', changes, changes + 1, loop_indicator[changes])
+    events['type'][~closed] = 'open_loop'
+    return events
+
+
+# an event for every bit that changes, value is the new value of the channel
+def detect_fault_changes(channel, values):
+    codes = np.nan_to_num(values).astype(np.int64)
+    changes = change_offsets(codes)
+    flipped = codes[changes] ^ codes[changes - 1]
+
+    events = []
+    for bit in range(int(flipped.max()).bit_length() if len(flipped) else 0):
+        selected = np.flatnonzero((flipped >> bit) & 1)
+        offsets = changes[selected]
+
+        bit_events = interval_events('fault_set', channel, offsets, offsets + 1, codes[offsets])
+        bit_events['type'][((codes[offsets] >> bit) & 1) == 0] = 'fault_cleared'
+        bit_events['bit'] = bit
+        events.append(bit_events)
+
+    return events
+
+
+# the voltage of a battery at rest is lower than when charging, so only the
+# samples with the engine turning are compared
+def detect_battery_dips(battery_voltage, engine_speed, settings):
+    if engine_speed is None:
+        turning = np.ones(len(battery_voltage), dtype=bool)
+        running = turning
+    else:
+        turning = engine_speed > 0
+        running = engine_speed >= settings['running_speed']
+
+    usual = np.nanmedian(battery_voltage[running]) if running.any() else np.nanmedian(battery_voltage)
+
+    starts, ends = runs(turning & (battery_voltage < usual - settings['dip_volts']))
+    return interval_events('battery_dip', 'battery_voltage', starts, ends, reduce_runs(np.minimum, battery_voltage, starts, ends))
+
+
+# the events of a loaded log, a DataFrame or mems.compact.CompactFrame.
+# settings override default_settings
+def detect_events(frame, settings=None):
+    settings = dict(default_settings, **(settings or {}))
+
+    def column(name):
+        return frame[name].to_numpy(dtype=np.float64) if name in frame.columns else None
+
+    length = len(frame)
+    timestamps = frame['timestamp'].to_numpy() if 'timestamp' in frame.columns else np.arange(length)
+    t = mems.windows.as_seconds(timestamps)
+
+    if length == 0:
+        return EventIndex(t=t)
+
+    engine_speed = column('engine_speed')
+    throttle_angle = column('throttle_angle')
+    loop_indicator = column('loop_indicator')
+    battery_voltage = column('battery_voltage')
+
+    found = []
+    if engine_speed is not None:
+        found.append(detect_cranking(engine_speed, settings))
+    if throttle_angle is not None:
+        found.append(detect_throttle_blips(throttle_angle, t, settings))
+    if loop_indicator is not None:
+        found.append(detect_loop_changes(loop_indicator))
+    for channel in fault_channels:
+        values = column(channel)
+        if values is not None:
+            found.extend(detect_fault_changes(channel, values))
+    if battery_voltage is not None:
+        found.append(detect_battery_dips(battery_voltage, engine_speed, settings))
+
+    events = pd.concat([pd.DataFrame(f) for f in found if len(f['start'])] or [pd.DataFrame(columns=event_columns)],
+                       ignore_index=True)
+
+    start = events['start'].to_numpy(dtype=np.int64)
+    last = events['end'].to_numpy(dtype=np.int64) - 1
+    events['timestamp'] = timestamps[start]
+    events['end_timestamp'] = timestamps[last]
+    events['start_time'] = t[start]
+    events['end_time'] = t[last]
+    events['duration'] = t[last] - t[start]
+
+    events['order'] = events['type'].map(event_types.index)
+    events = events.sort_values(['start', 'order'], kind='stable').drop(columns='order').reset_index(drop=True)
+
+    return EventIndex(events[event_columns], t)
+
+
+class EventIndex(object):
+    # events has a row for every event, see event_columns. t is the time of
+    # every sample of the log in seconds from the first
+    def __init__(self, events=None, t=None):
+        self.events = events if events is not None else pd.DataFrame(columns=event_columns)
+        self.t = t if t is not None else np.zeros(0)
+
+
+    def __len__(self):
+        return len(self.events)
+
+
+    def __getitem__(self, n):
+        return self.events.iloc[n]
+
+
+    def __iter__(self):
+        return (row for _, row in self.events.iterrows())
+
+
+    # the events of the listed types, of a channel and that overlap the
+    # seconds from start to end
+    def filter(self, types=None, channel=None, start=None, end=None):
+        events = self.events
+        selected = np.ones(len(events), dtype=bool)
+
+        if types is not None:
+            types = [types] if isinstance(types, str) else list(types)
+            unknown = [kind for kind in types if kind not in event_types]
+            if unknown:
+                raise ValueError(f'unknown event types {", ".join(unknown)}, use {", ".join(event_types)}')
+            selected &= events['type'].isin(types).to_numpy()
+        if channel is not None:
+            selected &= (events['channel'] == channel).to_numpy()
+        if start is not None:
+            selected &= (events['end_time'] >= start).to_numpy()
+        if end is not None:
+            selected &= (events['start_time'] <= end).to_numpy()
+
+        return EventIndex(events[selected].reset_index(drop=True), self.t)
+
+
+    # the number of events of each type
+    def counts(self):
+        return self.events['type'].value_counts().reindex(event_types, fill_value=0)
+
+
+    # the sample offsets [first, last) from before seconds ahead of an event
+    # to after seconds past its end
+    def window(self, event, before=10.0, after=10.0):
+        if not isinstance(event, pd.Series):
+            event = self[event]
+
+        first = np.searchsorted(self.t, event['start_time'] - before, side='left')
+        last = np.searchsorted(self.t, event['end_time'] + after, side='right')
+        return int(first), int(last)
+
+
+    def create_report(self):
+        if len(self.events) == 0:
+            return 'No events'
+
+        lines = [f'{"time (s)":>10}{"duration":>10}  {"event":<20}{"channel":<48}{"value":>10}']
+        for event in self:
+            channel = event['channel'] if event['bit'] < 0 else f'{event["channel"]} bit {event["bit"]}'
+            lines.append(f'{event["start_time"]:>10.1f}{event["duration"]:>10.1f}  {event["type"]:<20}{channel:<48}{event["value"]:>10.2f}')
+
+        return '\n'.join(lines)
+
+
+def main(argv=None):
+    import mems.logreader
+
+    parser = argparse.ArgumentParser(prog='python -m mems.events', description='List the events of a MEMS log')
+    parser.add_argument('log', help='.log, .csv or .memsbin log')
+    parser.add_argument('--type', nargs='+', choices=event_types, help='only list these events')
+    parser.add_argument('--start', type=float, help='seconds from the start of the log')
+    parser.add_argument('--end', type=float, help='seconds from the start of the log')
+    args = parser.parse_args(argv)
+
+    lr = mems.logreader.LogReader(dtype_policy='compact')
+    extension = os.path.splitext(args.log)[1].lower()
+
+    if extension == '.csv':
+        lr.read_memsscanfile(args.log)
+    elif extension == '.memsbin':
+        lr.read_binaryfile(args.log)
+    else:
+        lr.read_logfile(args.log)
+
+    events = lr.events.filter(args.type, start=args.start, end=args.end)
+    print(events.create_report())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,179 @@
+# Export of loaded logs to Excel, Parquet and Feather
+#
+# Excel workbooks are written with openpyxl in write-only mode, the rows are
+# streamed from the columns a block at a time instead of building the whole
+# sheet in memory. A sheet holds at most 1,048,576 rows including its header,
+# longer logs continue on further sheets. An optional summary sheet holds the
+# ECU version, the fault report and the statistics of every channel.
+#
+# Parquet and Feather are much faster to write and read back. Parquet files
+# are compressed and dictionary encode the channels with few distinct values,
+# such as the switches and fault bits.
+#
+#   python -m mems.export run.log -o run.xlsx
+#   python -m mems.export run.csv -o run.parquet --compression zstd
+#
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+
+excel_max_rows = 1048576
+
+formats = {'.xlsx': 'excel', '.parquet': 'parquet', '.feather': 'feather', '.arrow': 'feather'}
+
+
+# the ECU version, faults, fault report and channel statistics of a loaded
+# log, the diagnostics are run if they have not been already
+def create_summary(lr):
+    if not lr.diagnostics.aggregates:
+        lr.diagnostics.analyse_run(lr.df)
+
+    statistics = lr.dimension_stats().drop(index='timestamp', errors='ignore')
+    units = lr.get_units()
+    statistics.insert(0, 'unit', [units.get(c, '') for c in statistics.index])
+
+    return {'source': lr.filepath,
+            'ecu_version': lr.rosco.get_version(lr.version) or lr.version,
+            'samples': len(lr.df),
+            'faults': list(lr.diagnostics.faults),
+            'report': lr.diagnostics.create_analysis_report(),
+            'statistics': statistics}
+
+
+# plain python values for openpyxl, NaN becomes an empty cell
+def cell_values(series):
+    if series.dtype.kind == 'f':
+        values = series.to_numpy(dtype=object)
+        values[np.isnan(series.to_numpy())] = None
+        return values.tolist()
+
+    if series.dtype.kind == 'M':
+        return series.dt.to_pydatetime().tolist()
+
+    return series.tolist()
+
+
+def write_summary_sheet(workbook, summary):
+    sheet = workbook.create_sheet('Summary')
+
+    sheet.append(['Source', summary.get('source', '')])
+    sheet.append(['ECU version', summary.get('ecu_version', '')])
+    sheet.append(['Samples', summary.get('samples', 0)])
+    sheet.append(['Faults', ', '.join(summary.get('faults', [])) or 'No faults'])
+    sheet.append([])
+
+    for line in summary.get('report', '').splitlines():
+        sheet.append([line])
+    sheet.append([])
+
+    statistics = summary.get('statistics')
+    if statistics is not None:
+        sheet.append(['channel'] + list(statistics.columns))
+        for channel, row in statistics.iterrows():
+            sheet.append([channel] + [None if isinstance(v, float) and np.isnan(v) else v for v in row.tolist()])
+
+
+# write a log to an Excel workbook, returns the names of the data sheets
+def export_excel(df, filepath, summary=None, sheet_name='Log Data', max_rows=excel_max_rows, block_rows=10000):
+    import openpyxl
+
+    workbook = openpyxl.Workbook(write_only=True)
+
+    if summary is not None:
+        write_summary_sheet(workbook, summary)
+
+    rows_per_sheet = max_rows - 1
+    header = [str(c) for c in df.columns]
+    sheets = []
+
+    for part, start in enumerate(range(0, max(len(df), 1), rows_per_sheet)):
+        name = sheet_name if part == 0 else f'{sheet_name} {part + 1}'
+        sheet = workbook.create_sheet(name)
+        sheet.append(header)
+        sheets.append(name)
+
+        stop = min(start + rows_per_sheet, len(df))
+        for block in range(start, stop, block_rows):
+            chunk = df.iloc[block:min(block + block_rows, stop)]
+            for row in zip(*[cell_values(chunk[c]) for c in chunk.columns]):
+                sheet.append(row)
+
+    workbook.save(filepath)
+    return sheets
+
+
+# channels with at most max_distinct values, which dictionary encoding stores
+# as small indices. the others are left plain, where a dictionary would only
+# be built and thrown away
+def dictionary_columns(df, max_distinct=256):
+    columns = []
+
+    for c in df.columns:
+        if df[c].dtype.kind in 'iufb' and df[c].nunique(dropna=False) <= max_distinct:
+            columns.append(str(c))
+
+    return columns
+
+
+def export_parquet(df, filepath, compression='zstd', dictionary=True):
+    use_dictionary = dictionary_columns(df) if dictionary else False
+    df.to_parquet(filepath, engine='pyarrow', index=False, compression=compression, use_dictionary=use_dictionary)
+
+
+# feather keeps the dtypes of the columns, with dictionary=True the low
+# cardinality channels are written as, and read back as, categoricals
+def export_feather(df, filepath, compression='zstd', dictionary=False):
+    df = df.reset_index(drop=True)
+
+    if dictionary:
+        df = df.astype({c: 'category' for c in dictionary_columns(df)})
+
+    df.to_feather(filepath, compression=compression)
+
+
+def export(df, filepath, summary=None, compression='zstd'):
+    fmt = formats.get(os.path.splitext(filepath)[1].lower())
+
+    if fmt == 'excel':
+        return export_excel(df, filepath, summary)
+    if fmt == 'parquet':
+        return export_parquet(df, filepath, compression)
+    if fmt == 'feather':
+        return export_feather(df, filepath, compression)
+
+    raise ValueError(f'unknown export format for {filepath}, use one of {", ".join(formats)}')
+
+
+def main(argv=None):
+    import mems.logreader
+
+    parser = argparse.ArgumentParser(prog='python -m mems.export', description='Export a MEMS log to Excel, Parquet or Feather')
+    parser.add_argument('log', help='.log, .csv or .memsbin log')
+    parser.add_argument('-o', '--output', required=True, help='.xlsx, .parquet or .feather file')
+    parser.add_argument('--compression', default='zstd', help='parquet/feather compression (zstd, lz4, snappy, none)')
+    args = parser.parse_args(argv)
+
+    lr = mems.logreader.LogReader()
+    extension = os.path.splitext(args.log)[1].lower()
+
+    if extension == '.csv':
+        lr.read_memsscanfile(args.log)
+    elif extension == '.memsbin':
+        lr.read_binaryfile(args.log)
+    else:
+        lr.read_logfile(args.log)
+
+    summary = create_summary(lr) if args.output.lower().endswith('.xlsx') else None
+    compression = None if args.compression == 'none' else args.compression
+    export(lr.df, args.output, summary, compression)
+
+    print(f'{len(lr.df)} samples written to {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,434 @@
+# Index of many logs per vehicle for trends across runs
+#
+# Each log is summarised once and stored in a SQLite database: per channel
+# count, min, mean, max, std, the median when warm and idling and a grid of
+# quantiles, the diagnostic aggregates of the fault rules and the faults
+# found. The index is keyed by vehicle and ECU version. Updating only reads
+# logs that are new or have changed since they were indexed, and trend
+# queries read the database only, never the logs.
+#
+# A log's vehicle is the name of the directory it is in unless one is given.
+# Runs are ordered by the time they were recorded, the date and time in the
+# name of the log (example-2019-05-05_17.45.csv) or else its first timestamp,
+# and the modification time of the log only when it has neither. Runs
+# recorded at the same time are ordered by path.
+#
+#   python -m mems.fleet update ./logs/mgf --db fleet.sqlite
+#   python -m mems.fleet trend --db fleet.sqlite --vehicle mgf --channel idle_air_contol_position --stat warm_idle_median --last 50
+#   python -m mems.fleet faults --db fleet.sqlite --vehicle mgf
+#
+import argparse
+import datetime
+import os
+import re
+import sqlite3
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import mems.batch
+import mems.logreader
+import mems.windows
+
+
+schema_version = 1
+
+# the date and time in a log name, 2019-05-05_17.45 or 20190505-174500
+name_stamp = re.compile(r'(\d{4})-?(\d{2})-?(\d{2})[_T -](\d{2})[.:-]?(\d{2})(?:[.:-]?(\d{2}))?')
+
+# the quantiles stored for every channel of every log
+quantile_grid = np.linspace(0.0, 1.0, 21)
+
+channel_statistics = ['count', 'min', 'mean', 'max', 'std', 'warm_idle_median']
+
+schema = '''
+create table if not exists logs (
+    id integer primary key,
+    path text unique not null,
+    vehicle text not null,
+    ecu_version text not null,
+    format text not null,
+    size integer not null,
+    mtime_ns integer not null,
+    recorded real not null,
+    samples integer,
+    duration real,
+    status text not null,
+    error text,
+    indexed real not null
+);
+create index if not exists logs_vehicle on logs (vehicle, ecu_version, recorded);
+
+create table if not exists channel_stats (
+    log_id integer not null,
+    channel text not null,
+    count integer,
+    min real,
+    mean real,
+    max real,
+    std real,
+    warm_idle_median real,
+    quantiles blob,
+    primary key (channel, log_id)
+) without rowid;
+
+create table if not exists aggregates (
+    log_id integer not null,
+    name text not null,
+    value real,
+    primary key (name, log_id)
+) without rowid;
+
+create table if not exists faults (
+    log_id integer not null,
+    fault text not null,
+    primary key (log_id, fault)
+) without rowid;
+'''
+
+
+def as_real(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+
+    return None if np.isnan(value) else value
+
+
+# the statistics of every numeric channel, one column at a time so that only
+# one float copy of a channel is held
+def channel_summaries(df, warm_idle):
+    summaries = []
+
+    for channel in df.select_dtypes(include='number').columns:
+        if channel == 'timestamp':
+            continue
+
+        values = df[channel].to_numpy(dtype=np.float64)
+        valid = ~np.isnan(values)
+        count = int(valid.sum())
+
+        if count == 0:
+            summaries.append((channel, 0, None, None, None, None, None, None))
+            continue
+
+        present = values[valid]
+        quantiles = np.quantile(present, quantile_grid)
+        idle = values[warm_idle & valid]
+
+        summaries.append((channel, count, float(quantiles[0]), float(present.mean()), float(quantiles[-1]),
+                          float(present.std()), float(np.median(idle)) if len(idle) else None,
+                          quantiles.astype(np.float64).tobytes()))
+
+    return summaries
+
+
+# seconds since the epoch of the date and time in the name of a log, as
+# written, or None
+def name_time(filepath):
+    match = name_stamp.search(os.path.basename(filepath))
+    if match is None:
+        return None
+
+    try:
+        stamp = datetime.datetime(*[int(part or 0) for part in match.groups()], tzinfo=datetime.timezone.utc)
+    except ValueError:
+        return None
+
+    return stamp.timestamp()
+
+
+# the first timestamp of a log when it is a date, mems-scan times of day
+# fall on 1900-01-01 and readmems timestamps are sample numbers
+def first_time(df):
+    if len(df) == 0 or 'timestamp' not in df.columns or not pd.api.types.is_datetime64_any_dtype(df['timestamp']):
+        return None
+
+    first = pd.Timestamp(df['timestamp'].iloc[0])
+    return None if first.year <= 1900 else first.tz_localize(None).timestamp()
+
+
+def log_result(filepath):
+    return {'path': filepath,
+            'format': mems.batch.log_format(filepath),
+            'ecu_version': '',
+            'recorded': name_time(filepath),
+            'samples': None,
+            'duration': None,
+            'status': 'ok',
+            'error': None,
+            'channels': [],
+            'aggregates': {},
+            'faults': []}
+
+
+# read and summarise one log. runs in a worker process, a failure is returned
+# as the status of the log so that it is not read again until it changes
+def summarise_log(filepath):
+    result = log_result(filepath)
+
+    try:
+        lr = mems.logreader.LogReader()
+
+        if result['format'] == 'mems-scan':
+            lr.read_memsscanfile(filepath)
+        else:
+            lr.read_logfile(filepath)
+
+        df = lr.df
+        diagnostics = lr.diagnostics
+        diagnostics.analyse_run(df)
+
+        def column(name):
+            return df[name].to_numpy(dtype=np.float64) if name in df.columns else None
+
+        masks = diagnostics.rules.subset_masks(column, len(df))
+        warm_idle = masks.get('warm', np.zeros(len(df), dtype=bool)) & masks.get('stable_idle', np.zeros(len(df), dtype=bool))
+
+        result['ecu_version'] = lr.rosco.get_version(lr.version) or lr.version or ''
+        result['recorded'] = result['recorded'] or first_time(df)
+        result['samples'] = len(df)
+        if len(df) and 'timestamp' in df.columns:
+            t = mems.windows.as_seconds(df['timestamp'])
+            result['duration'] = float(t[-1])
+        result['channels'] = channel_summaries(df, warm_idle)
+        result['aggregates'] = {name: as_real(value) for name, value in diagnostics.aggregates.items()}
+        result['faults'] = list(diagnostics.faults)
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = f'{type(e).__name__}: {e}'
+
+    return result
+
+
+class FleetIndex(object):
+    def __init__(self, filepath='fleet.sqlite'):
+        self.filepath = filepath
+        self.db = sqlite3.connect(filepath)
+        self.db.executescript(schema)
+
+        version = self.db.execute('pragma user_version').fetchone()[0]
+        if version == 0:
+            self.db.execute(f'pragma user_version = {schema_version}')
+        elif version != schema_version:
+            raise ValueError(f'{filepath} is a version {version} index, expected version {schema_version}')
+
+
+    def close(self):
+        self.db.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+    # logs not yet indexed, or changed since they were
+    def stale(self, paths):
+        known = {path: (size, mtime_ns) for path, size, mtime_ns in self.db.execute('select path, size, mtime_ns from logs')}
+        stale = []
+
+        for path in paths:
+            stat = os.stat(path)
+            if known.get(os.path.abspath(path)) != (stat.st_size, stat.st_mtime_ns):
+                stale.append(path)
+
+        return stale
+
+
+    # index the new and changed logs of a directory, or a list of logs. the
+    # vehicle defaults to the name of each log's directory. every log is read
+    # in a process of its own and stored as it finishes, a log that crashes
+    # its process or runs past timeout seconds is stored as failed. returns
+    # the number of logs read
+    def update(self, source, vehicle=None, workers=None, timeout=None):
+        paths = mems.batch.find_logs(source) if isinstance(source, str) else list(source)
+        stale = self.stale(paths)
+
+        for path, result, error, status in mems.batch.run_isolated(summarise_log, stale, workers, timeout):
+            if result is None:
+                # the worker died or was killed before returning
+                result = dict(log_result(path), status=status, error=error)
+            self.store(result, vehicle)
+
+        return len(stale)
+
+
+    def store(self, result, vehicle=None):
+        path = os.path.abspath(result['path'])
+        stat = os.stat(path)
+        vehicle = vehicle or os.path.basename(os.path.dirname(path))
+
+        with self.db:
+            self.remove(path)
+
+            log_id = self.db.execute(
+                'insert into logs (path, vehicle, ecu_version, format, size, mtime_ns, recorded, samples, duration, status, error, indexed) '
+                'values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (path, vehicle, result['ecu_version'], result['format'], stat.st_size, stat.st_mtime_ns,
+                 result['recorded'] or stat.st_mtime, result['samples'], result['duration'], result['status'], result['error'],
+                 time.time())).lastrowid
+
+            self.db.executemany('insert into channel_stats values (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                [(log_id,) + summary for summary in result['channels']])
+            self.db.executemany('insert into aggregates values (?, ?, ?)',
+                                [(log_id, name, value) for name, value in result['aggregates'].items()])
+            self.db.executemany('insert into faults values (?, ?)',
+                                [(log_id, fault) for fault in result['faults']])
+
+
+    def remove(self, path):
+        row = self.db.execute('select id from logs where path = ?', (path,)).fetchone()
+        if row is None:
+            return
+
+        for table in ['channel_stats', 'aggregates', 'faults']:
+            self.db.execute(f'delete from {table} where log_id = ?', row)
+        self.db.execute('delete from logs where id = ?', row)
+
+
+    def vehicles(self):
+        return pd.read_sql_query(
+            'select vehicle, ecu_version, count(*) as runs, min(recorded) as first, max(recorded) as last '
+            'from logs where status = \'ok\' group by vehicle, ecu_version order by vehicle, ecu_version', self.db).assign(
+                first=lambda df: pd.to_datetime(df['first'], unit='s'), last=lambda df: pd.to_datetime(df['last'], unit='s'))
+
+
+    def logs(self, vehicle=None, ecu_version=None):
+        where, parameters = self.log_filter(vehicle, ecu_version)
+        df = pd.read_sql_query(f'select * from logs l {where} order by recorded, path', self.db, params=parameters)
+        df['recorded'] = pd.to_datetime(df['recorded'], unit='s')
+        return df
+
+
+    def log_filter(self, vehicle=None, ecu_version=None):
+        conditions = ['l.status = \'ok\'']
+        parameters = []
+
+        if vehicle is not None:
+            conditions.append('l.vehicle = ?')
+            parameters.append(vehicle)
+        if ecu_version is not None:
+            conditions.append('l.ecu_version = ?')
+            parameters.append(ecu_version)
+
+        return 'where ' + ' and '.join(conditions), parameters
+
+
+    # a statistic of a channel over the last runs of a vehicle, oldest first
+    def trend(self, vehicle, channel, stat='mean', last=None, ecu_version=None):
+        if stat not in channel_statistics:
+            raise ValueError(f'unknown statistic {stat}, use one of {", ".join(channel_statistics)}')
+
+        where, parameters = self.log_filter(vehicle, ecu_version)
+        return self.query_trend(
+            f'select l.recorded, l.path, l.ecu_version, s.{stat} as value from channel_stats s '
+            f'join logs l on l.id = s.log_id {where} and s.channel = ?', parameters + [channel], last)
+
+
+    # a quantile of a channel over the last runs, interpolated between the
+    # stored quantiles
+    def quantile_trend(self, vehicle, channel, q, last=None, ecu_version=None):
+        where, parameters = self.log_filter(vehicle, ecu_version)
+        df = self.query_trend(
+            f'select l.recorded, l.path, l.ecu_version, s.quantiles as value from channel_stats s '
+            f'join logs l on l.id = s.log_id {where} and s.channel = ?', parameters + [channel], last)
+
+        df['value'] = [np.interp(q, quantile_grid, np.frombuffer(b, dtype=np.float64)) if b is not None else np.nan
+                       for b in df['value']]
+        return df
+
+
+    # a diagnostic aggregate, such as stable_idle_air_control_median, over
+    # the last runs
+    def aggregate_trend(self, vehicle, name, last=None, ecu_version=None):
+        where, parameters = self.log_filter(vehicle, ecu_version)
+        return self.query_trend(
+            f'select l.recorded, l.path, l.ecu_version, a.value from aggregates a '
+            f'join logs l on l.id = a.log_id {where} and a.name = ?', parameters + [name], last)
+
+
+    def query_trend(self, query, parameters, last=None):
+        query = query + ' order by l.recorded desc, l.path desc'
+        if last is not None:
+            query = query + ' limit ?'
+            parameters = parameters + [int(last)]
+
+        df = pd.read_sql_query(query, self.db, params=parameters).iloc[::-1].reset_index(drop=True)
+        df['recorded'] = pd.to_datetime(df['recorded'], unit='s')
+        return df
+
+
+    # how many of the last runs reported each fault
+    def fault_counts(self, vehicle=None, last=None, ecu_version=None):
+        where, parameters = self.log_filter(vehicle, ecu_version)
+        limit = '' if last is None else ' limit ?'
+
+        return pd.read_sql_query(
+            f'select f.fault, count(*) as runs, max(l.recorded) as last_seen from faults f '
+            f'join (select * from logs l {where} order by l.recorded desc, l.path desc{limit}) l on l.id = f.log_id '
+            f'group by f.fault order by runs desc, f.fault', self.db,
+            params=parameters + ([] if last is None else [int(last)])).assign(
+                last_seen=lambda df: pd.to_datetime(df['last_seen'], unit='s'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m mems.fleet', description='Index MEMS logs by vehicle and query trends')
+    parser.add_argument('--db', default='fleet.sqlite', help='index database')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    update = commands.add_parser('update', help='index new and changed logs')
+    update.add_argument('directory', help='directory searched recursively for .log and .csv files')
+    update.add_argument('--vehicle', help='vehicle of every log (default: the directory of each log)')
+    update.add_argument('-w', '--workers', type=int, default=None, help='worker processes (default: all cores)')
+    update.add_argument('-t', '--timeout', type=float, default=300, help='seconds allowed per log')
+
+    commands.add_parser('vehicles', help='list the vehicles and ECU versions indexed')
+
+    trend = commands.add_parser('trend', help='a channel statistic over the last runs')
+    trend.add_argument('--vehicle', required=True)
+    trend.add_argument('--ecu-version')
+    trend.add_argument('--channel', help='channel, not needed for an aggregate')
+    trend.add_argument('--stat', default='mean', help=f'{", ".join(channel_statistics)}, qNN for a quantile or an aggregate name')
+    trend.add_argument('--last', type=int, help='number of most recent runs')
+
+    faults = commands.add_parser('faults', help='runs reporting each fault')
+    faults.add_argument('--vehicle')
+    faults.add_argument('--ecu-version')
+    faults.add_argument('--last', type=int, help='number of most recent runs')
+
+    args = parser.parse_args(argv)
+
+    with FleetIndex(args.db) as index:
+        if args.command == 'update':
+            started = time.perf_counter()
+            count = index.update(args.directory, args.vehicle, args.workers, args.timeout)
+            print(f'{count} logs indexed in {time.perf_counter() - started:.1f}s')
+        elif args.command == 'vehicles':
+            print(index.vehicles().to_string(index=False))
+        elif args.command == 'trend':
+            if args.channel is None and (args.stat in channel_statistics or args.stat.startswith('q')):
+                parser.error(f'--channel is needed for {args.stat}')
+
+            if args.stat in channel_statistics:
+                df = index.trend(args.vehicle, args.channel, args.stat, args.last, args.ecu_version)
+            elif args.stat.startswith('q') and args.stat[1:].isdigit():
+                df = index.quantile_trend(args.vehicle, args.channel, int(args.stat[1:]) / 100, args.last, args.ecu_version)
+            else:
+                df = index.aggregate_trend(args.vehicle, args.stat, args.last, args.ecu_version)
+            print(df.to_string(index=False))
+        elif args.command == 'faults':
+            print(index.fault_counts(args.vehicle, args.last, args.ecu_version).to_string(index=False))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+# Sparse offset index of a text log
+#
+# Records the byte offset and time of every stride-th sample so that a time
+# window can be read by seeking straight to it. The index is built on the
+# first scan of a log and saved next to it as <log>.idx.npz, it is rebuilt
+# when the log changes.
+#
+import json
+import os
+
+import numpy as np
+
+import mems.protocol.frames
+import mems.protocol.rosco
+
+
+index_version = 2
+
+
+class LogIndex(object):
+    def __init__(self, filepath, format, rows, offsets, clock, total_rows, version='', header=None, stride=1024):
+        self.filepath = filepath
+        self.format = format
+        self.rows = rows
+        self.offsets = offsets
+        self.clock = clock
+        self.total_rows = total_rows
+        self.version = version
+        self.header = header or []
+        self.stride = stride
+
+
+    @staticmethod
+    def index_path(filepath):
+        return filepath + '.idx.npz'
+
+
+    @classmethod
+    def load_or_build(cls, filepath, stride=1024, save=True):
+        index = cls.load(filepath, stride)
+
+        if index is None:
+            if filepath.lower().endswith('.csv'):
+                index = cls.build_memsscan(filepath, stride)
+            else:
+                index = cls.build_readmems(filepath, stride)
+
+            if save:
+                index.save()
+
+        return index
+
+
+    @classmethod
+    def load(cls, filepath, stride=1024):
+        try:
+            stored = np.load(cls.index_path(filepath))
+            meta = json.loads(str(stored['meta']))
+        except (OSError, ValueError, KeyError):
+            return None
+
+        stat = os.stat(filepath)
+        if (meta['index_version'] != index_version or meta['stride'] != stride or
+                meta['source_size'] != stat.st_size or meta['source_mtime'] != stat.st_mtime_ns):
+            return None
+
+        return cls(filepath, meta['format'], stored['rows'], stored['offsets'], stored['clock'],
+                   meta['total_rows'], meta['version'], meta['header'], stride)
+
+
+    # the index is a convenience, a log in a read-only directory is still read
+    def save(self):
+        stat = os.stat(self.filepath)
+        meta = {'index_version': index_version,
+                'format': self.format,
+                'stride': self.stride,
+                'total_rows': self.total_rows,
+                'version': self.version,
+                'header': self.header,
+                'source_size': stat.st_size,
+                'source_mtime': stat.st_mtime_ns}
+
+        try:
+            with open(self.index_path(self.filepath), 'wb') as f:
+                np.savez(f, rows=self.rows, offsets=self.offsets, clock=self.clock, meta=json.dumps(meta))
+        except OSError:
+            pass
+
+
+    # readmems samples are one second apart, an entry is the offset of the line
+    # after the 0x7d response that completes a sample. uses the decoder of
+    # LogReader.read_frame_blocks so the sample numbers agree
+    @classmethod
+    def build_readmems(cls, filepath, stride=1024, block_size=1 << 22):
+        decoder = mems.protocol.frames.ReadmemsDecoder(mems.protocol.rosco.Rosco(), keep_frames=False)
+
+        with open(filepath, 'rb') as f:
+            for data in iter(lambda: f.read(block_size), b''):
+                decoder.feed(data)
+            decoder.finish()
+
+        ends = decoder.sample_ends()
+        rows = np.arange(0, len(ends) + 1, stride, dtype=np.int64)
+        offsets = np.r_[0, ends[stride - 1::stride]].astype(np.int64)
+
+        return cls(filepath, 'readmems', rows, offsets, rows.astype(np.float64),
+                   len(ends), decoder.version or '', None, stride)
+
+
+    # mems-scan rows carry an HH:MM:SS time, the clock of an entry counts
+    # seconds from midnight of the first day including any midnight rollover
+    @classmethod
+    def build_memsscan(cls, filepath, stride=1024):
+        ecu_prefix = b'ECU ID:'
+        rows = []
+        offsets = []
+        clock = []
+        header = None
+        version = ''
+        days = 0
+        last = None
+        row = 0
+        offset = 0
+
+        with open(filepath, 'rb') as f:
+            for line in f:
+                start = offset
+                offset = offset + len(line)
+
+                if header is None:
+                    if line.startswith(b'#time'):
+                        header = line.decode().strip().split(',')
+                    elif line.startswith(ecu_prefix):
+                        version = line[len(ecu_prefix):].strip().decode()
+                    continue
+
+                if row % stride == 0:
+                    h, m, s = line[:line.index(b',')].split(b':')
+                    seconds = int(h) * 3600 + int(m) * 60 + int(s)
+                    if last is not None and last - seconds > 43200:
+                        days = days + 1
+                    last = seconds
+
+                    rows.append(row)
+                    offsets.append(start)
+                    clock.append(days * 86400 + seconds)
+
+                row = row + 1
+
+        return cls(filepath, 'mems-scan', np.array(rows, dtype=np.int64), np.array(offsets, dtype=np.int64),
+                   np.array(clock, dtype=np.float64), row, version, header, stride)
+
+
+    # seconds since the first sample of each entry
+    @property
+    def times(self):
+        return self.clock - self.clock[0] if len(self.clock) else self.clock
+
+
+    # the last entry at or before a sample number
+    def locate_row(self, row):
+        entry = max(int(np.searchsorted(self.rows, row, side='right')) - 1, 0)
+        return entry
+
+
+    # the entries bounding the samples between start and end seconds from the
+    # start of the log, the last entry is None when reading to the end. times
+    # are whole seconds, so the samples of the second an entry starts on can
+    # begin in the entry before it, the read starts at the last entry before
+    # start
+    def locate_time(self, start=None, end=None):
+        times = self.times
+
+        first = 0 if start is None else max(int(np.searchsorted(times, start, side='left')) - 1, 0)
+        last = None if end is None else int(np.searchsorted(times, end, side='right'))
+
+        if last is not None and last >= len(times):
+            last = None
+
+        return first, last
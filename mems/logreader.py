@@ -1,35 +1,227 @@
 import os
 
+import mems.binlog
+import mems.compact
+import mems.events
+import mems.export
+import mems.logindex
+import mems.profiling
+import mems.protocol.frames
 import mems.protocol.rosco
 import mems.diagnostics
+import mems.visualization
 
+import numpy as np
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objs as go
-import plotly.figure_factory as ff
-from plotly.offline import download_plotlyjs, init_notebook_mode, plot, iplot
 
 class LogReader(object):
-    def __init__(self):
+    # increment when a change to parsing or conversion alters the loaded data,
+    # this invalidates cached logs
+    parser_version = 1
+
+    # mems-scan csv columns and the protocol fields they hold
+    memsscan_columns = {
+            '#time': 'timestamp', 
+            '80x01-02_engine-rpm': 'engine_speed',
+            '80x03_coolant_temp': 'coolant_temperature',
+            '80x04_ambient_temp': 'ambient_temperature',
+            '80x05_intake_air_temp': 'intake_air_temperature',
+            '80x06_fuel_temp' : 'fuel_temperature',
+            '80x07_map_kpa' : 'map_sensor',
+            '80x08_battery_voltage' : 'battery_voltage',
+            '80x09_throttle_pot' : 'throttle_pot_voltage',
+            '80x0A_idle_switch' : 'idle_switch',
+            '80x0C_park_neutral_switch' : 'park_neutral_switch',
+            '80x0D-0E_fault_codes' : 'fault_codes',
+            '80x0F_idle_set_point' : 'idle_set_point',
+            '80x10_idle_hot' : 'idle_decay',
+            '80x12_iac_position' : 'idle_air_contol_position',
+            '80x13-14_idle_error' : 'idle_speed_deviation',
+            '80x15_ignition_advance_offset' : 'ignition_advance_offset',
+            '80x16_ignition_advance' : 'ignition_advance',
+            '80x17-18_coil_time' : 'coil_time',
+            '80x19_crankshaft_position_sensor' : 'crankshaft_position_sensor',
+            '7dx01_ignition_switch' : 'ignition_switch',
+            '7dx02_throttle_angle' : 'throttle_angle',
+            '7dx04_air_fuel_ratio' : 'air_fuel_ratio',
+            '7dx05_dtc2' : 'dtc2',
+            '7dx06_lambda_voltage' : 'lambda_voltage',
+            '7dx07_lambda_sensor_frequency' : 'lambda_frequency',
+            '7dx08_lambda_sensor_dutycycle' : 'lambda_duty_cycle',
+            '7dx09_lambda_sensor_status' : 'lambda_status',
+            '7dx0A_closed_loop' : 'loop_indicator',
+            '7dx0B_long_term_fuel_trim' : 'long_term_trim',
+            '7dx0C_short_term_fuel_trim' : 'short_term_trim',
+            '7dx0D_carbon_canister_dutycycle' : 'carbon_canister_purge_valve_duty_cycle',
+            '7dx0E_dtc3' : 'dtc3',
+            '7dx0F_idle_base_pos' : 'idle_base_position',
+            '7dx11_dtc4' : 'dtc4',
+            '7dx12_ignition_advance2' : 'ignition_advance_offset',
+            '7dx13_idle_speed_offset' : 'idle_speed_offset',
+            '7dx14_idle_error2' : 'idle_error',
+            '7dx16_dtc5' : 'dtc5',
+    }
+
+    # dtype_policy 'converted' loads every channel in the dtype of the
+    # conversion table, 'compact' keeps the raw bytes in self.channels and
+    # scales a channel when it is read, see mems.compact. with events the
+    # event index of mems.events is built as the last step of loading
+    def __init__(self, cache=None, profiler=None, dtype_policy='converted', events=True):
+        if dtype_policy not in mems.compact.dtype_policies:
+            raise ValueError(f'unknown dtype policy {dtype_policy}, use one of {", ".join(mems.compact.dtype_policies)}')
+
+        self.cache = cache
         self.rosco = mems.protocol.rosco.Rosco()
         self.diagnostics = mems.diagnostics.MemsDiagnostics()
+        self.profiler = profiler
+        self.dtype_policy = dtype_policy
+        self.channels = None
         self.df = pd.DataFrame()
         self.filename = []
         self.filepath = ''
         self.raw = []
         self.version = ''
+        self.frame_stats = {}
+        self.index_events = events
+        self.events = mems.events.EventIndex()
+
+
+    # a mems.profiling.Profiler records the stages of loading and diagnosing
+    # a log, it is shared with the diagnostics
+    @property
+    def profiler(self):
+        return self._profiler
+
+
+    @profiler.setter
+    def profiler(self, profiler):
+        self._profiler = profiler
+        self.diagnostics.profiler = profiler
+
+
+    def stage(self, name, rows=None):
+        return mems.profiling.stage(self._profiler, name, rows)
+
+
+    # with the compact policy the converted frame is built from the channels
+    # the first time it is used and kept from then on
+    @property
+    def df(self):
+        if self._df is None:
+            self._df = self.channels.to_dataframe() if self.channels is not None else pd.DataFrame()
+        return self._df
+
+
+    @df.setter
+    def df(self, df):
+        self._df = df
+        self.channels = None
+
+
+    # the loaded log for reading channels, with the compact policy only the
+    # channels that are read are scaled
+    @property
+    def frame(self):
+        return self.channels if self.channels is not None and self._df is None else self.df
+
+
+    def use_channels(self, channels):
+        self.channels = channels
+        self.raw = channels.raw
+        self._df = None
+
+
+    # keep a converted frame as compact channels when the policy asks for it
+    def apply_dtype_policy(self):
+        if self.dtype_policy != 'compact' or self.channels is not None:
+            return
+
+        with self.stage('pack', len(self._df)):
+            self.use_channels(mems.compact.CompactFrame.from_dataframe(self._df, self.rosco._conversions))
+
+
+    # bytes held by every column of the loaded log. bytes are the stored
+    # column, cached_bytes the scaled copies of compact channels and
+    # frame_bytes the converted frame once built. converted_bytes is the size
+    # of the column with the 'converted' policy
+    def memory_usage(self):
+        if self.channels is not None:
+            usage = self.channels.memory_usage()
+        else:
+            usage = pd.DataFrame({'column': list(self._df.columns),
+                                  'dtype': [str(t) for t in self._df.dtypes],
+                                  'bytes': self._df.memory_usage(index=False).to_list(),
+                                  'cached_bytes': 0})
+            usage['converted_dtype'] = usage['dtype']
+            usage['converted_bytes'] = usage['bytes']
+
+        frame = self._df.memory_usage(index=False) if self._df is not None and self.channels is not None else {}
+        usage.insert(4, 'frame_bytes', [int(frame.get(c, 0)) for c in usage['column']])
+
+        return usage
+
+
+    def display_memory_usage(self):
+        usage = self.memory_usage()
+        held = usage[['bytes', 'cached_bytes', 'frame_bytes']].to_numpy().sum()
+        converted = usage['converted_bytes'].sum()
+
+        print(usage.to_string(index=False))
+        print(f'\n{held / 1048576:.1f} MB held, {converted / 1048576:.1f} MB converted ({self.dtype_policy} policy)')
+
+
+    # the event index of the loaded log, the channels it reads are the ones
+    # just loaded. with the compact policy only those are scaled
+    def create_event_index(self, settings=None):
+        if not self.index_events:
+            return self.events
+
+        with self.stage('events', len(self.frame)):
+            self.events = mems.events.detect_events(self.frame, settings)
+
+        return self.events
+
+
+    # the samples from before seconds ahead of an event to after seconds past
+    # its end. event is a row of self.events or its position
+    def event_window(self, event, before=10.0, after=10.0, columns=None):
+        first, last = self.events.window(event, before, after)
+
+        if columns is not None:
+            columns = ['timestamp'] + [c for c in columns if c in self.frame.columns and c != 'timestamp']
+
+        if self.channels is not None and self._df is None:
+            return self.channels.to_dataframe(columns, slice(first, last))
+
+        df = self.df.iloc[first:last]
+        return df if columns is None else df[columns]
+
+
+    # a graph of the window around an event, by default of the channel the
+    # event was found in
+    def create_event_graph(self, event, dimensions=None, before=10.0, after=10.0, title='', y_axis_label='',
+                           max_points=4000, webgl_threshold=20000, method='lttb'):
+        if not isinstance(event, pd.Series):
+            event = self.events[event]
+
+        dimensions = dimensions or [event['channel']]
+        df = self.event_window(event, before, after, dimensions)
+
+        return mems.visualization.create_event_graph(df, event, dimensions, title, y_axis_label, max_points, webgl_threshold, method)
+
+
+    def display_event_graph(self, event, dimensions=None, before=10.0, after=10.0, title='', y_axis_label=''):
+        from plotly.offline import iplot
+
+        return iplot(self.create_event_graph(event, dimensions, before, after, title, y_axis_label))
 
 
     def get_version(self):
         return "MEMS ECU ID: " + self.rosco.get_version(self.version)
     
     
-    def convert_farenheit_to_celcius(self, f):
-        return f - 55 #round(((f - 32) * 5.0 / 9.0),1)
-
-
     def combine_high_low_bytes(self, high, low):
-        return high + low
+        return high.astype(np.uint16) * 256 + low.astype(np.uint16)
 
 
     def extract_fault_code(self, x, bitmask, df, result_column):
@@ -38,106 +230,97 @@ class LogReader(object):
 
 
     def create_dataframe_from_file(self):
-        datadict7d = {}
-        datadict80 = {}
+        with self.stage('parse') as s:
+            blocks = self.read_frame_blocks()
+            s.rows = len(blocks['80'])
 
-        i = 0
-        version_prefix = 'ECU responded to D0 command with:'
+        return self.assemble_dataframe(blocks, np.arange(len(blocks['80']), dtype=np.uint32))
 
-        f = open(self.filepath)
-        line = f.readline()
-        while line:
-            line = f.readline()
 
-            if line.startswith(version_prefix):
-                self.version = line[len(version_prefix):].strip()
-                
-            if len(line) > 50:
-                command_code = (line[0:2]).lower()
+    # the compact policy keeps the parsed bytes as they are
+    def create_channels_from_file(self):
+        with self.stage('parse') as s:
+            blocks = self.read_frame_blocks()
+            s.rows = len(blocks['80'])
+
+        with self.stage('pack', len(blocks['80'])):
+            return mems.compact.CompactFrame.from_blocks(blocks, self.rosco, np.arange(len(blocks['80']), dtype=np.uint32))
+
+
+    # decode the 0x80 and 0x7d responses of a readmems log into one uint8 row
+    # per sample, see mems.protocol.frames. a sample is a 0x7d response that
+    # directly follows a 0x80 response, damaged responses are dropped and
+    # counted in self.frame_stats. reading can start at a sample boundary
+    # found in the log index and stop after max_rows samples
+    def read_frame_blocks(self, offset=0, max_rows=None, block_size=1 << 22):
+        decoder = mems.protocol.frames.ReadmemsDecoder(self.rosco, offset)
 
-                for c in self.rosco._dataframes:
-                    dataframecmd = c['command']
+        with open(self.filepath, 'rb') as f:
+            f.seek(offset)
 
-                    if (dataframecmd == command_code):
-                        dataframe = c['fields']
-                        line = line.replace(' \n', '').replace('\r', '')
-                        statuscodes = line[4:].strip().split(" ")
+            for data in iter(lambda: f.read(block_size), b''):
+                decoder.feed(data)
+                if max_rows is not None and decoder.samples >= max_rows:
+                    break
+            else:
+                decoder.finish()
 
-                        if command_code == '80':
-                            datadict80.update({i: pd.Series(statuscodes, index=dataframe)})
+        if decoder.version is not None:
+            self.version = decoder.version
+        self.frame_stats = decoder.stats
 
-                        if command_code == '7d':
-                            if 'timestamp' not in dataframe:
-                                dataframe.append('timestamp')
-                            statuscodes.append(format(i, 'x').zfill(2))
+        return decoder.frame_blocks(max_rows)
 
-                            datadict7d.update({i: pd.Series(statuscodes, index=dataframe)})
-                            # increment index after a 7d command response to complete full dataframe
-                            i = i + 1
 
-                        self.raw.append(statuscodes)
-        f.close()
+    # build the raw frame from acquisition records (see Rosco.record_dtype), the
+    # timestamp is the time in seconds since origin, by default the first record
+    def create_dataframe_from_records(self, records, origin=None):
+        if origin is None:
+            origin = records['timestamp'][0] if len(records) else 0.0
 
-        df7d = pd.DataFrame(datadict7d)
-        df80 = pd.DataFrame(datadict80)
+        timestamps = records['timestamp'] - origin
+        return self.assemble_dataframe({'80': records['80'], '7d': records['7d']}, timestamps)
 
-        return df7d.append(df80)
+
+    # assemble the frame once from the column arrays, fields that appear in
+    # both responses take the value from the 0x80 response. fields limits the
+    # frame to the listed raw fields
+    def assemble_dataframe(self, blocks, timestamps, fields=None):
+        with self.stage('assemble', len(timestamps)):
+            columns = {}
+            for command in ['7d', '80']:
+                for n, field in enumerate(self.rosco.get_dataframe_fields(command)):
+                    if fields is None or field in fields:
+                        columns[field] = blocks[command][:, n].copy()
+
+            columns['timestamp'] = timestamps
+            self.raw = columns
+
+            return pd.DataFrame(columns, copy=False)
 
     
+    # plotting lives in mems.visualization, which only imports plotly on the
+    # first call so that parsing and diagnostics run without it
     def exp_display_histogram(self, dimensions, title='', y_axis_label=''):
         self.df = self.df.fillna(0)
-        fig = ff.create_distplot([self.df[c] for c in dimensions], dimensions, curve_type='normal')
-        return iplot(fig, filename=(f'{self.filename[0]}-{title}')) 
-    
-    
-    def display_graph(self, dimensions, title='', y_axis_label=''):
-        data = []
-
-        for dimension in dimensions:
-            data.append( 
-                go.Scatter(
-                    x=self.df['timestamp'],  # assign x as the dataframe column 'x'
-                    y=self.df[dimension],
-                    name=dimension,
-                    #fill='toself',
-                    line=dict(shape='spline', smoothing=0.4),
-                )
-            )
-
-        layout = go.Layout(title=f'{title}',
-            xaxis=dict(title='time (s)'),
-            yaxis=dict(title=y_axis_label, zeroline=False))
-
-        fig = go.Figure(data=data, layout=layout)
-
-        fig.update_layout(
-            xaxis=dict(
-                linecolor='rgb(204, 204, 204)',
-            ),
-            autosize=True,
-            showlegend=True,
-            plot_bgcolor='rgb(250, 250, 250)'
-        )
-        
-        return iplot(fig, filename=(f'{self.filename[0]}-{dimension}')) 
-
-
-    def display_histogram(self, dimension, title='', y_axis_label=''):
-        fig = px.histogram(self.df, x=dimension, marginal="box")
-        fig.update_layout(
-            xaxis=dict(
-                linecolor='rgb(204, 204, 204)',
-            ),
-            bargap=0.1,
-            autosize=True,
-            showlegend=True,
-            plot_bgcolor='rgb(250, 250, 250)',
-        )
-        return iplot(fig, filename=(f'{self.filename[0]}-{dimension}')) 
-   
+        return mems.visualization.display_distplot(self.df, dimensions, title, self.filename)
+
+
+    def create_graph(self, dimensions, title='', y_axis_label='', max_points=4000, webgl_threshold=20000, method='lttb'):
+        return mems.visualization.create_graph(self.df, dimensions, title, y_axis_label, max_points, webgl_threshold, method)
+
+
+    def display_graph(self, dimensions, title='', y_axis_label='', max_points=4000, webgl_threshold=20000, method='lttb', dynamic=False):
+        return mems.visualization.display_graph(self.df, dimensions, title, y_axis_label, self.filename,
+                                                max_points, webgl_threshold, method, dynamic)
+
+
+    def display_histogram(self, dimension, title='', y_axis_label='', bins=50):
+        return mems.visualization.display_histogram(self.df, dimension, title, y_axis_label, self.filename, bins)
+
 
     def display_faults(self):
-        report = self.diagnostics.analyse_run(self.df)
+        report = self.diagnostics.analyse_run(self.frame)
         print(report)
         
             
@@ -168,81 +351,354 @@ class LogReader(object):
 
                 
     def remap_memsscan_data(self):
-        self.df.rename(columns={
-            '#time': 'timestamp', 
-            '80x01-02_engine-rpm': 'engine_speed',
-            '80x03_coolant_temp': 'coolant_temperature',
-            '80x04_ambient_temp': 'ambient_temperature',
-            '80x05_intake_air_temp': 'intake_air_temperature',
-            '80x06_fuel_temp' : 'fuel_temperature',
-            '80x07_map_kpa' : 'map_sensor',
-            '80x08_battery_voltage' : 'battery_voltage',
-            '80x09_throttle_pot' : 'throttle_pot_voltage',
-            '80x0A_idle_switch' : 'idle_switch',
-            '80x0C_park_neutral_switch' : 'park_neutral_switch',
-            '80x0D-0E_fault_codes' : 'fault_codes',
-            '80x0F_idle_set_point' : 'idle_set_point',
-            '80x10_idle_hot' : 'idle_decay',
-            '80x12_iac_position' : 'idle_air_contol_position',
-            '80x13-14_idle_error' : 'idle_speed_deviation',
-            '80x15_ignition_advance_offset' : 'ignition_advance_offset',
-            '80x16_ignition_advance' : 'ignition_advance',
-            '80x17-18_coil_time' : 'coil_time',
-            '80x19_crankshaft_position_sensor' : 'crankshaft_position_sensor',
-            '7dx01_ignition_switch' : 'ignition_switch',
-            '7dx02_throttle_angle' : 'throttle_angle',
-            '7dx04_air_fuel_ratio' : 'air_fuel_ratio',
-            '7dx05_dtc2' : 'dtc2',
-            '7dx06_lambda_voltage' : 'lambda_voltage',
-            '7dx07_lambda_sensor_frequency' : 'lambda_frequency',
-            '7dx08_lambda_sensor_dutycycle' : 'lambda_dutycycle',
-            '7dx09_lambda_sensor_status' : 'lambda_status',
-            '7dx0A_closed_loop' : 'loop_indicator',
-            '7dx0B_long_term_fuel_trim' : 'long_term_trim',
-            '7dx0C_short_term_fuel_trim' : 'short_term_trim',
-            '7dx0D_carbon_canister_dutycycle' : 'carbon_canister_purge_valve_duty_cycle',
-            '7dx0E_dtc3' : 'dtc3',
-            '7dx0F_idle_base_pos' : 'idle_base_position',
-            '7dx11_dtc4' : 'dtc4',
-            '7dx12_ignition_advance2' : 'ignition_advance_offset',
-            '7dx13_idle_speed_offset' : 'idle_speed_offset',
-            '7dx14_idle_error2' : 'idle_error',
-            '7dx16_dtc5' : 'dtc5',
-        }, inplace=True)
+        self.df = self.remap_memsscan_dataframe(self.df)
+
+
+    def remap_memsscan_dataframe(self, df):
+        df = df.rename(columns=self.memsscan_columns)
+
+        # the ignition advance offset is reported in both responses, keep the
+        # 0x80 value as the readmems logs do
+        return df.loc[:, ~df.columns.duplicated()]
         
         
+    # exports are written by mems.export, the excel workbook has a summary
+    # sheet and the log split over as many sheets as needed
     def save_as_excel(self):
-        writer = pd.ExcelWriter(f'{self.filename[0]}.xlsx')
-        self.df.to_excel(writer, 'Log Data')
-        writer.save()
+        mems.export.export_excel(self.df, f'{self.filename[0]}.xlsx', mems.export.create_summary(self))
+
+
+    def save_as_parquet(self, compression='zstd'):
+        mems.export.export_parquet(self.df, f'{self.filename[0]}.parquet', compression)
+
+
+    def save_as_feather(self, compression='zstd'):
+        mems.export.export_feather(self.df, f'{self.filename[0]}.feather', compression)
 
         
-    def read_memsscanfile(self, filepath):
+    def read_memsscanfile(self, filepath, chunksize=100000):
         self.filepath = filepath
         filename = os.path.basename(filepath)
         self.filename = os.path.splitext(filename)
+
+        if self.load_from_cache('mems-scan'):
+            self.create_event_index()
+            return
         
-        dateparser = lambda x: pd.datetime.strptime(x, "%H:%M:%S")
-        self.df = pd.read_csv(self.filepath, parse_dates=['#time'], date_parser=dateparser)
-        
-        self.remap_memsscan_data()
-   
+        chunks = self.iter_memsscan_chunks(filepath, chunksize)
+
+        # with the compact policy each chunk is packed as it is read so the
+        # whole log is never held converted
+        if self.dtype_policy == 'compact':
+            chunks = [mems.compact.CompactFrame.from_dataframe(c, self.rosco._conversions) for c in chunks]
+
+            with self.stage('concat', sum(len(c) for c in chunks)):
+                self.use_channels(mems.compact.CompactFrame.concat(chunks, self.rosco._conversions))
+        else:
+            chunks = list(chunks)
+
+            with self.stage('concat', sum(len(c) for c in chunks)):
+                self.df = pd.concat(chunks)
+
+        self.store_in_cache('mems-scan')
+        self.create_event_index()
+
+
+    # read a mems-scan log in chunks of at most chunksize rows. each chunk is
+    # remapped, converted and indexed by time so that long logs can be analysed
+    # without holding the whole file in memory
+    def iter_memsscan_chunks(self, filepath, chunksize=100000):
+        header, skiprows = self.read_memsscan_preamble(filepath)
+
+        dtypes = {column: np.float32 for column in header}
+        dtypes['#time'] = str
+
+        reader = pd.read_csv(filepath, skiprows=skiprows, dtype=dtypes, chunksize=chunksize)
+        state = {'last': None, 'days': 0}
+
+        with reader:
+            for chunk in mems.profiling.iterate(self._profiler, 'read_csv', reader):
+                with self.stage('parse_times', len(chunk)):
+                    chunk = chunk[chunk['#time'].notna()]
+                    times = self.parse_memsscan_times(chunk.pop('#time'), state)
+
+                with self.stage('fillna', len(chunk)):
+                    chunk = chunk.fillna(0)
+
+                with self.stage('remap', len(chunk)):
+                    chunk = self.remap_memsscan_dataframe(chunk)
+
+                chunk = self.convert_dataframe(chunk, from_raw=False)
+                chunk.insert(0, 'timestamp', times)
+                chunk.index = pd.DatetimeIndex(times, name='time')
+
+                yield chunk
+
+
+    # find the csv header, some versions of mems-scan write the ECU id first
+    def read_memsscan_preamble(self, filepath):
+        ecu_prefix = 'ECU ID:'
+        skiprows = 0
+
+        with open(filepath) as f:
+            for line in f:
+                if line.startswith('#time'):
+                    return line.strip().split(','), skiprows
+
+                if line.startswith(ecu_prefix):
+                    self.version = line[len(ecu_prefix):].strip()
+
+                skiprows = skiprows + 1
+
+        raise ValueError(f'{filepath} is not a mems-scan log, no #time header found')
+
+
+    # convert the bare HH:MM:SS times of a mems-scan log into timestamps. the log
+    # carries no date so a time more than 12 hours earlier than the one before
+    # it is taken to be a midnight rollover, state carries the last time and day
+    # count across chunks
+    def parse_memsscan_times(self, times, state=None):
+        if state is None:
+            state = {'last': None, 'days': 0}
+
+        text = np.asarray(times.to_numpy(dtype=str), dtype='S8')
+        chars = text.view(np.uint8).reshape(-1, 8).astype(np.int32)
+        digits = chars - ord('0')
+
+        well_formed = ((chars[:, 2] == ord(':')) & (chars[:, 5] == ord(':')) &
+                       ((digits[:, [0, 1, 3, 4, 6, 7]] >= 0) & (digits[:, [0, 1, 3, 4, 6, 7]] <= 9)).all(axis=1))
+
+        if well_formed.all():
+            seconds = ((digits[:, 0] * 10 + digits[:, 1]) * 3600 +
+                       (digits[:, 3] * 10 + digits[:, 4]) * 60 +
+                       (digits[:, 6] * 10 + digits[:, 7]))
+        else:
+            parsed = pd.to_datetime(pd.Series(times), format='%H:%M:%S', exact=False)
+            seconds = (parsed.dt.hour * 3600 + parsed.dt.minute * 60 + parsed.dt.second).to_numpy(np.int32)
+
+        previous = np.empty_like(seconds)
+        previous[1:] = seconds[:-1]
+        previous[:1] = seconds[:1] if state['last'] is None else state['last']
+
+        days = state['days'] + np.cumsum(previous - seconds > 43200)
+
+        if len(seconds) > 0:
+            state['last'] = int(seconds[-1])
+            state['days'] = int(days[-1])
+
+        return (np.datetime64('1900-01-01', 's') + (days * 86400 + seconds).astype('timedelta64[s]')).astype('datetime64[ns]')
+
+
+    # min, mean and max of every numeric column accumulated over a sequence of
+    # chunks, e.g. from iter_memsscan_chunks, holding only one chunk at a time
+    def dimension_stats(self, chunks=None):
+        if chunks is None:
+            chunks = [self.df]
+
+        mn = mx = total = count = None
+
+        for chunk in chunks:
+            numeric = chunk.select_dtypes(include='number')
+            chunk_min = numeric.min()
+            chunk_max = numeric.max()
+            chunk_total = numeric.astype(np.float64).sum()
+            chunk_count = numeric.count()
+
+            if mn is None:
+                mn, mx, total, count = chunk_min, chunk_max, chunk_total, chunk_count
+            else:
+                mn = np.fmin(mn, chunk_min)
+                mx = np.fmax(mx, chunk_max)
+                total = total.add(chunk_total, fill_value=0)
+                count = count.add(chunk_count, fill_value=0)
+
+        if mn is None:
+            return pd.DataFrame(columns=['min', 'mean', 'max'])
+
+        return pd.DataFrame({'min': mn, 'mean': total / count, 'max': mx})
+
 
     def read_logfile(self, filepath):
         self.filepath = filepath
         filename = os.path.basename(filepath)
         self.filename = os.path.splitext(filename)
+
+        if self.load_from_cache('readmems'):
+            self.create_event_index()
+            return
+
+        if self.dtype_policy == 'compact':
+            self.use_channels(self.create_channels_from_file())
+            self.store_in_cache('readmems')
+            self.create_event_index()
+            return
         
         # create a dataframe from the log file
         self.df = self.create_dataframe_from_file()
         
         # prepare and transform the data 
-        self.pivot_dataframe()
-               
         #self.remove_unknown_fields()
-        self.replace_not_a_number_with_zero()
-        self.create_decimal_values_from_bytes()
         self.convert_metrics()
+        self.store_in_cache('readmems')
+        self.create_event_index()
+
+
+    # load a binary log, optionally only the samples between start and end
+    # seconds from the start of the log. the records are memory mapped so
+    # there is no parsing
+    def read_binaryfile(self, filepath, start=None, end=None):
+        self.filepath = filepath
+        filename = os.path.basename(filepath)
+        self.filename = os.path.splitext(filename)
+
+        log = mems.binlog.BinaryLogReader(filepath)
+        self.version = log.version
+
+        origin = log.records['timestamp'][0] if len(log) else 0.0
+        records = log.time_range(start, end)
+
+        if self.dtype_policy == 'compact':
+            blocks = {'80': records['80'], '7d': records['7d']}
+            self.use_channels(mems.compact.CompactFrame.from_blocks(blocks, self.rosco, records['timestamp'] - origin))
+            self.create_event_index()
+            return
+
+        self.df = self.create_dataframe_from_records(records, origin)
+        self.convert_metrics()
+        self.create_event_index()
+
+
+    # load only the listed columns of the samples between start and end seconds
+    # from the start of the log. text logs are read through a sparse offset
+    # index kept next to the log, built the first time the log is loaded
+    def load(self, filepath, columns=None, start=None, end=None):
+        self.filepath = filepath
+        filename = os.path.basename(filepath)
+        self.filename = os.path.splitext(filename)
+
+        if filepath.lower().endswith('.memsbin'):
+            self.read_binaryfile(filepath, start, end)
+            self.df = self.project_columns(self.df, columns)
+            return self.df
+
+        index = mems.logindex.LogIndex.load_or_build(filepath)
+        self.version = index.version
+
+        if index.format == 'readmems':
+            self.df = self.load_readmems_window(index, columns, start, end)
+        else:
+            self.df = self.load_memsscan_window(index, columns, start, end)
+
+        self.create_event_index()
+        return self.df
+
+
+    def project_columns(self, df, columns):
+        if columns is None:
+            return df
+
+        return df[['timestamp'] + [c for c in columns if c in df.columns and c != 'timestamp']]
+
+
+    # the raw protocol fields needed to produce the listed columns
+    def source_fields(self, columns):
+        fields = set()
+        for column in columns:
+            conversion = self.rosco._conversions.get(column, {})
+            fields.update(conversion.get('bytes', [column]))
+
+        return fields
+
+
+    def load_readmems_window(self, index, columns, start, end):
+        first = 0 if start is None else max(int(np.ceil(start)), 0)
+        last = index.total_rows if end is None else min(int(np.floor(end)) + 1, index.total_rows)
+        last = max(first, last)
+
+        entry = index.locate_row(first)
+        entry_row = int(index.rows[entry])
+
+        blocks = self.read_frame_blocks(int(index.offsets[entry]), max_rows=last - entry_row)
+        blocks = {command: block[first - entry_row:last - entry_row] for command, block in blocks.items()}
+
+        fields = None if columns is None else self.source_fields(columns)
+        timestamps = np.arange(first, first + len(blocks['80']), dtype=np.uint32)
+
+        df = self.convert_dataframe(self.assemble_dataframe(blocks, timestamps, fields))
+        return self.project_columns(df, columns)
+
+
+    def load_memsscan_window(self, index, columns, start, end):
+        first, last = index.locate_time(start, end)
+        nrows = None if last is None else int(index.rows[last] - index.rows[first])
+
+        usecols = index.header
+        if columns is not None:
+            usecols = [c for c in index.header if c == '#time' or self.memsscan_columns.get(c, c) in columns]
+
+        dtypes = {column: np.float32 for column in usecols}
+        dtypes['#time'] = str
+
+        with open(self.filepath) as f:
+            f.seek(int(index.offsets[first]))
+            df = pd.read_csv(f, header=None, names=index.header, usecols=usecols, dtype=dtypes, nrows=nrows)
+
+        clock = int(index.clock[first])
+        state = {'last': clock % 86400, 'days': clock // 86400}
+        times = self.parse_memsscan_times(df.pop('#time'), state)
+
+        elapsed = (times - np.datetime64('1900-01-01', 'ns')) / np.timedelta64(1, 's') - index.clock[0]
+        window = np.ones(len(df), dtype=bool)
+        if start is not None:
+            window &= elapsed >= start
+        if end is not None:
+            window &= elapsed <= end
+
+        df = self.remap_memsscan_dataframe(df[window].fillna(0))
+        df = self.convert_dataframe(df, from_raw=False)
+        df.insert(0, 'timestamp', times[window])
+        df.index = pd.DatetimeIndex(times[window], name='time')
+
+        return self.project_columns(df, columns)
+
+
+    # the units of the loaded columns, from the protocol conversion table
+    def get_units(self):
+        return {c: self.rosco._conversions[c]['unit'] for c in self.frame.columns if c in self.rosco._conversions}
+
+
+    # use the converted log from the cache if it has been loaded before
+    def load_from_cache(self, source_format):
+        if self.cache is None:
+            return False
+
+        with self.stage('cache_load') as s:
+            cached = self.cache.get(self.cache.key(self.filepath, self.parser_version))
+            s.rows = 0 if cached is None else len(cached[0])
+
+        if cached is None or cached[1].get('format') != source_format:
+            return False
+
+        self.df, metadata = cached
+        self.version = metadata.get('version', '')
+        self.apply_dtype_policy()
+        return True
+
+
+    def store_in_cache(self, source_format):
+        if self.cache is None:
+            return
+
+        metadata = {'format': source_format,
+                    'version': self.version,
+                    'units': self.get_units(),
+                    'source': os.path.abspath(self.filepath)}
+
+        # a compact log is cached converted, without keeping the frame
+        df = self._df if self._df is not None else self.channels.to_dataframe()
+
+        with self.stage('cache_store', len(df)):
+            self.cache.put(self.cache.key(self.filepath, self.parser_version), df, metadata)
             
                
     # remove the unknown fields 
@@ -254,56 +710,35 @@ class LogReader(object):
                
     # replace NaN with zeros
     def replace_not_a_number_with_zero(self):
-        self.df = self.df.fillna('00')
+        self.df = self.df.fillna(0)
           
                
-    # pivot the table so that the indexes are now columns, this makes it much
-    # easier to create plots and do column analysis
-    def pivot_dataframe(self):
-        self.df = self.df.transpose()
+    # convert the metrics to the correct scale using the conversion table in
+    # the protocol definition. raw readmems logs hold the undecoded bytes, the
+    # mems-scan logs are mostly in engineering units already and are retyped
+    def convert_metrics(self, from_raw=True):
+        self.df = self.convert_dataframe(self.df, from_raw)
 
-               
-    # combine the 16 bit values into a single value and remove the source fields            
-    def create_decimal_values_from_bytes(self): 
-        self.df['engine_speed'] = self.combine_high_low_bytes(self.df['engine_speed_high_byte'], self.df['engine_speed_low_byte'])
-        self.df.drop(columns=['engine_speed_high_byte', 'engine_speed_low_byte'])
 
-        self.df['idle_speed_deviation'] = self.combine_high_low_bytes(self.df['idle_speed_deviation_high_byte'],self.df['idle_speed_deviation_low_byte'])
-        self.df.drop(columns=['idle_speed_deviation_high_byte', 'idle_speed_deviation_low_byte'], inplace = True)
+    def convert_dataframe(self, df, from_raw=True):
+        columns = {c: df[c] for c in df.columns}
 
-        self.df['coil_time'] = self.combine_high_low_bytes(self.df['coil_time_high_byte'], self.df['coil_time_low_byte'])
-        self.df.drop(columns=['coil_time_high_byte', 'coil_time_low_byte'], inplace = True)
-            
-               
-    # convert the metrics to the correct scale
-    def convert_metrics(self):
-        # convert all the hex strings into integers
-        self.df = self.df.apply(lambda x: x.astype(str).map(lambda x: int(x, base=16)))
-               
-        # battery voltage 0.1V per LSB (e.g. 0x7B == 12.3V)
-        self.df['battery_voltage'] = self.df['battery_voltage'].apply(lambda x: x * 0.1) 
-               
-        # throttle pot. voltage 0.02V per LSB. (e.g. 0xFA == 5.0V)
-        self.df['throttle_pot_voltage'] = self.df['throttle_pot_voltage'].apply(lambda x: x * 0.02)
-    
-        # short term fuel trim (STFL) 1% per LSB
-        self.df['short_term_trim'] = self.df['short_term_trim'].apply(lambda x: (x - 100) / 10)
-        self.df['long_term_trim'] = self.df['long_term_trim'].apply(lambda x: (x - 128) )
-               
-        # ignition_advance 0.5 degrees per LSB with range of -24 deg (0x00) to 103.5 deg (0xFF)
-        self.df['ignition_advance'] = self.df['ignition_advance'].apply(lambda x: (x / 50) - 24)
-        
-        self.df['idle_air_contol_position'] = self.df['idle_air_contol_position'].apply(lambda x: (x / 1.8))
-        self.df['lambda_voltage'] = self.df['lambda_voltage'].apply(lambda x: (x * 5))
-        self.df['throttle_angle'] = self.df['throttle_angle'].apply(lambda x: x * 6 / 10)
-        self.df['air_fuel_ratio'] = self.df['air_fuel_ratio'].apply(lambda x: x / 10)
-        self.df['idle_speed_offset'] = self.df['idle_speed_offset'].apply(lambda x: (x - 128) * 25)
-        
-        # coil time, 0.002 milliseconds per LSB (16 bits) 
-        self.df['coil_time'] = self.df['coil_time'].apply(lambda x: x / 2000)
-                        
-        # convert all temperatures to celcius
-        self.df['coolant_temperature'] = self.df['coolant_temperature'].apply(self.convert_farenheit_to_celcius)
-        self.df['ambient_temperature'] = self.df['ambient_temperature'].apply(self.convert_farenheit_to_celcius)
-        self.df['intake_air_temperature'] = self.df['intake_air_temperature'].apply(self.convert_farenheit_to_celcius)
-        self.df['fuel_temperature'] = self.df['fuel_temperature'].apply(self.convert_farenheit_to_celcius)
\ No newline at end of file
+        with self.stage('combine_bytes', len(df)):
+            for field, conversion in self.rosco._conversions.items():
+                if conversion['width'] == 2 and 'bytes' in conversion and conversion['bytes'][0] in columns:
+                    high, low = conversion['bytes']
+                    columns[field] = self.combine_high_low_bytes(columns.pop(high).to_numpy(), columns.pop(low).to_numpy())
+
+        with self.stage('convert', len(df)):
+            for field, conversion in self.rosco._conversions.items():
+                if field not in columns:
+                    continue
+
+                values = np.asarray(columns[field])
+
+                if from_raw or conversion.get('memsscan_raw', False):
+                    columns[field] = mems.compact.scale_values(values, conversion)
+                else:
+                    columns[field] = values.astype(conversion['dtype'])
+
+        return pd.DataFrame(columns, index=df.index, copy=False)
@@ -0,0 +1,219 @@
+# Opt-in timing of the stages of loading and diagnosing a log
+#
+# Attach a Profiler to a LogReader (or MemsDiagnostics) and every stage
+# records its wall time, the rows it processed and the change in resident
+# memory. The stages are collected in a ProfileReport and can also be written
+# as JSON lines as they complete. With no profiler attached each stage is a
+# shared no-op, so the instrumentation costs next to nothing.
+#
+#   profiler = mems.profiling.Profiler(output='profile.jsonl')
+#   lr = mems.logreader.LogReader(profiler=profiler)
+#   lr.read_logfile('run.log')
+#   print(profiler.report)
+#
+import json
+import os
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+try:
+    page_size = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    page_size = 4096
+
+
+# current resident memory in bytes. where /proc is not available the peak
+# resident memory is used, so the deltas only show growth
+def resident_memory():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * page_size
+    except (OSError, ValueError, IndexError):
+        pass
+
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    return 0
+
+
+class StageTiming(object):
+    def __init__(self, profiler, name, rows=None):
+        self.profiler = profiler
+        self.name = name
+        self.rows = rows
+        self.started = None
+        self.seconds = 0.0
+        self.memory = 0
+        self.memory_delta = 0
+
+
+    def __enter__(self):
+        self.memory = resident_memory()
+        self.started = time.time()
+        self._counter = time.perf_counter()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds = time.perf_counter() - self._counter
+        memory = resident_memory()
+        self.memory_delta = memory - self.memory
+        self.memory = memory
+        self.profiler.record(self)
+        return False
+
+
+    def as_dict(self):
+        return {'stage': self.name,
+                'started': self.started,
+                'seconds': self.seconds,
+                'rows': self.rows,
+                'memory': self.memory,
+                'memory_delta': self.memory_delta}
+
+
+# stands in for a stage when no profiler is attached, rows can still be set
+class NullStage(object):
+    rows = None
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+null_stage = NullStage()
+
+
+class ProfileReport(object):
+    def __init__(self):
+        self.stages = []
+
+
+    def add(self, stage):
+        self.stages.append(stage)
+
+
+    def clear(self):
+        self.stages = []
+
+
+    @property
+    def total_seconds(self):
+        return sum(s.seconds for s in self.stages)
+
+
+    # stages of the same name, such as those repeated for every chunk of a
+    # mems-scan log, summed in the order they first ran
+    def totals(self):
+        totals = {}
+
+        for s in self.stages:
+            total = totals.setdefault(s.name, {'stage': s.name, 'calls': 0, 'seconds': 0.0, 'rows': 0, 'memory_delta': 0})
+            total['calls'] += 1
+            total['seconds'] += s.seconds
+            total['rows'] += s.rows or 0
+            total['memory_delta'] += s.memory_delta
+
+        return list(totals.values())
+
+
+    def as_dicts(self):
+        return [s.as_dict() for s in self.stages]
+
+
+    def write_json_lines(self, output):
+        if isinstance(output, str):
+            with open(output, 'a') as f:
+                self.write_json_lines(f)
+            return
+
+        for s in self.stages:
+            output.write(json.dumps(s.as_dict()) + '\n')
+
+
+    def __str__(self):
+        lines = [f'{"stage":<24} {"calls":>6} {"seconds":>10} {"rows":>12} {"rows/s":>12} {"memory MB":>10}']
+
+        for total in self.totals():
+            rate = total['rows'] / total['seconds'] if total['rows'] and total['seconds'] else 0
+            lines.append(f'{total["stage"]:<24} {total["calls"]:>6} {total["seconds"]:>10.4f} {total["rows"]:>12} '
+                         f'{rate:>12,.0f} {total["memory_delta"] / 1048576:>10.1f}')
+
+        lines.append(f'{"total":<24} {"":>6} {self.total_seconds:>10.4f}')
+        return '\n'.join(lines)
+
+
+# collects stages into a report. output is a path or open file that each
+# completed stage is written to as a JSON line, callback is called with each
+# completed StageTiming
+class Profiler(object):
+    def __init__(self, output=None, callback=None, context=None):
+        self.report = ProfileReport()
+        self.callback = callback
+        self.context = context or {}
+        self.output = output
+        self.f = None
+
+
+    def stage(self, name, rows=None):
+        return StageTiming(self, name, rows)
+
+
+    def record(self, stage):
+        self.report.add(stage)
+
+        if self.output is not None:
+            if self.f is None:
+                self.f = open(self.output, 'a') if isinstance(self.output, str) else self.output
+
+            self.f.write(json.dumps(dict(self.context, **stage.as_dict())) + '\n')
+            self.f.flush()
+
+        if self.callback is not None:
+            self.callback(stage)
+
+
+    def close(self):
+        if self.f is not None and isinstance(self.output, str):
+            self.f.close()
+        self.f = None
+
+
+# a stage of the attached profiler, or the shared no-op when there is none
+def stage(profiler, name, rows=None):
+    if profiler is None:
+        return null_stage
+
+    return profiler.stage(name, rows)
+
+
+# times fetching each item of an iterable, such as the chunks of a csv reader
+def iterate(profiler, name, iterable):
+    if profiler is None:
+        return iterable
+
+    return profiled_iteration(profiler, name, iterable)
+
+
+def profiled_iteration(profiler, name, iterable):
+    iterator = iter(iterable)
+
+    # the last fetch, which finds the end, is recorded with no rows
+    while True:
+        with profiler.stage(name) as s:
+            item = next(iterator, s)
+            s.rows = 0 if item is s else (len(item) if hasattr(item, '__len__') else None)
+
+        if item is s:
+            return
+
+        yield item
@@ -0,0 +1,334 @@
+# Live acquisition from a MEMS 1.6 ECU over a serial link
+#
+# The ECU echoes every command byte before its response. After the
+# 0xCA/0x75/0xD0 initialisation handshake the client polls the 0x80 and
+# 0x7D data frames at a fixed rate and decodes each pair into a fixed size
+# record (see Rosco.record_dtype) which is pushed to a ring buffer and any
+# attached log writers. A 0xF4 heartbeat keeps the link open when polling
+# is slower than the ECU's timeout.
+#
+import collections
+import os
+import select
+import threading
+import time
+
+import numpy as np
+
+import mems.protocol.frames
+import mems.protocol.rosco
+
+try:
+    import serial
+except ImportError:
+    serial = None
+
+try:
+    import termios
+except ImportError:
+    termios = None
+
+
+class RoscoError(Exception):
+    pass
+
+
+# minimal raw serial port on POSIX terminals, used when pyserial is not
+# installed. also opens pseudo terminals such as the ECU simulator
+class PosixSerialPort(object):
+    def __init__(self, port, baudrate=9600, timeout=1.0):
+        self.timeout = timeout
+        self.fd = os.open(port, os.O_RDWR | os.O_NOCTTY)
+
+        attributes = termios.tcgetattr(self.fd)
+        attributes[0] = 0                                               # iflag
+        attributes[1] = 0                                               # oflag
+        attributes[2] = termios.CS8 | termios.CREAD | termios.CLOCAL    # cflag
+        attributes[3] = 0                                               # lflag
+        speed = getattr(termios, f'B{baudrate}')
+        attributes[4] = speed
+        attributes[5] = speed
+        attributes[6][termios.VMIN] = 0
+        attributes[6][termios.VTIME] = 0
+        termios.tcsetattr(self.fd, termios.TCSANOW, attributes)
+
+    def write(self, data):
+        return os.write(self.fd, data)
+
+    def read(self, size):
+        data = b''
+        deadline = time.monotonic() + self.timeout
+
+        while len(data) < size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            readable, _, _ = select.select([self.fd], [], [], remaining)
+            if readable:
+                data = data + os.read(self.fd, size - len(data))
+
+        return data
+
+    def reset_input_buffer(self):
+        termios.tcflush(self.fd, termios.TCIFLUSH)
+
+    def close(self):
+        os.close(self.fd)
+
+
+def open_serial_port(port, baudrate=9600, timeout=1.0):
+    if serial is not None:
+        return serial.Serial(port, baudrate=baudrate, timeout=timeout)
+
+    if termios is None:
+        raise RoscoError('pyserial is required to open a serial port on this platform')
+
+    return PosixSerialPort(port, baudrate, timeout)
+
+
+# fixed capacity buffer of the most recent records, safe to read from
+# another thread while acquisition is running
+class RingBuffer(object):
+    def __init__(self, dtype, capacity=4096):
+        self.records = np.zeros(capacity, dtype=dtype)
+        self.capacity = capacity
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def append(self, record):
+        with self.lock:
+            self.records[self.count % self.capacity] = record
+            self.count = self.count + 1
+
+    # the last n records, oldest first
+    def latest(self, n=None):
+        with self.lock:
+            available = min(self.count, self.capacity)
+            n = available if n is None else min(n, available)
+            end = self.count % self.capacity
+            index = (np.arange(end - n, end)) % self.capacity
+            return self.records[index].copy()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+
+# writes records in the readmems text format read by LogReader.read_logfile
+class ReadmemsLogWriter(object):
+    def __init__(self, filepath):
+        self.f = open(filepath, 'w')
+        self.f.write('readmems log\n')
+
+    def write_version(self, version):
+        self.f.write(f'ECU responded to D0 command with: {version}\n')
+
+    def write(self, record):
+        self.f.write('80: ' + record['80'].tobytes().hex(' ').upper() + ' \n')
+        self.f.write('7D: ' + record['7d'].tobytes().hex(' ').upper() + ' \n')
+
+    def close(self):
+        self.f.close()
+
+
+class RoscoClient(object):
+    def __init__(self, port, rate=10.0, heartbeat_interval=1.0, buffer_size=4096, timeout=1.0, baudrate=9600):
+        self.rosco = mems.protocol.rosco.Rosco()
+        self.port_name = port
+        self.rate = rate
+        self.heartbeat_interval = heartbeat_interval
+        self.timeout = timeout
+        self.baudrate = baudrate
+        self.port = None
+        self.version = ''
+        self.record_dtype = np.dtype(self.rosco.record_dtype)
+        self.buffer = RingBuffer(self.record_dtype, buffer_size)
+        self.writers = []
+        self.last_command = 0.0
+        self.running = False
+        self.thread = None
+        self.stats = {'samples': 0, 'errors': 0, 'heartbeats': 0, 'malformed': 0, 'resynced': 0}
+        self.latencies = collections.deque(maxlen=10000)
+
+        self.frame_sizes = {'80': len(self.rosco.get_dataframe_fields('80')),
+                            '7d': len(self.rosco.get_dataframe_fields('7d'))}
+
+
+    def connect(self):
+        self.port = open_serial_port(self.port_name, self.baudrate, self.timeout)
+        self.initialise()
+
+
+    def close(self):
+        self.running = False
+        if self.port is not None:
+            self.port.close()
+            self.port = None
+
+
+    def add_writer(self, writer):
+        if self.version and hasattr(writer, 'write_version'):
+            writer.write_version(self.version)
+        self.writers.append(writer)
+
+
+    # send a command byte and read back the echo followed by the response
+    def command(self, code, response_length=0):
+        self.port.write(code)
+        self.last_command = time.monotonic()
+
+        response = self.port.read(1 + response_length)
+        if len(response) < 1 + response_length:
+            raise RoscoError(f'timeout waiting for response to command 0x{code.hex()}')
+
+        if response[0:1] != code:
+            raise RoscoError(f'command 0x{code.hex()} echoed as 0x{response[0:1].hex()}')
+
+        return response[1:]
+
+
+    def initialise(self):
+        if hasattr(self.port, 'reset_input_buffer'):
+            self.port.reset_input_buffer()
+
+        for step in self.rosco.initialization_sequence:
+            if step['tx'] == b'\xd0':
+                self.version = self.command(step['tx'], 4).hex(' ').upper()
+            else:
+                self.command(step['tx'])
+
+        for writer in self.writers:
+            if hasattr(writer, 'write_version'):
+                writer.write_version(self.version)
+
+
+    def heartbeat(self):
+        self.command(self.rosco.get_command_code('heartbeat'), 1)
+        self.stats['heartbeats'] += 1
+
+
+    # request a data frame, the first byte of the response is its length.
+    # when the echo and size byte are not where expected the frame is looked
+    # for further on, the bytes before it are left from an earlier response
+    def read_frame(self, command_code):
+        size = self.frame_sizes[command_code]
+        code = bytes.fromhex(command_code)
+
+        self.port.write(code)
+        self.last_command = time.monotonic()
+
+        response = self.port.read(1 + size)
+        start = mems.protocol.frames.find_frame(response, code[0], size)
+
+        if start is None and len(response) == 1 + size:
+            self.stats['malformed'] += 1
+            raise RoscoError(f'no 0x{command_code} frame of size {size} in the response')
+
+        if start:
+            self.stats['resynced'] += 1
+            response = response[start:] + self.port.read(start)
+
+        if start is None or len(response) < 1 + size:
+            raise RoscoError(f'timeout waiting for response to command 0x{command_code}')
+
+        return response[1:]
+
+
+    def sample(self):
+        record = np.zeros((), dtype=self.record_dtype)
+
+        started = time.monotonic()
+        record['80'] = np.frombuffer(self.read_frame('80'), dtype=np.uint8)
+        record['7d'] = np.frombuffer(self.read_frame('7d'), dtype=np.uint8)
+        record['timestamp'] = started
+
+        self.latencies.append(time.monotonic() - started)
+        self.stats['samples'] += 1
+
+        self.buffer.append(record)
+        for writer in self.writers:
+            writer.write(record)
+
+        return record
+
+
+    # a missed or garbled response is counted and what is left of it dropped,
+    # the next command starts afresh
+    def recover(self):
+        self.stats['errors'] += 1
+        if hasattr(self.port, 'reset_input_buffer'):
+            self.port.reset_input_buffer()
+
+
+    # poll the ECU at self.rate samples per second (as fast as possible when
+    # rate is None) until stopped, duration has passed or samples are taken
+    def run(self, duration=None, samples=None):
+        self.running = True
+        period = 1.0 / self.rate if self.rate else 0.0
+        started = time.monotonic()
+        next_sample = started
+        taken = 0
+
+        while self.running:
+            now = time.monotonic()
+            if duration is not None and now - started >= duration:
+                break
+            if samples is not None and taken >= samples:
+                break
+
+            if now < next_sample:
+                if self.heartbeat_interval and now - self.last_command >= self.heartbeat_interval:
+                    try:
+                        self.heartbeat()
+                    except RoscoError:
+                        self.recover()
+                else:
+                    time.sleep(min(next_sample - now, self.heartbeat_interval or period))
+                continue
+
+            try:
+                self.sample()
+                taken = taken + 1
+            except RoscoError:
+                self.recover()
+
+            # skip missed slots rather than bursting to catch up
+            next_sample = max(next_sample + period, time.monotonic() - period)
+
+        self.running = False
+
+
+    def start(self, duration=None, samples=None):
+        self.thread = threading.Thread(target=self.run, args=(duration, samples), daemon=True)
+        self.thread.start()
+        return self.thread
+
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+
+    # poll as fast as the link allows and report the sustained sample rate
+    # and the request to response latency of each sample
+    def measure(self, duration=5.0):
+        rate = self.rate
+        self.rate = None
+        self.latencies.clear()
+        samples = self.stats['samples']
+
+        started = time.monotonic()
+        self.run(duration=duration)
+        elapsed = time.monotonic() - started
+        self.rate = rate
+
+        latencies = np.array(self.latencies) * 1000
+        taken = self.stats['samples'] - samples
+
+        return {'samples': taken,
+                'rate_hz': taken / elapsed if elapsed else 0.0,
+                'latency_ms_mean': float(latencies.mean()) if taken else np.nan,
+                'latency_ms_p95': float(np.percentile(latencies, 95)) if taken else np.nan,
+                'latency_ms_max': float(latencies.max()) if taken else np.nan,
+                'errors': self.stats['errors']}
@@ -0,0 +1,226 @@
+# Validation and resynchronisation of the 0x80 and 0x7D data frames
+#
+# A data frame starts with its dataframe_size byte, the number of bytes in the
+# frame including itself (see Rosco._dataframes). Frames whose size byte or
+# length is wrong are dropped and counted, anything that is not a frame is
+# skipped, and a sample is only made from a 0x7D frame that directly follows
+# a 0x80 frame, so one damaged response never shifts the samples after it.
+#
+# ReadmemsDecoder reads the text logs of readmems a block at a time. Lines of
+# the usual 'XX ' layout are decoded together with numpy, any other line is
+# decoded on its own and may hold several frames where lines were merged.
+# find_frame finds the start of a frame in the bytes of a live link.
+#
+import re
+
+import numpy as np
+
+
+version_prefix = b'ECU responded to D0 command with:'
+
+# readmems writes the command of each response at the start of its line
+commands = {b'80': '80', b'7d': '7d', b'7D': '7d'}
+frame_marker = re.compile(rb'(80|7[dD]):')
+frame_kinds = {'80': 0, '7d': 1, None: 2}
+
+# value of every hex digit, 255 for anything else
+hex_digits = np.full(256, 255, dtype=np.uint8)
+for n, digit in enumerate(b'0123456789abcdef'):
+    hex_digits[digit] = n
+    hex_digits[bytes([digit]).upper()[0]] = n
+
+
+def new_frame_stats():
+    return {'frames_80': 0, 'frames_7d': 0, 'samples': 0, 'malformed': 0, 'unpaired': 0, 'resynced': 0}
+
+
+# the offset of the echoed command byte of a frame of size bytes in data, or
+# None. bytes before the offset are the remains of an earlier response
+def find_frame(data, code, size):
+    start = data.find(bytes([code, size]))
+    return None if start < 0 else start
+
+
+# offset is the position in the log of the first block fed. with keep_frames
+# False only the sample ends are kept, as for building a LogIndex
+class ReadmemsDecoder(object):
+    def __init__(self, rosco, offset=0, keep_frames=True):
+        self.sizes = {command: len(rosco.get_dataframe_fields(command)) for command in ['80', '7d']}
+        self.stats = new_frame_stats()
+        self.version = None
+        self.offset = offset
+        self.remainder = b''
+        self.pending = None
+        self.blocks = {'80': [], '7d': []}
+        self.ends = []
+        self.samples = 0
+        self.keep_frames = keep_frames
+
+
+    # decode the complete lines of the next block of the log, the rest is
+    # kept for the next block. final decodes whatever is left
+    def feed(self, data, final=False):
+        data = self.remainder + data
+        cut = len(data) if final else data.rfind(b'\n') + 1
+        self.remainder = data[cut:]
+
+        if cut == 0:
+            return
+
+        text = np.frombuffer(data, dtype=np.uint8, count=cut)
+        ends = np.flatnonzero(text == ord('\n')) + 1
+        if len(ends) == 0 or ends[-1] != cut:
+            ends = np.r_[ends, cut]
+        starts = np.r_[0, ends[:-1]]
+
+        frames = []
+        decoded = np.zeros(len(starts), dtype=bool)
+
+        for command, code in [('80', b'80: '), ('7d', b'7D: ')]:
+            lines, rows = self.decode_lines(text, starts, ends, command, code)
+            decoded[lines] = True
+            frames.append((lines, np.zeros(len(lines), dtype=np.int64), command, rows))
+
+        # everything else, a line at a time
+        for line in np.flatnonzero(~decoded).tolist():
+            for position, command, frame in self.decode_line(bytes(data[starts[line]:ends[line]])):
+                frames.append((np.array([line]), np.array([position]), command, None if frame is None else frame[None, :]))
+
+        self.pair(frames, ends)
+        self.offset = self.offset + cut
+
+
+    def finish(self):
+        self.feed(b'', final=True)
+
+        if self.pending is not None:
+            self.stats['unpaired'] += 1
+            self.pending = None
+
+
+    # decode the lines of the usual layout, the command followed by 'XX '
+    # for every byte, returns the lines and their frames
+    def decode_lines(self, text, starts, ends, command, code):
+        size = self.sizes[command]
+        lengths = ends - starts
+        candidates = starts[((lengths == len(code) + 3 * size) | (lengths == len(code) + 3 * size + 1)) &
+                            (text[np.minimum(starts, len(text) - 1)] == code[0])]
+
+        for n, c in enumerate(code[1:], 1):
+            if len(candidates) == 0:
+                break
+            candidates = candidates[(text[candidates + n] == c) | (text[candidates + n] == ord(chr(c).lower()))]
+
+        if len(candidates) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, size), dtype=np.uint8)
+
+        positions = candidates[:, None] + len(code) + 3 * np.arange(size)
+        high = hex_digits[text[positions]]
+        low = hex_digits[text[positions + 1]]
+        rows = (high << 4) | low
+
+        valid = (high != 255).all(axis=1) & (low != 255).all(axis=1) & (rows[:, 0] == size)
+        lines = np.searchsorted(starts, candidates[valid])
+
+        return lines, rows[valid].astype(np.uint8)
+
+
+    # the frames of any other line as (position, command, frame), a line may
+    # hold several frames where lines were merged. a damaged frame is listed
+    # with no command, no 0x80 and 0x7D frames are paired across it
+    def decode_line(self, line):
+        if line.startswith(version_prefix):
+            self.version = line[len(version_prefix):].strip().decode(errors='replace')
+            return []
+
+        markers = list(frame_marker.finditer(line))
+        frames = []
+
+        # as long as a frame but not one, the rest of the log is text
+        if not markers and len(line.strip()) > 50:
+            self.stats['malformed'] += 1
+            frames.append((0, None, None))
+
+        for n, marker in enumerate(markers):
+            end = markers[n + 1].start() if n + 1 < len(markers) else len(line)
+            command = commands[marker.group(1)]
+            size = self.sizes[command]
+
+            try:
+                frame = bytes.fromhex(line[marker.end():end].decode('ascii'))
+            except (UnicodeDecodeError, ValueError):
+                frame = b''
+
+            if len(frame) < size or frame[0] != size:
+                self.stats['malformed'] += 1
+                frames.append((n, None, None))
+                continue
+
+            # trailing bytes of a line are garbage, or a merged line
+            if len(frame) > size or len(markers) > 1:
+                self.stats['resynced'] += 1
+
+            frames.append((n, command, np.frombuffer(frame[:size], dtype=np.uint8)))
+
+        return frames
+
+
+    # keep the 0x7D frames that directly follow a 0x80 frame as samples. a
+    # 0x80 frame at the end of the block waits for the next block
+    def pair(self, frames, ends):
+        rows = {}
+        for command in ['80', '7d']:
+            selected = [f[3] for f in frames if f[2] == command]
+            rows[command] = np.concatenate(selected) if selected else np.zeros((0, self.sizes[command]), dtype=np.uint8)
+            self.stats[f'frames_{command}'] += len(rows[command])
+
+        # 0 for a 0x80 frame, 1 for 0x7D and 2 for a damaged frame
+        lines = np.concatenate([f[0] for f in frames])
+        positions = np.concatenate([f[1] for f in frames])
+        kinds = np.concatenate([np.full(len(f[0]), frame_kinds[f[2]], dtype=np.int8) for f in frames])
+
+        # the row of every frame among the frames of its command
+        index = np.zeros(len(lines), dtype=np.int64)
+        for kind in [0, 1]:
+            index[kinds == kind] = np.arange(int((kinds == kind).sum()))
+
+        # a 0x80 frame left waiting by the block before comes first
+        if self.pending is not None:
+            rows['80'] = np.concatenate([self.pending[None, :], rows['80']])
+            index[kinds == 0] += 1
+            lines = np.r_[-1, lines]
+            positions = np.r_[0, positions]
+            kinds = np.r_[np.int8(0), kinds]
+            index = np.r_[0, index]
+
+        order = np.lexsort((positions, lines))
+        lines, kinds, index = lines[order], kinds[order], index[order]
+
+        follows = np.flatnonzero((kinds[1:] == 1) & (kinds[:-1] == 0)) + 1
+        waiting = len(kinds) > 0 and kinds[-1] == 0
+
+        self.stats['unpaired'] += int((kinds < 2).sum()) - 2 * len(follows) - int(waiting)
+        self.pending = rows['80'][index[-1]].copy() if waiting else None
+
+        if self.keep_frames:
+            self.blocks['80'].append(rows['80'][index[follows - 1]])
+            self.blocks['7d'].append(rows['7d'][index[follows]])
+        self.ends.append(self.offset + ends[lines[follows]])
+        self.samples = self.samples + len(follows)
+        self.stats['samples'] = self.samples
+
+
+    # the paired frames as one block per command, at most max_rows samples
+    def frame_blocks(self, max_rows=None):
+        blocks = {}
+        for command in ['80', '7d']:
+            parts = self.blocks[command]
+            block = np.concatenate(parts) if parts else np.zeros((0, self.sizes[command]), dtype=np.uint8)
+            blocks[command] = block[:max_rows]
+
+        return blocks
+
+
+    # the offset just past the 0x7D line of every sample
+    def sample_ends(self):
+        return np.concatenate(self.ends) if self.ends else np.zeros(0, dtype=np.int64)
@@ -1,5 +1,18 @@
 # ROSCO - Rover Communication Protocol
 
+import re
+
+import numpy as np
+
+
+# mems-scan names the bytes it has no name for by their place in the frame,
+# such as 80x0B_uk1 or the two byte 7dx14-15_uk10
+memsscan_position = re.compile(r'^(80|7d)x([0-9A-Fa-f]{2})(?:-([0-9A-Fa-f]{2}))?_')
+
+# the fault rules read the bits of the mems-scan fault_codes column against
+# both fault bytes of the 0x80 frame
+fault_code_fields = ['coolant_temp_inlet_air_temp_sensor_fault', 'fuel_pump_throttle_pot_circuit_fault']
+
 class Rosco(object):
     def __init__(self):
         self._version   = 'MNE101070'
@@ -80,6 +93,57 @@ class Rosco(object):
                                                '80x1B']}
             ]
 
+        #
+        # Conversion of the data frame fields into engineering units.
+        # value = raw * scale + offset, 16 bit fields are combined big-endian
+        # from the high and low bytes listed in 'bytes'. mems-scan logs hold
+        # converted values except for the fields marked 'memsscan_raw'.
+        #
+
+        self._conversions = {
+                'engine_speed'                          : {'width': 2, 'bytes': ['engine_speed_high_byte', 'engine_speed_low_byte'], 'scale': 1, 'offset': 0, 'unit': 'rpm', 'dtype': 'int32'},
+                'coolant_temperature'                   : {'width': 1, 'scale': 1, 'offset': -55, 'unit': '°C', 'dtype': 'int16'},
+                'ambient_temperature'                   : {'width': 1, 'scale': 1, 'offset': -55, 'unit': '°C', 'dtype': 'int16'},
+                'intake_air_temperature'                : {'width': 1, 'scale': 1, 'offset': -55, 'unit': '°C', 'dtype': 'int16'},
+                'fuel_temperature'                      : {'width': 1, 'scale': 1, 'offset': -55, 'unit': '°C', 'dtype': 'int16'},
+                'map_sensor'                            : {'width': 1, 'scale': 1, 'offset': 0, 'unit': 'kPa', 'dtype': 'int16'},
+                'battery_voltage'                       : {'width': 1, 'scale': 0.1, 'offset': 0, 'unit': 'V', 'dtype': 'float32'},
+                'throttle_pot_voltage'                  : {'width': 1, 'scale': 0.02, 'offset': 0, 'unit': 'V', 'dtype': 'float32'},
+                'idle_switch'                           : {'width': 1, 'scale': 1, 'offset': 0, 'unit': '', 'dtype': 'int16'},
+                'aircon_switch'                         : {'width': 1, 'scale': 1, 'offset': 0, 'unit': '', 'dtype': 'int16'},
+                'park_neutral_switch'                   : {'width': 1, 'scale': 1, 'offset': 0, 'unit': '', 'dtype': 'int16'},
+                'coolant_temp_inlet_air_temp_sensor_fault' : {'width': 1, 'scale': 1, 'offset': 0, 'unit': '', 'dtype': 'int16'},
+                'fuel_pump_throttle_pot_circuit_fault'  : {'width': 1, 'scale': 1, 'offset': 0, 'unit': '', 'dtype': 'int16'},
+                'fault_codes'                           : {'width': 2, 'scale': 1, 'offset': 0, 'unit': '', 'dtype': 'int32'},
+                'idle_set_point'                        : {'width': 1, 'scale': 1, 'offset': 0, 'unit': '', 'dtype': 'int16'},
+                'idle_decay'                            : {'width': 1, 'scale': 1, 'offset': 0, 'unit': '', 'dtype': 'int16'},
+                'idle_air_contol_position'              : {'width': 1, 'scale': 1 / 1.8, 'offset': 0, 'unit': '%', 'dtype': 'float32'},
+                'idle_speed_deviation'                  : {'width': 2, 'bytes': ['idle_speed_deviation_high_byte', 'idle_speed_deviation_low_byte'], 'scale': 1, 'offset': 0, 'unit': 'rpm', 'dtype': 'int32'},
+                'ignition_advance_offset'               : {'width': 1, 'scale': 1, 'offset': 0, 'unit': 'deg', 'dtype': 'int16'},
+                'ignition_advance'                      : {'width': 1, 'scale': 0.5, 'offset': -24, 'unit': 'deg', 'dtype': 'float32'},
+                'coil_time'                             : {'width': 2, 'bytes': ['coil_time_high_byte', 'coil_time_low_byte'], 'scale': 0.002, 'offset': 0, 'unit': 'ms', 'dtype': 'float32'},
+                'crankshaft_position_sensor'            : {'width': 1, 'scale': 1, 'offset': 0, 'unit': '', 'dtype': 'int16'},
+                'ignition_switch'                       : {'width': 1, 'scale': 1, 'offset': 0, 'unit': '', 'dtype': 'int16'},
+                'throttle_angle'                        : {'width': 1, 'scale': 0.6, 'offset': 0, 'unit': 'deg', 'dtype': 'float32'},
+                'air_fuel_ratio'                        : {'width': 1, 'scale': 0.1, 'offset': 0, 'unit': ':1', 'dtype': 'float32', 'memsscan_raw': True},
+                'dtc2'                                  : {'width': 1, 'scale': 1, 'offset': 0, 'unit': '', 'dtype': 'int16'},
+                'lambda_voltage'                        : {'width': 1, 'scale': 5, 'offset': 0, 'unit': 'mV', 'dtype': 'int16'},
+                'lambda_frequency'                      : {'width': 1, 'scale': 1, 'offset': 0, 'unit': '', 'dtype': 'int16'},
+                'lambda_duty_cycle'                     : {'width': 1, 'scale': 1, 'offset': 0, 'unit': '', 'dtype': 'int16'},
+                'lambda_status'                         : {'width': 1, 'scale': 1, 'offset': 0, 'unit': '', 'dtype': 'int16'},
+                'loop_indicator'                        : {'width': 1, 'scale': 1, 'offset': 0, 'unit': '', 'dtype': 'int16'},
+                'long_term_trim'                        : {'width': 1, 'scale': 1, 'offset': -128, 'unit': '', 'dtype': 'int16', 'memsscan_raw': True},
+                'short_term_trim'                       : {'width': 1, 'scale': 0.1, 'offset': -10, 'unit': '%', 'dtype': 'float32', 'memsscan_raw': True},
+                'carbon_canister_purge_valve_duty_cycle': {'width': 1, 'scale': 1, 'offset': 0, 'unit': '', 'dtype': 'int16'},
+                'dtc3'                                  : {'width': 1, 'scale': 1, 'offset': 0, 'unit': '', 'dtype': 'int16'},
+                'idle_base_position'                    : {'width': 1, 'scale': 1, 'offset': 0, 'unit': '', 'dtype': 'int16'},
+                'dtc4'                                  : {'width': 1, 'scale': 1, 'offset': 0, 'unit': '', 'dtype': 'int16'},
+                'idle_speed_offset'                     : {'width': 1, 'scale': 25, 'offset': -3200, 'unit': 'rpm', 'dtype': 'int16', 'memsscan_raw': True},
+                'idle_error'                            : {'width': 1, 'scale': 1, 'offset': 0, 'unit': '', 'dtype': 'int16'},
+                'dtc5'                                  : {'width': 1, 'scale': 1, 'offset': 0, 'unit': '', 'dtype': 'int16'},
+                'jack_count_number'                     : {'width': 1, 'scale': 1, 'offset': 0, 'unit': '', 'dtype': 'int16'},
+            }
+
         self._commands = [
                 {'open_fuel_pump_relay' : b'\x01'},
                 {'open_ptc_relay'       : b'\x02'},
@@ -139,3 +203,84 @@ class Rosco(object):
                    {'tx': b'\xd0', 'response': self._version}
                ]
 
+
+    # the frame positions of the bytes every column of df is written to, as
+    # (column, positions, conversion) with the high byte first for two byte
+    # values. columns without a conversion are written as they are
+    def column_positions(self, df, command_code):
+        fields = self.get_dataframe_fields(command_code)
+        placed = []
+
+        for field, conversion in self._conversions.items():
+            if field not in df.columns:
+                continue
+
+            if conversion['width'] == 2 and 'bytes' in conversion:
+                if conversion['bytes'][0] in fields:
+                    placed.append((field, [fields.index(b) for b in conversion['bytes']], conversion))
+            elif field in fields:
+                placed.append((field, [fields.index(field)], conversion))
+
+        # raw fields under their own name, then the unnamed mems-scan bytes
+        identity = {'scale': 1, 'offset': 0}
+        for n, field in enumerate(fields):
+            if n > 0 and field not in self._conversions and field in df.columns:
+                placed.append((field, [n], identity))
+
+        for column in df.columns:
+            match = memsscan_position.match(str(column))
+            if match and match.group(1) == command_code:
+                positions = [int(p, 16) for p in match.groups()[1:] if p is not None]
+                if all(p < len(fields) for p in positions):
+                    placed.append((column, positions, identity))
+
+        return placed
+
+
+    # the columns of df that no frame can hold
+    def unencoded_columns(self, df):
+        encoded = {'timestamp', 'fault_codes'}
+        for command_code in ['80', '7d']:
+            encoded.update(column for column, _, _ in self.column_positions(df, command_code))
+
+        return [c for c in df.columns if c not in encoded]
+
+
+    # rebuild raw frames from converted values by inverting the conversion
+    # table. a byte is written by the first column that holds it, named
+    # channels before the unnamed mems-scan bytes. fields that are not in the
+    # dataframe are sent as zero, see unencoded_columns for the columns lost
+    def encode_frames(self, df, command_code):
+        fields = self.get_dataframe_fields(command_code)
+        frames = np.zeros((len(df), len(fields)), dtype=np.uint8)
+        frames[:, 0] = len(fields)
+        written = {0}
+
+        for column, positions, conversion in self.column_positions(df, command_code):
+            raw = np.rint((df[column].to_numpy(np.float64) - conversion['offset']) / conversion['scale'])
+            raw = np.clip(np.nan_to_num(raw), 0, (1 << (8 * len(positions))) - 1).astype(np.uint32)
+
+            for n, position in enumerate(positions):
+                if position not in written:
+                    frames[:, position] = (raw >> (8 * (len(positions) - 1 - n))) & 0xff
+                    written.add(position)
+
+        if command_code == '80' and 'fault_codes' in df.columns:
+            codes = np.clip(np.nan_to_num(df['fault_codes'].to_numpy(np.float64)), 0, 0xff).astype(np.uint8)
+            for field in fault_code_fields:
+                frames[:, fields.index(field)] |= codes
+
+        return frames
+
+    def get_dataframe_fields(self, command_code):
+        for c in self._dataframes:
+            if c['command'] == command_code:
+                return c['fields']
+
+    # layout of one sample as a fixed size binary record: the monotonic time
+    # the sample was taken followed by the raw 0x80 and 0x7d response frames
+    @property
+    def record_dtype(self):
+        return [('timestamp', '<f8'),
+                ('80', 'u1', (len(self.get_dataframe_fields('80')),)),
+                ('7d', 'u1', (len(self.get_dataframe_fields('7d')),))]
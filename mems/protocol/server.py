@@ -0,0 +1,399 @@
+# Concurrent acquisition from several ECUs with fan-out to subscribers
+#
+# Each serial link (or simulator pty) is driven by its own asyncio task which
+# paces the 0x80/0x7D requests independently. Decoded records are published
+# to every subscriber through a bounded queue. A subscriber either applies
+# backpressure (the links wait for it) or drops its oldest records, which are
+# counted per link.
+#
+#   server = AcquisitionServer()
+#   server.add_link('car1', '/dev/ttyUSB0', rate=10)
+#   server.add_link('car2', '/dev/ttyUSB1', rate=10)
+#   server.subscribe(LogSink({'car1': ReadmemsLogWriter('car1.log')}))
+#   server.subscribe(DiagnosticsSink())
+#   server.subscribe(StreamSink(port=8765))
+#   asyncio.run(server.run(duration=600))
+#
+import asyncio
+import collections
+import json
+import os
+import time
+
+import numpy as np
+
+import mems.diagnostics
+import mems.logreader
+import mems.protocol.client
+import mems.protocol.frames
+import mems.protocol.rosco
+
+
+class AsyncRoscoLink(object):
+    def __init__(self, name, port, rate=10.0, heartbeat_interval=1.0, timeout=1.0, baudrate=9600):
+        self.rosco = mems.protocol.rosco.Rosco()
+        self.name = name
+        self.port_name = port
+        self.rate = rate
+        self.heartbeat_interval = heartbeat_interval
+        self.timeout = timeout
+        self.baudrate = baudrate
+        self.version = ''
+        self.record_dtype = np.dtype(self.rosco.record_dtype)
+        self.port = None
+        self.reader = None
+        self.transport = None
+        self.last_command = 0.0
+        self.stats = {'samples': 0, 'errors': 0, 'heartbeats': 0, 'dropped': 0, 'malformed': 0, 'resynced': 0}
+        self.failure = None
+        self.sample_times = collections.deque(maxlen=256)
+
+        self.frame_sizes = {'80': len(self.rosco.get_dataframe_fields('80')),
+                            '7d': len(self.rosco.get_dataframe_fields('7d'))}
+
+
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+
+        # configure the terminal then hand the descriptor to the event loop
+        self.port = mems.protocol.client.PosixSerialPort(self.port_name, self.baudrate, self.timeout)
+        os.set_blocking(self.port.fd, False)
+
+        self.reader = asyncio.StreamReader()
+        protocol = asyncio.StreamReaderProtocol(self.reader)
+        self.transport, _ = await loop.connect_read_pipe(lambda: protocol, os.fdopen(os.dup(self.port.fd), 'rb', buffering=0))
+
+        for step in self.rosco.initialization_sequence:
+            if step['tx'] == b'\xd0':
+                self.version = (await self.command(step['tx'], 4)).hex(' ').upper()
+            else:
+                await self.command(step['tx'])
+
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+        if self.port is not None:
+            self.port.close()
+
+
+    async def command(self, code, response_length=0):
+        os.write(self.port.fd, code)
+        self.last_command = time.monotonic()
+
+        try:
+            response = await asyncio.wait_for(self.reader.readexactly(1 + response_length), self.timeout)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+            raise mems.protocol.client.RoscoError(f'timeout waiting for response to command 0x{code.hex()}')
+
+        if response[0:1] != code:
+            raise mems.protocol.client.RoscoError(f'command 0x{code.hex()} echoed as 0x{response[0:1].hex()}')
+
+        return response[1:]
+
+
+    # as RoscoClient.read_frame, a frame found after stray bytes is read on
+    async def read_frame(self, command_code):
+        size = self.frame_sizes[command_code]
+        code = bytes.fromhex(command_code)
+
+        os.write(self.port.fd, code)
+        self.last_command = time.monotonic()
+
+        try:
+            response = await asyncio.wait_for(self.reader.readexactly(1 + size), self.timeout)
+            start = mems.protocol.frames.find_frame(response, code[0], size)
+
+            if start is None:
+                self.stats['malformed'] += 1
+                raise mems.protocol.client.RoscoError(f'no 0x{command_code} frame of size {size} in the response')
+
+            if start:
+                self.stats['resynced'] += 1
+                response = response[start:] + await asyncio.wait_for(self.reader.readexactly(start), self.timeout)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+            raise mems.protocol.client.RoscoError(f'timeout waiting for response to command 0x{command_code}')
+
+        return response[1:]
+
+
+    async def sample(self):
+        record = np.zeros((), dtype=self.record_dtype)
+        record['timestamp'] = time.monotonic()
+        record['80'] = np.frombuffer(await self.read_frame('80'), dtype=np.uint8)
+        record['7d'] = np.frombuffer(await self.read_frame('7d'), dtype=np.uint8)
+
+        self.stats['samples'] += 1
+        self.sample_times.append(record['timestamp'].item())
+
+        return record
+
+
+    # samples per second over the most recent samples
+    def achieved_rate(self):
+        if len(self.sample_times) < 2:
+            return 0.0
+        return (len(self.sample_times) - 1) / (self.sample_times[-1] - self.sample_times[0])
+
+
+    async def run(self, publish, stopping):
+        period = 1.0 / self.rate if self.rate else 0.0
+        loop = asyncio.get_running_loop()
+        next_sample = loop.time()
+
+        while not stopping.is_set():
+            now = loop.time()
+
+            if now < next_sample:
+                if self.heartbeat_interval and time.monotonic() - self.last_command >= self.heartbeat_interval:
+                    try:
+                        await self.command(self.rosco.get_command_code('heartbeat'), 1)
+                        self.stats['heartbeats'] += 1
+                    except mems.protocol.client.RoscoError:
+                        self.stats['errors'] += 1
+                else:
+                    await asyncio.sleep(min(next_sample - now, self.heartbeat_interval or period))
+                continue
+
+            try:
+                await publish(self, await self.sample())
+            except mems.protocol.client.RoscoError:
+                self.stats['errors'] += 1
+                await asyncio.sleep(0)
+
+            # skip missed slots rather than bursting to catch up
+            next_sample = max(next_sample + period, loop.time() - period)
+
+
+# a subscriber receives (link name, record) pairs through a bounded queue.
+# with block=True a full queue holds up the links (backpressure), otherwise
+# the oldest queued record is dropped and counted against its link. records
+# whose handling raised are counted in errors and the subscriber carries on
+class Subscriber(object):
+    def __init__(self, maxsize=1024, block=False):
+        self.queue = asyncio.Queue(maxsize)
+        self.block = block
+        self.dropped = collections.Counter()
+        self.errors = 0
+        self.last_error = None
+
+
+    async def put(self, link, record):
+        if self.block:
+            await self.queue.put((link.name, record))
+            return
+
+        if self.queue.full():
+            name, _ = self.queue.get_nowait()
+            self.dropped[name] += 1
+            link.stats['dropped'] += 1
+
+        self.queue.put_nowait((link.name, record))
+
+
+    async def start(self, server):
+        pass
+
+
+    async def consume(self):
+        while True:
+            items = [await self.queue.get()]
+            while not self.queue.empty():
+                items.append(self.queue.get_nowait())
+
+            try:
+                self.handle(items)
+            except Exception as e:
+                self.errors += len(items)
+                self.last_error = f'{type(e).__name__}: {e}'
+
+
+    def handle(self, items):
+        pass
+
+
+    async def close(self):
+        pass
+
+
+# writes each link's records to its own log writer
+class LogSink(Subscriber):
+    def __init__(self, writers, maxsize=4096):
+        super().__init__(maxsize, block=True)
+        self.writers = writers
+
+
+    async def start(self, server):
+        for name, link in server.links.items():
+            if name in self.writers and hasattr(self.writers[name], 'write_version'):
+                self.writers[name].write_version(link.version)
+
+
+    def handle(self, items):
+        for name, record in items:
+            if name in self.writers:
+                self.writers[name].write(record)
+
+
+    async def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+
+# runs the incremental diagnostics for every link, faults holds the current
+# fault list of each link
+class DiagnosticsSink(Subscriber):
+    def __init__(self, maxsize=1024):
+        super().__init__(maxsize)
+        self.logreader = mems.logreader.LogReader()
+        self.analysers = collections.defaultdict(mems.diagnostics.IncrementalMemsDiagnostics)
+        self.faults = {}
+
+
+    def handle(self, items):
+        by_link = collections.defaultdict(list)
+        for name, record in items:
+            by_link[name].append(record)
+
+        for name, records in by_link.items():
+            df = self.logreader.create_dataframe_from_records(np.stack(records))
+            self.analysers[name].update(self.logreader.convert_dataframe(df))
+            self.faults[name] = self.analysers[name].current_faults()
+
+
+# streams records to TCP clients as JSON lines, each client has its own
+# bounded queue so a slow client only loses its own records
+class StreamSink(Subscriber):
+    def __init__(self, host='127.0.0.1', port=8765, maxsize=1024, client_queue_size=256):
+        super().__init__(maxsize)
+        self.host = host
+        self.port = port
+        self.client_queue_size = client_queue_size
+        self.clients = set()
+        self.tcp_server = None
+
+
+    async def start(self, server):
+        self.tcp_server = await asyncio.start_server(self.serve_client, self.host, self.port)
+        self.port = self.tcp_server.sockets[0].getsockname()[1]
+
+
+    async def serve_client(self, reader, writer):
+        queue = asyncio.Queue(self.client_queue_size)
+        self.clients.add(queue)
+
+        try:
+            while True:
+                line = await queue.get()
+                writer.write(line)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.clients.discard(queue)
+            writer.close()
+
+
+    def handle(self, items):
+        for name, record in items:
+            line = (json.dumps({'link': name,
+                                'timestamp': record['timestamp'].item(),
+                                '80': record['80'].tobytes().hex(),
+                                '7d': record['7d'].tobytes().hex()}) + '\n').encode()
+
+            for queue in self.clients:
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(line)
+
+
+    async def close(self):
+        if self.tcp_server is not None:
+            self.tcp_server.close()
+            await self.tcp_server.wait_closed()
+
+
+class AcquisitionServer(object):
+    def __init__(self):
+        self.links = {}
+        self.subscribers = []
+        self.stopping = None
+
+
+    def add_link(self, name, port, rate=10.0, heartbeat_interval=1.0, timeout=1.0):
+        self.links[name] = AsyncRoscoLink(name, port, rate, heartbeat_interval, timeout)
+        return self.links[name]
+
+
+    def subscribe(self, subscriber):
+        self.subscribers.append(subscriber)
+        return subscriber
+
+
+    async def publish(self, link, record):
+        for subscriber in self.subscribers:
+            await subscriber.put(link, record)
+
+
+    def stop(self):
+        if self.stopping is not None:
+            self.stopping.set()
+
+
+    # the stats of every link, failure is the error that ended a link early
+    def report(self):
+        return {name: {'rate_hz': link.achieved_rate(), **link.stats, 'failure': link.failure} for name, link in self.links.items()}
+
+
+    # a link that fails to connect or fails while running is reported and the
+    # others carry on. queued records are handed to the subscribers for at
+    # most drain_timeout seconds after stopping
+    async def run(self, duration=None, drain_timeout=5.0):
+        self.stopping = asyncio.Event()
+        consumers = []
+        producers = []
+
+        try:
+            links = list(self.links.values())
+            results = await asyncio.gather(*[link.connect() for link in links], return_exceptions=True)
+
+            connected = []
+            for link, result in zip(links, results):
+                if isinstance(result, Exception):
+                    link.failure = f'{type(result).__name__}: {result}'
+                else:
+                    connected.append(link)
+
+            for subscriber in self.subscribers:
+                await subscriber.start(self)
+
+            consumers = [asyncio.create_task(s.consume()) for s in self.subscribers]
+            producers = [asyncio.create_task(link.run(self.publish, self.stopping)) for link in connected]
+
+            if duration is None:
+                await self.stopping.wait()
+            else:
+                try:
+                    await asyncio.wait_for(self.stopping.wait(), duration)
+                except asyncio.TimeoutError:
+                    self.stopping.set()
+
+            results = await asyncio.gather(*producers, return_exceptions=True)
+            for link, result in zip(connected, results):
+                if isinstance(result, Exception):
+                    link.failure = f'{type(result).__name__}: {result}'
+
+            # let the subscribers finish what has been queued
+            deadline = time.monotonic() + drain_timeout
+            for subscriber in self.subscribers:
+                while not subscriber.queue.empty() and time.monotonic() < deadline:
+                    await asyncio.sleep(0.01)
+        finally:
+            for task in producers + consumers:
+                task.cancel()
+            for subscriber in self.subscribers:
+                await subscriber.close()
+            for link in self.links.values():
+                link.close()
+
+        return self.report()
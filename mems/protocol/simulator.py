@@ -0,0 +1,110 @@
+# ECU simulator on a pseudo terminal
+#
+# Replays the frames of a readmems or mems-scan log in answer to the Rosco
+# commands, so RoscoClient can be exercised without a car:
+#
+#   sim = EcuSimulator.from_logfile('./logs/example-2019-08-14_16.57.csv')
+#   sim.start()
+#   client = RoscoClient(sim.port)
+#
+import os
+import random
+import threading
+import time
+import tty
+
+import mems.logreader
+import mems.protocol.rosco
+
+
+class EcuSimulator(object):
+    # noise is the chance of a stray byte being sent before a response, to
+    # exercise the resynchronisation of the clients
+    def __init__(self, frames80, frames7d, version='99 00 02 03', response_delay=0.0, noise=0.0):
+        self.rosco = mems.protocol.rosco.Rosco()
+        self.frames = {b'\x80': frames80, b'\x7d': frames7d}
+        self.version = bytes.fromhex(version)
+        self.response_delay = response_delay
+        self.noise = noise
+        self.random = random.Random(0)
+        self.index = 0
+        self.requests = 0
+        self.running = False
+        self.thread = None
+
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+
+
+    # as mems.binlog.convert_logfile, mems-scan columns the frames cannot
+    # hold are refused unless allow_loss is set
+    @classmethod
+    def from_logfile(cls, filepath, response_delay=0.0, noise=0.0, allow_loss=False):
+        lr = mems.logreader.LogReader()
+
+        if filepath.lower().endswith('.csv'):
+            lr.read_memsscanfile(filepath)
+
+            lost = lr.rosco.unencoded_columns(lr.df)
+            if lost and not allow_loss:
+                raise ValueError(f'{filepath} has columns the simulator cannot send: {", ".join(lost)}')
+            frames80 = lr.rosco.encode_frames(lr.df, '80')
+            frames7d = lr.rosco.encode_frames(lr.df, '7d')
+            version = lr.rosco._versions.get(lr.version or lr.rosco._version)
+        else:
+            lr.filepath = filepath
+            blocks = lr.read_frame_blocks()
+            frames80 = blocks['80']
+            frames7d = blocks['7d']
+            version = lr.version
+
+        return cls(frames80, frames7d, version or '99 00 02 03', response_delay, noise)
+
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+
+    def stop(self):
+        self.running = False
+        os.close(self.slave)
+        os.close(self.master)
+
+
+    def respond(self, command):
+        if command in self.frames:
+            frames = self.frames[command]
+            response = frames[self.index % len(frames)].tobytes()
+            if command == b'\x7d':
+                self.index = self.index + 1
+        elif command == b'\xd0':
+            response = self.version
+        elif command in (b'\xca', b'\x75'):
+            response = b''
+        else:
+            response = b'\x00'
+
+        if self.noise and command in self.frames and self.random.random() < self.noise:
+            return bytes([self.random.randrange(256)]) + command + response
+
+        return command + response
+
+
+    def serve(self):
+        while self.running:
+            try:
+                command = os.read(self.master, 1)
+            except OSError:
+                break
+
+            if not command:
+                continue
+
+            self.requests = self.requests + 1
+            if self.response_delay:
+                time.sleep(self.response_delay)
+
+            os.write(self.master, self.respond(command))
@@ -0,0 +1,563 @@
+# Declarative fault rules
+#
+# A rule set is read from a TOML file (mems/faults/rules.toml by default) of
+#
+#  - subsets:    named conditions on the channels selecting samples, such as
+#                the samples once the engine is warm
+#  - aggregates: a summary (count, sum, min, max, mean, median, quantile or
+#                bitwise_or) of a channel over all samples or a subset
+#  - rules:      the fault to report, named after its response in
+#                mems/faults, and a condition on the aggregates
+#
+# and for the windowed analysis, see mems.windows
+#
+#  - window_aggregates: a summary of a channel for every window of the run
+#                (count, fraction of samples in the subset, sum, min, max,
+#                mean, std, bitwise_or, crossings of a level or of the
+#                window mean, or rate of change per minute over a span of
+#                seconds)
+#  - window_rules: the fault and a condition on the window aggregates,
+#                checked for every window. consecutive windows where it
+#                holds form the intervals the fault was active
+#
+# Every channel is read once and every subset mask computed once. The
+# aggregates over the same channel and subset share their selection, so the
+# cost of a run grows with the channels used rather than the number of rules.
+# Conditions are python expressions limited to names, numbers, arithmetic,
+# comparisons, and/or/not and the bitwise operators.
+#
+import ast
+import functools
+import math
+import operator
+import os
+
+try:
+    import tomllib
+except ImportError:
+    import tomli as tomllib
+
+import numpy as np
+import pandas as pd
+
+import mems.profiling
+import mems.windows
+
+
+default_rules_path = os.path.join(os.path.dirname(__file__), 'faults', 'rules.toml')
+
+aggregate_functions = ['count', 'sum', 'min', 'max', 'mean', 'median', 'quantile', 'bitwise_or']
+
+window_functions = ['count', 'fraction', 'sum', 'min', 'max', 'mean', 'std', 'bitwise_or', 'crossings', 'rate']
+
+
+class RuleError(Exception):
+    pass
+
+
+binary_operators = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Mod: operator.mod,
+    ast.BitAnd: operator.and_,
+    ast.BitOr: operator.or_,
+    ast.BitXor: operator.xor,
+    ast.LShift: operator.lshift,
+    ast.RShift: operator.rshift,
+}
+
+comparison_operators = {
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+}
+
+unary_operators = {
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+    ast.Invert: operator.invert,
+    ast.Not: operator.not_,
+}
+
+
+# an aggregate of a missing channel is None and a summary of no samples is
+# NaN, neither makes a condition hold
+def is_true(value):
+    if value is None:
+        return False
+    if isinstance(value, float) and math.isnan(value):
+        return False
+    return bool(value)
+
+
+# the truth of each window for the conditions of window rules
+def truth(value):
+    if isinstance(value, np.ndarray):
+        if np.issubdtype(value.dtype, np.floating):
+            return ~np.isnan(value) & (value != 0)
+        return value.astype(bool)
+
+    return is_true(value)
+
+
+def apply(function, *operands):
+    if any(o is None for o in operands):
+        return None
+    return function(*operands)
+
+
+# compile an expression to a function of a mapping of values, names not in
+# names are rejected
+def compile_expression(text, names):
+    try:
+        tree = ast.parse(text, mode='eval')
+    except SyntaxError as e:
+        raise RuleError(f'invalid expression {text!r}: {e.msg}')
+
+    return compile_node(tree.body, names, text)
+
+
+def compile_node(node, names, text):
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float, bool)):
+        value = node.value
+        return lambda values: value
+
+    if isinstance(node, ast.Name):
+        if node.id not in names:
+            raise RuleError(f'unknown name {node.id!r} in {text!r}')
+        name = node.id
+        return lambda values: values[name]
+
+    if isinstance(node, ast.BinOp) and type(node.op) in binary_operators:
+        function = binary_operators[type(node.op)]
+        left = compile_node(node.left, names, text)
+        right = compile_node(node.right, names, text)
+        return lambda values: apply(function, left(values), right(values))
+
+    if isinstance(node, ast.UnaryOp) and type(node.op) in unary_operators:
+        function = unary_operators[type(node.op)]
+        operand = compile_node(node.operand, names, text)
+        if isinstance(node.op, ast.Not):
+            return lambda values: np.logical_not(truth(operand(values)))
+        return lambda values: apply(function, operand(values))
+
+    if isinstance(node, ast.BoolOp):
+        operands = [compile_node(v, names, text) for v in node.values]
+        # and/or apply to each window when the operands are window values
+        if isinstance(node.op, ast.And):
+            return lambda values: functools.reduce(np.logical_and, [truth(o(values)) for o in operands])
+        return lambda values: functools.reduce(np.logical_or, [truth(o(values)) for o in operands])
+
+    if isinstance(node, ast.Compare) and all(type(op) in comparison_operators for op in node.ops):
+        functions = [comparison_operators[type(op)] for op in node.ops]
+        operands = [compile_node(n, names, text) for n in [node.left] + node.comparators]
+
+        def compare(values):
+            evaluated = [o(values) for o in operands]
+            result = True
+            for function, left, right in zip(functions, evaluated, evaluated[1:]):
+                step = apply(function, left, right)
+                if step is None:
+                    return False
+                result = result & step
+            return result
+
+        return compare
+
+    raise RuleError(f'unsupported expression {ast.unparse(node)!r} in {text!r}')
+
+
+# the summaries of one channel over one subset, values is None when the
+# channel is not in the log
+def summarise(values, aggregates):
+    results = {}
+    valid = np.zeros(0) if values is None else values[~np.isnan(values)]
+
+    quantiles = [a['q'] for a in aggregates if a['function'] in ['median', 'quantile']]
+    if quantiles:
+        computed = np.quantile(valid, quantiles) if len(valid) else [np.nan] * len(quantiles)
+        quantiles = dict(zip(quantiles, computed))
+
+    for a in aggregates:
+        function = a['function']
+
+        if function == 'count':
+            result = len(valid)
+        elif function == 'sum':
+            result = float(valid.sum())
+        elif function == 'min':
+            result = valid.min() if len(valid) else np.nan
+        elif function == 'max':
+            result = valid.max() if len(valid) else np.nan
+        elif function == 'mean':
+            result = valid.mean() if len(valid) else np.nan
+        elif function == 'bitwise_or':
+            result = None if values is None else int(np.bitwise_or.reduce(valid.astype(np.int64)))
+        else:
+            result = quantiles[a['q']]
+
+        results[a['name']] = result
+
+    return results
+
+
+# the running state of one channel over one subset, for aggregating a run a
+# sample or chunk at a time
+class ChannelState(object):
+    def __init__(self, quantiles=False):
+        self.present = False
+        self.count = 0
+        self.total = 0.0
+        self.minimum = np.nan
+        self.maximum = np.nan
+        self.bits = 0
+        self.sketch = QuantileSketch() if quantiles else None
+
+
+    def update(self, values):
+        self.present = True
+        valid = values[~np.isnan(values)]
+
+        if len(valid) == 0:
+            return
+
+        self.count += len(valid)
+        self.total += float(valid.sum())
+        self.minimum = np.fmin(self.minimum, valid.min())
+        self.maximum = np.fmax(self.maximum, valid.max())
+        self.bits |= int(np.bitwise_or.reduce(valid.astype(np.int64)))
+
+        if self.sketch is not None:
+            self.sketch.update(valid)
+
+
+    def result(self, aggregate):
+        function = aggregate['function']
+
+        if function == 'count':
+            return self.count
+        if function == 'sum':
+            return self.total
+        if function == 'min':
+            return self.minimum
+        if function == 'max':
+            return self.maximum
+        if function == 'mean':
+            return self.total / self.count if self.count else np.nan
+        if function == 'bitwise_or':
+            return self.bits if self.present else None
+
+        return self.sketch.quantile(aggregate['q'])
+
+
+# exact quantiles over a stream of values. every channel reported by the ECU
+# is derived from one or two bytes, so the number of distinct values, and the
+# memory held, stays small however long the run is
+class QuantileSketch(object):
+    def __init__(self):
+        self.counts = {}
+
+
+    def update(self, values):
+        values = values[~np.isnan(values)]
+        distinct, counts = np.unique(values, return_counts=True)
+
+        for value, count in zip(distinct.tolist(), counts.tolist()):
+            self.counts[value] = self.counts.get(value, 0) + count
+
+
+    def count(self):
+        return sum(self.counts.values())
+
+
+    # linear interpolation between the closest ranks, as pandas does
+    def quantile(self, q):
+        if not self.counts:
+            return np.nan
+
+        values = np.array(sorted(self.counts))
+        ranks = np.cumsum([self.counts[v] for v in values])
+
+        position = (ranks[-1] - 1) * q
+        lower = int(np.floor(position))
+        upper = int(np.ceil(position))
+
+        low_value = values[np.searchsorted(ranks, lower, side='right')]
+        high_value = values[np.searchsorted(ranks, upper, side='right')]
+
+        return low_value + (high_value - low_value) * (position - lower)
+
+
+    def median(self):
+        return self.quantile(0.5)
+
+
+class RuleSet(object):
+    def __init__(self, subsets=None, aggregates=None, rules=None, window_aggregates=None, window_rules=None):
+        subsets = subsets or {}
+        aggregates = aggregates or {}
+        rules = rules or []
+        window_aggregates = window_aggregates or {}
+        window_rules = window_rules or []
+
+        # a subset may use any channel, the channels are only known per log
+        self.subset_columns = {}
+        self.subsets = {}
+        for name, text in subsets.items():
+            columns = {n.id for n in ast.walk(ast.parse(text, mode='eval')) if isinstance(n, ast.Name)}
+            self.subset_columns[name] = sorted(columns)
+            self.subsets[name] = compile_expression(text, columns)
+
+        self.aggregates = {}
+        for name, spec in aggregates.items():
+            self.aggregates[name] = self.parse_aggregate(name, spec)
+
+        self.rules = [self.parse_rule(rule, self.aggregates) for rule in rules]
+
+        self.window_aggregates = {}
+        for name, spec in window_aggregates.items():
+            self.window_aggregates[name] = self.parse_aggregate(name, spec, window_functions)
+
+        window_names = list(self.window_aggregates) + ['samples', 'duration']
+        self.window_rules = [self.parse_rule(rule, window_names) for rule in window_rules]
+
+        # aggregates of the same channels and subset share one selection
+        self.groups = {}
+        for aggregate in self.aggregates.values():
+            self.groups.setdefault((aggregate['columns'], aggregate['subset']), []).append(aggregate)
+
+
+    def parse_aggregate(self, name, spec, functions=aggregate_functions):
+        function = spec.get('function')
+        if function not in functions:
+            raise RuleError(f'aggregate {name} has unknown function {function!r}')
+
+        # columns lists alternatives, the first that is in the log is used
+        columns = spec.get('columns', [spec.get('column')])
+        if not columns or None in columns:
+            raise RuleError(f'aggregate {name} needs a column')
+
+        subset = spec.get('subset')
+        if subset is not None and subset not in self.subsets:
+            raise RuleError(f'aggregate {name} has unknown subset {subset!r}')
+
+        q = 0.5 if function == 'median' else spec.get('q')
+        if function == 'quantile' and q is None:
+            raise RuleError(f'quantile aggregate {name} needs q')
+
+        if function == 'crossings' and 'level' not in spec:
+            raise RuleError(f'crossings aggregate {name} needs a level')
+
+        return {'name': name, 'function': function, 'columns': tuple(columns), 'subset': subset, 'q': q,
+                'level': spec.get('level'), 'span': spec.get('span')}
+
+
+    def parse_rule(self, rule, names):
+        if 'fault' not in rule or 'when' not in rule:
+            raise RuleError(f'a rule needs a fault and a when condition: {rule}')
+
+        return {'fault': rule['fault'], 'when': rule['when'], 'condition': compile_expression(rule['when'], names)}
+
+
+    @classmethod
+    def from_file(cls, filepath):
+        with open(filepath, 'rb') as f:
+            data = tomllib.load(f)
+
+        return cls(data.get('subsets'), data.get('aggregates'), data.get('rules'),
+                   data.get('window_aggregates'), data.get('window_rules'))
+
+
+    # the channels a run needs for these rules
+    def columns(self):
+        columns = set()
+        for names in self.subset_columns.values():
+            columns.update(names)
+        for aggregate in list(self.aggregates.values()) + list(self.window_aggregates.values()):
+            columns.update(aggregate['columns'])
+        return sorted(columns)
+
+
+    # the sample mask of every subset, channels missing from the log read as NaN
+    def subset_masks(self, column, length):
+        masks = {}
+
+        for name, condition in self.subsets.items():
+            channels = {c: column(c) if column(c) is not None else np.full(length, np.nan)
+                        for c in self.subset_columns[name]}
+            masks[name] = np.asarray(condition(channels), dtype=bool)
+
+        return masks
+
+
+    # every aggregate of a complete run in one pass over the channels it uses
+    def calculate_aggregates(self, df, profiler=None):
+        arrays = {}
+
+        def column(name):
+            if name not in arrays:
+                arrays[name] = df[name].to_numpy(dtype=np.float64) if name in df.columns else None
+            return arrays[name]
+
+        with mems.profiling.stage(profiler, 'subsets', len(df)):
+            masks = self.subset_masks(column, len(df))
+
+        results = {}
+        with mems.profiling.stage(profiler, 'channel_aggregates', len(df)):
+            for (columns, subset), aggregates in self.groups.items():
+                values = next((column(c) for c in columns if column(c) is not None), None)
+
+                if values is not None and subset is not None:
+                    values = values[masks[subset]]
+
+                results.update(summarise(values, aggregates))
+
+        return {name: results[name] for name in self.aggregates}
+
+
+    def create_state(self):
+        return {key: ChannelState(any(a['function'] in ['median', 'quantile'] for a in aggregates))
+                for key, aggregates in self.groups.items()}
+
+
+    # add a sample (a dict or Series keyed by channel) or a DataFrame chunk
+    # to the running state from create_state
+    def update_state(self, state, sample):
+        if hasattr(sample, 'columns'):
+            names = set(sample.columns)
+            length = len(sample)
+            read = lambda name: sample[name].to_numpy(dtype=np.float64)
+        else:
+            names = set(sample.keys())
+            length = 1
+            read = lambda name: np.atleast_1d(np.asarray(sample[name], dtype=np.float64))
+
+        arrays = {}
+
+        def column(name):
+            if name not in arrays:
+                arrays[name] = read(name) if name in names else None
+            return arrays[name]
+
+        masks = self.subset_masks(column, length)
+
+        for (columns, subset), channel in state.items():
+            values = next((column(c) for c in columns if column(c) is not None), None)
+            if values is None:
+                continue
+
+            if subset is not None:
+                values = values[masks[subset]]
+
+            channel.update(values)
+
+
+    def state_aggregates(self, state):
+        return {name: state[(a['columns'], a['subset'])].result(a) for name, a in self.aggregates.items()}
+
+
+    # the faults whose conditions hold, in the order of the rules
+    def evaluate(self, aggregates, profiler=None):
+        faults = []
+
+        for rule in self.rules:
+            with mems.profiling.stage(profiler, f'rule.{rule["fault"]}'):
+                if is_true(rule['condition'](aggregates)):
+                    faults.append(rule['fault'])
+
+        return faults
+
+
+    # the window aggregates of every window of length seconds, with the start,
+    # end, number of samples and time covered of each window. the times are
+    # seconds from the first sample
+    def calculate_windows(self, df, length=10.0, profiler=None):
+        arrays = {}
+
+        def column(name):
+            if name not in arrays:
+                arrays[name] = df[name].to_numpy(dtype=np.float64) if name in df.columns else None
+            return arrays[name]
+
+        if 'timestamp' in df.columns:
+            t = mems.windows.as_seconds(df['timestamp'].to_numpy())
+        else:
+            t = np.arange(len(df), dtype=np.float64)
+
+        grid = mems.windows.WindowGrid(t, length)
+        masks = self.subset_masks(column, len(df))
+
+        windows = {'start': grid.start.astype(np.float64), 'end': grid.end.astype(np.float64),
+                   'samples': grid.counts, 'duration': grid.duration}
+
+        with mems.profiling.stage(profiler, 'window_aggregates', len(df)):
+            for name, a in self.window_aggregates.items():
+                values = next((column(c) for c in a['columns'] if column(c) is not None), None)
+
+                if values is None:
+                    windows[name] = np.full(len(grid), np.nan)
+                    continue
+
+                valid = ~np.isnan(values)
+                selected = valid & masks[a['subset']] if a['subset'] is not None else valid
+                function = a['function']
+
+                if function == 'count':
+                    windows[name] = grid.count(selected)
+                elif function == 'fraction':
+                    windows[name] = grid.fraction(valid, selected)
+                elif function == 'crossings':
+                    level = a['level']
+                    if level == 'mean':
+                        level = np.repeat(grid.mean(values, selected), grid.counts)
+                    windows[name] = grid.crossings(values, selected, level)
+                elif function == 'rate':
+                    windows[name] = grid.rate(values, selected, a['span'] or length)
+                else:
+                    windows[name] = getattr(grid, function)(values, selected)
+
+        return pd.DataFrame(windows)
+
+
+    # the intervals, in seconds from the first sample, where each window rule
+    # held, in the order of the rules
+    def evaluate_windows(self, windows, profiler=None):
+        columns = ['fault', 'start', 'end', 'duration', 'windows']
+        if len(windows) == 0:
+            return pd.DataFrame(columns=columns)
+
+        # a window aggregate of a channel missing from the log is all NaN,
+        # it is passed as None so that it never makes a condition hold
+        values = {}
+        for name in windows.columns:
+            column = windows[name].to_numpy()
+            values[name] = None if np.isnan(column.astype(np.float64)).all() else column
+
+        start = windows['start'].to_numpy()
+        end = windows['end'].to_numpy()
+        covered = start + windows['duration'].to_numpy()
+        intervals = []
+
+        for rule in self.window_rules:
+            with mems.profiling.stage(profiler, f'window_rule.{rule["fault"]}', len(windows)):
+                flags = np.broadcast_to(truth(rule['condition'](values)), (len(windows),))
+
+                for first, last in mems.windows.intervals(start, end, flags):
+                    intervals.append({'fault': rule['fault'],
+                                      'start': start[first],
+                                      'end': covered[last],
+                                      'duration': covered[last] - start[first],
+                                      'windows': last - first + 1})
+
+        return pd.DataFrame(intervals, columns=columns)
+
+
+# rule files are parsed once per process and shared
+@functools.lru_cache(maxsize=None)
+def load_rules(filepath=default_rules_path):
+    return RuleSet.from_file(filepath)
@@ -0,0 +1,265 @@
+# Synthetic MEMS logs for benchmarks and demonstrations
+#
+# Generates a plausible run of any length: cranking, a cold idle that
+# settles as the coolant warms up, occasional throttle blips, and closed
+# loop lambda oscillation once warm. Sensor fault bits and derived faults
+# can be injected part way through the run.
+#
+#   python -m mems.synthetic 1000000 run.log
+#   python -m mems.synthetic 100000 run.csv --faults thermostat coolant_temp_sensor_fault
+#
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+import mems.logreader
+import mems.protocol.rosco
+
+
+# fault bits reported by the ECU in the 0x80 frame
+fault_bits = {
+    'coolant_temp_sensor_fault': ('coolant_temp_inlet_air_temp_sensor_fault', 0b00000001),
+    'inlet_air_temp_sensor_fault': ('coolant_temp_inlet_air_temp_sensor_fault', 0b00000010),
+    'fuel_pump_circuit_fault': ('fuel_pump_throttle_pot_circuit_fault', 0b00000001),
+    'throttle_pot_circuit_fault': ('fuel_pump_throttle_pot_circuit_fault', 0b01000000),
+}
+
+# faults produced by the behaviour of the engine rather than a fault bit
+derived_faults = ['thermostat', 'map_sensor_high', 'idle_speed_high', 'idle_air_control_high']
+
+
+class SyntheticLog(object):
+    def __init__(self, samples, period=1.0, seed=0, faults=(), fault_start=0.5, ambient=15.0, version='99 00 02 03'):
+        self.rosco = mems.protocol.rosco.Rosco()
+        self.samples = samples
+        self.period = period
+        self.seed = seed
+        self.faults = list(faults)
+        self.fault_start = int(samples * fault_start)
+        self.ambient = ambient
+        self.version = version
+
+        unknown = [f for f in self.faults if f not in fault_bits and f not in derived_faults]
+        if unknown:
+            raise ValueError(f'unknown synthetic faults: {", ".join(unknown)}')
+
+
+    # converted channel values for samples [start, stop), generated from the
+    # sample number alone so any part of a long run can be made on its own
+    def channels(self, start, stop):
+        rng = np.random.default_rng((self.seed, start))
+        n = stop - start
+        t = np.arange(start, stop) * self.period
+        noise = lambda scale: rng.normal(0, scale, n)
+
+        thermostat = 'thermostat' in self.faults
+        warm_limit = 62.0 if thermostat else 90.0
+        coolant = self.ambient + (warm_limit - self.ambient) * (1 - np.exp(-t / 480.0))
+        warmth = np.clip((coolant - self.ambient) / (90.0 - self.ambient), 0, 1)
+
+        cranking = t < 3.0
+        idle = 1250 - 400 * warmth
+        if 'idle_speed_high' in self.faults:
+            idle = np.where(t >= self.fault_start * self.period, np.maximum(idle, 1250), idle)
+
+        # short throttle blips every couple of minutes
+        blip = np.clip(np.sin(2 * np.pi * t / 137.0) * 8 - 7, 0, 1)
+        engine_speed = np.where(cranking, 200, idle + blip * 2200 + noise(15))
+
+        map_idle = 52.0 if 'map_sensor_high' in self.faults else 34.0
+        map_sensor = np.where(cranking, 100, map_idle - blip * 10 + noise(1.5))
+
+        iac = 120 - 80 * warmth
+        if 'idle_air_control_high' in self.faults:
+            iac = np.maximum(iac, 110)
+
+        # lambda switches 7-8 times every 10 seconds once in closed loop
+        closed_loop = coolant > 55
+        lambda_voltage = np.where(closed_loop, 450 + 400 * np.tanh(3 * np.sin(2 * np.pi * t / 2.6)) + noise(20), 435)
+
+        throttle_pot = 0.6 + blip * 3.0 + noise(0.01)
+
+        return {
+            'engine_speed': np.clip(engine_speed, 0, 8000),
+            'coolant_temperature': coolant,
+            'ambient_temperature': np.full(n, self.ambient),
+            'intake_air_temperature': self.ambient + 20 * warmth + noise(0.5),
+            'fuel_temperature': self.ambient + 10 * warmth,
+            'map_sensor': np.clip(map_sensor, 0, 255),
+            'battery_voltage': np.where(cranking, 10.5, 14.0) + noise(0.05),
+            'throttle_pot_voltage': np.clip(throttle_pot, 0, 5),
+            'idle_switch': (blip == 0).astype(np.float64),
+            'park_neutral_switch': np.zeros(n),
+            'idle_set_point': np.full(n, 16.0),
+            'idle_decay': np.full(n, 36.0),
+            'idle_air_contol_position': iac / 1.8,
+            'idle_speed_deviation': np.abs(noise(20)),
+            'ignition_advance': 12 + 20 * blip + noise(0.5),
+            'coil_time': 2.8 + noise(0.05),
+            'ignition_switch': np.ones(n),
+            'throttle_angle': blip * 60,
+            'air_fuel_ratio': 14.7 + noise(0.1),
+            'lambda_voltage': np.clip(lambda_voltage, 0, 1275),
+            'loop_indicator': closed_loop.astype(np.float64),
+            'long_term_trim': np.full(n, 2.0),
+            'short_term_trim': np.where(closed_loop, 5 * np.sin(2 * np.pi * t / 2.6), 0.0),
+            'idle_speed_offset': np.zeros(n),
+            'timestamp': t,
+        }
+
+
+    # fault bytes of the 0x80 frame with the injected fault bits set from
+    # fault_start onwards
+    def fault_bytes(self, start, stop):
+        active = np.arange(start, stop) >= self.fault_start
+        result = {field: np.zeros(stop - start, dtype=np.uint8) for field, _ in fault_bits.values()}
+
+        for fault in self.faults:
+            if fault in fault_bits:
+                field, bit = fault_bits[fault]
+                result[field] = result[field] | np.where(active, bit, 0).astype(np.uint8)
+
+        return result
+
+
+    def frames(self, start, stop):
+        df = pd.DataFrame(self.channels(start, stop))
+        frames80 = self.rosco.encode_frames(df, '80')
+        frames7d = self.rosco.encode_frames(df, '7d')
+
+        fields = self.rosco.get_dataframe_fields('80')
+        for field, values in self.fault_bytes(start, stop).items():
+            frames80[:, fields.index(field)] = values
+
+        return frames80, frames7d
+
+
+    def chunks(self, chunksize):
+        for start in range(0, self.samples, chunksize):
+            yield start, min(start + chunksize, self.samples)
+
+
+    def write_readmems(self, filepath, chunksize=100000):
+        # 'XX ' for every byte value, a frame line is built by table lookup
+        table = np.frombuffer(''.join(f'{b:02X} ' for b in range(256)).encode(), dtype=np.uint8).reshape(256, 3)
+
+        def lines(prefix, frames):
+            body = table[frames].reshape(len(frames), -1)
+            head = np.broadcast_to(np.frombuffer(prefix, dtype=np.uint8), (len(frames), len(prefix)))
+            tail = np.full((len(frames), 1), ord('\n'), dtype=np.uint8)
+            return np.hstack([head, body, tail])
+
+        with open(filepath, 'wb') as f:
+            f.write(b'readmems synthetic log\n')
+            f.write(f'ECU responded to D0 command with: {self.version}\n'.encode())
+
+            for start, stop in self.chunks(chunksize):
+                frames80, frames7d = self.frames(start, stop)
+                f.write(np.hstack([lines(b'80: ', frames80), lines(b'7D: ', frames7d)]).tobytes())
+
+
+    # mems-scan writes these fields as the raw byte
+    def memsscan_values(self, start, stop):
+        values = self.channels(start, stop)
+
+        for field, conversion in self.rosco._conversions.items():
+            if conversion.get('memsscan_raw') and field in values:
+                values[field] = (values[field] - conversion['offset']) / conversion['scale']
+
+        fault_codes = self.fault_bytes(start, stop)
+        values['fault_codes'] = (fault_codes['coolant_temp_inlet_air_temp_sensor_fault'] |
+                                 fault_codes['fuel_pump_throttle_pot_circuit_fault'])
+
+        return values
+
+
+    # decimal places mems-scan writes a field with, whole numbers for fields
+    # with an integer scale or written raw
+    def memsscan_decimals(self, field):
+        conversion = self.rosco._conversions.get(field)
+        if conversion is None or conversion.get('memsscan_raw') or float(conversion['scale']).is_integer():
+            return 0
+        return 3
+
+
+    # csv text is built as a byte matrix, as pandas to_csv is too slow for
+    # logs of millions of rows
+    def write_memsscan(self, filepath, chunksize=100000, start_time=11 * 3600):
+        fields = [field for column, field in mems.logreader.LogReader.memsscan_columns.items() if column != '#time']
+        times = np.frombuffer(''.join(f'{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}' for s in range(86400)).encode(),
+                              dtype=np.uint8).reshape(86400, 8)
+
+        with open(filepath, 'wb') as f:
+            f.write(f'ECU ID:{self.rosco.get_version(self.version) or ""}\n'.encode())
+            f.write((','.join(mems.logreader.LogReader.memsscan_columns) + '\n').encode())
+
+            for start, stop in self.chunks(chunksize):
+                values = self.memsscan_values(start, stop)
+                n = stop - start
+
+                seconds = (values['timestamp'] + start_time).astype(np.int64) % 86400
+                parts = [times[seconds]]
+                keep = [np.ones((n, 8), dtype=bool)]
+
+                for field in fields:
+                    text, mask = format_column(values.get(field, np.zeros(n)), self.memsscan_decimals(field))
+                    parts.extend([np.full((n, 1), ord(','), dtype=np.uint8), text])
+                    keep.extend([np.ones((n, 1), dtype=bool), mask])
+
+                parts.append(np.full((n, 1), ord('\n'), dtype=np.uint8))
+                keep.append(np.ones((n, 1), dtype=bool))
+
+                f.write(np.hstack(parts)[np.hstack(keep)].tobytes())
+
+
+# the digits of a column as a fixed width byte matrix and a mask of the
+# characters to keep, which drops the sign of positive numbers, leading zeros
+# and trailing decimal zeros
+def format_column(values, decimals):
+    values = np.round(np.asarray(values, dtype=np.float64), decimals)
+    scaled = np.round(np.abs(values) * 10 ** decimals).astype(np.int64)
+    width = max(len(str(int(scaled.max(initial=0)))), decimals + 1)
+
+    powers = 10 ** np.arange(width - 1, -1, -1, dtype=np.int64)
+    digits = (scaled[:, None] // powers % 10).astype(np.uint8)
+    whole, fraction = digits[:, :width - decimals], digits[:, width - decimals:]
+
+    keep_whole = np.cumsum(whole != 0, axis=1) > 0
+    keep_whole[:, -1] = True
+    keep_fraction = np.cumsum(fraction[:, ::-1] != 0, axis=1)[:, ::-1] > 0
+    keep_point = keep_fraction.any(axis=1)[:, None]
+    keep_sign = ((values < 0) & (scaled > 0))[:, None]
+
+    n = len(values)
+    text = np.hstack([np.full((n, 1), ord('-'), dtype=np.uint8), whole + ord('0'),
+                      np.full((n, 1), ord('.'), dtype=np.uint8), fraction + ord('0')])
+    keep = np.hstack([keep_sign, keep_whole, keep_point, keep_fraction])
+
+    return text, keep
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m mems.synthetic', description='Write a synthetic MEMS log')
+    parser.add_argument('samples', type=int)
+    parser.add_argument('output', help='.log for readmems format, .csv for mems-scan format')
+    parser.add_argument('--period', type=float, default=None, help='seconds between samples')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--faults', nargs='*', default=[], choices=list(fault_bits) + derived_faults)
+    args = parser.parse_args(argv)
+
+    memsscan = args.output.lower().endswith('.csv')
+    period = args.period or (0.5 if memsscan else 1.0)
+    log = SyntheticLog(args.samples, period, args.seed, args.faults)
+
+    if memsscan:
+        log.write_memsscan(args.output)
+    else:
+        log.write_readmems(args.output)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
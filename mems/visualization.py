@@ -0,0 +1,186 @@
+# Plotting of loaded logs
+#
+# plotly is imported inside each function rather than at module level, so
+# importing mems for parsing and diagnostics does not pay for it. Python
+# caches the modules after the first call.
+#
+import numpy as np
+
+import mems.decimate
+
+
+def display_distplot(df, dimensions, title, filename):
+    import plotly.figure_factory as ff
+    from plotly.offline import iplot
+
+    fig = ff.create_distplot([df[c] for c in dimensions], dimensions, curve_type='normal')
+    return iplot(fig, filename=(f'{filename[0]}-{title}'))
+
+
+# a line trace reduced to max_points, drawn with WebGL once the series is
+# longer than webgl_threshold. smoothing is only applied to raw series
+def create_trace(x, y, name, max_points=4000, webgl_threshold=20000, method='lttb'):
+    import plotly.graph_objs as go
+
+    n = len(y)
+
+    if max_points and n > max_points:
+        selected = mems.decimate.decimate_indices(x, y, max_points, method)
+        x = x[selected]
+        y = y[selected]
+        line = dict()
+    else:
+        line = dict(shape='spline', smoothing=0.4)
+
+    if n > webgl_threshold:
+        return go.Scattergl(x=x, y=y, name=name, mode='lines', line=line)
+
+    return go.Scatter(x=x, y=y, name=name, line=line)
+
+
+def create_graph(df, dimensions, title='', y_axis_label='', max_points=4000, webgl_threshold=20000, method='lttb'):
+    import plotly.graph_objs as go
+
+    data = []
+    x = df['timestamp'].to_numpy()
+
+    for dimension in dimensions:
+        data.append(create_trace(x, df[dimension].to_numpy(), dimension, max_points, webgl_threshold, method))
+
+    layout = go.Layout(title=f'{title}',
+        xaxis=dict(title='time (s)'),
+        yaxis=dict(title=y_axis_label, zeroline=False))
+
+    fig = go.Figure(data=data, layout=layout)
+
+    fig.update_layout(
+        xaxis=dict(
+            linecolor='rgb(204, 204, 204)',
+        ),
+        autosize=True,
+        showlegend=True,
+        plot_bgcolor='rgb(250, 250, 250)'
+    )
+
+    return fig
+
+
+# long logs are decimated to max_points per trace ('lttb' or 'minmax').
+# with dynamic=True a FigureWidget is returned which re-decimates the
+# visible range when zooming, this needs ipywidgets
+def display_graph(df, dimensions, title='', y_axis_label='', filename=('',), max_points=4000, webgl_threshold=20000, method='lttb', dynamic=False):
+    from plotly.offline import iplot
+
+    fig = create_graph(df, dimensions, title, y_axis_label, max_points, webgl_threshold, method)
+
+    if dynamic:
+        return create_dynamic_graph(df, fig, dimensions, max_points, method)
+
+    return iplot(fig, filename=(f'{filename[0]}-{dimensions[-1]}'))
+
+
+def create_dynamic_graph(df, fig, dimensions, max_points=4000, method='lttb'):
+    import plotly.graph_objs as go
+
+    widget = go.FigureWidget(fig)
+    x = df['timestamp'].to_numpy()
+    series = [df[dimension].to_numpy() for dimension in dimensions]
+
+    def redecimate(layout, xrange):
+        if xrange is None or xrange[0] is None:
+            lower, upper = 0, len(x)
+        else:
+            bounds = np.array(xrange, dtype=x.dtype)
+            lower, upper = np.searchsorted(x, bounds[0]), np.searchsorted(x, bounds[1], side='right')
+
+        with widget.batch_update():
+            for trace, y in zip(widget.data, series):
+                selected = lower + mems.decimate.decimate_indices(x[lower:upper], y[lower:upper], max_points, method)
+                trace.x = x[selected]
+                trace.y = y[selected]
+
+    widget.layout.xaxis.on_change(redecimate, 'range')
+    return widget
+
+
+# the bins and box statistics are computed with numpy so plotly only
+# receives the summary rather than every sample
+def create_histogram(df, dimension, title='', y_axis_label='', bins=50):
+    import plotly.graph_objs as go
+    from plotly.subplots import make_subplots
+
+    values = df[dimension].to_numpy()
+    counts, edges = mems.decimate.histogram(values, bins)
+    box = mems.decimate.box_statistics(values)
+
+    fig = make_subplots(rows=2, cols=1, shared_xaxes=True, row_heights=[0.2, 0.8], vertical_spacing=0.02)
+
+    if box is not None:
+        fig.add_trace(go.Box(y=[dimension], q1=[box['q1']], median=[box['median']], q3=[box['q3']],
+                             lowerfence=[box['lowerfence']], upperfence=[box['upperfence']],
+                             mean=[box['mean']], orientation='h', name=dimension, showlegend=False), row=1, col=1)
+
+    fig.add_trace(go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, width=np.diff(edges), name=dimension), row=2, col=1)
+
+    fig.update_layout(
+        title=title,
+        xaxis2=dict(
+            title=dimension,
+            linecolor='rgb(204, 204, 204)',
+        ),
+        yaxis2=dict(title=y_axis_label or 'count'),
+        bargap=0.1,
+        autosize=True,
+        showlegend=True,
+        plot_bgcolor='rgb(250, 250, 250)',
+    )
+
+    return fig
+
+
+def display_histogram(df, dimension, title='', y_axis_label='', filename=('',), bins=50):
+    from plotly.offline import iplot
+
+    fig = create_histogram(df, dimension, title, y_axis_label, bins)
+    return iplot(fig, filename=(f'{filename[0]}-{dimension}'))
+
+
+# the samples around an event of mems.events with the event shaded
+def create_event_graph(df, event, dimensions, title='', y_axis_label='', max_points=4000, webgl_threshold=20000, method='lttb'):
+    fig = create_graph(df, dimensions, title or f'{event["type"]} at {event["start_time"]:.1f}s', y_axis_label,
+                       max_points, webgl_threshold, method)
+
+    fig.add_vrect(x0=event['timestamp'], x1=event['end_timestamp'], fillcolor='rgb(255, 200, 120)', opacity=0.3,
+                  line_width=0, layer='below')
+
+    return fig
+
+
+# the aligned channels of a mems.compare.RunComparison, one plot per channel
+# with both runs decimated to max_points
+def create_comparison_graph(comparison, dimensions, title='', y_axis_label='', max_points=4000, method='lttb'):
+    from plotly.subplots import make_subplots
+
+    fig = make_subplots(rows=len(dimensions), cols=1, shared_xaxes=True, subplot_titles=dimensions, vertical_spacing=0.04)
+    x = comparison.grid
+
+    for row, dimension in enumerate(dimensions, 1):
+        for name, aligned, colour in zip(comparison.names, comparison.aligned, ['rgb(31, 119, 180)', 'rgb(214, 39, 40)']):
+            y = aligned[dimension].to_numpy()
+            valid = ~np.isnan(y)
+            trace = create_trace(x[valid], y[valid], name, max_points, method=method)
+            trace.update(line=dict(color=colour), legendgroup=name, showlegend=row == 1)
+            fig.add_trace(trace, row=row, col=1)
+
+    fig.update_layout(
+        title=title,
+        height=max(300, 220 * len(dimensions)),
+        autosize=True,
+        showlegend=True,
+        plot_bgcolor='rgb(250, 250, 250)',
+    )
+    fig.update_xaxes(title='time (s)', row=len(dimensions), col=1)
+    if y_axis_label:
+        fig.update_yaxes(title=y_axis_label)
+
+    return fig
@@ -0,0 +1,144 @@
+# Statistics of a run over consecutive windows of time
+#
+# The samples are cut into windows of a fixed number of seconds and each
+# statistic is computed for every window at once with ufunc.reduceat over the
+# window boundaries. The cost is linear in the length of the log whatever the
+# window length. Windows without samples, gaps in the log, are left out.
+#
+import numpy as np
+
+
+# seconds since the first sample of numeric or datetime timestamps
+def as_seconds(timestamps):
+    t = np.asarray(timestamps)
+
+    if np.issubdtype(t.dtype, np.datetime64):
+        t = t.astype('datetime64[ns]').astype(np.int64) / 1e9
+    else:
+        t = t.astype(np.float64)
+
+    return t - t[0] if len(t) else t
+
+
+class WindowGrid(object):
+    def __init__(self, t, length):
+        self.t = t
+        self.length = length
+
+        number = np.floor(t / length).astype(np.int64)
+        self.starts = np.flatnonzero(np.r_[True, number[1:] != number[:-1]]) if len(t) else np.zeros(0, dtype=np.int64)
+        self.number = number[self.starts]
+        self.counts = np.diff(np.r_[self.starts, len(t)])
+        self.start = self.number * length
+        self.end = self.start + length
+
+        # the time covered by the samples of each window, one sample period is
+        # added so that a full window covers its length. mems-scan times are
+        # whole seconds with several samples to a second, so the period is
+        # taken over the steps where the time moves on
+        steps = np.diff(t)
+        steps = steps[steps > 0]
+        period = float(np.median(steps)) if len(steps) else 0.0
+        last = self.starts + self.counts - 1
+        self.duration = np.minimum(t[last] - t[self.starts] + period, length) if len(t) else np.zeros(0)
+
+
+    def __len__(self):
+        return len(self.starts)
+
+
+    def reduce(self, ufunc, values):
+        if len(self.starts) == 0:
+            return np.zeros(0, dtype=values.dtype)
+        return ufunc.reduceat(values, self.starts)
+
+
+    def count(self, selected):
+        return self.reduce(np.add, selected.astype(np.int64))
+
+
+    # the fraction of the valid samples of a window that are selected
+    def fraction(self, valid, selected):
+        total = self.count(valid)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(total > 0, self.count(valid & selected) / total, np.nan)
+
+
+    def sum(self, values, selected):
+        return self.reduce(np.add, np.where(selected, values, 0.0))
+
+
+    def mean(self, values, selected):
+        count = self.count(selected)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(count > 0, self.sum(values, selected) / count, np.nan)
+
+
+    # from the sums of the values and their squares, centred on the overall
+    # mean to keep the precision
+    def std(self, values, selected):
+        centre = values[selected].mean() if selected.any() else 0.0
+        centred = values - centre
+        count = self.count(selected)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self.sum(centred, selected) / count
+            square = self.sum(centred * centred, selected) / count
+            return np.where(count > 0, np.sqrt(np.maximum(square - mean * mean, 0.0)), np.nan)
+
+
+    def min(self, values, selected):
+        return self.reduce(np.fmin, np.where(selected, values, np.nan))
+
+
+    def max(self, values, selected):
+        return self.reduce(np.fmax, np.where(selected, values, np.nan))
+
+
+    def bitwise_or(self, values, selected):
+        return self.reduce(np.bitwise_or, np.where(selected, values, 0).astype(np.int64))
+
+
+    # times the values cross level in each window, counted between
+    # consecutive selected samples of the same window. level is a number or
+    # an array of a level for every sample
+    def crossings(self, values, selected, level):
+        with np.errstate(invalid='ignore'):
+            above = values >= level
+        crossed = np.zeros(len(values), dtype=bool)
+        crossed[1:] = selected[1:] & selected[:-1] & (above[1:] != above[:-1])
+        crossed[self.starts] = False
+
+        return self.count(crossed)
+
+
+    # change of the values per minute over the span seconds up to the last
+    # sample of each window, NaN where the span reaches before the log
+    def rate(self, values, selected, span):
+        t = self.t[selected]
+        values = values[selected]
+
+        if len(t) < 2:
+            return np.full(len(self), np.nan)
+
+        end = self.t[self.starts + self.counts - 1]
+        begin = end - span
+
+        with np.errstate(invalid='ignore'):
+            rate = (np.interp(end, t, values) - np.interp(begin, t, values)) * 60.0 / span
+
+        return np.where(begin >= t[0], rate, np.nan)
+
+
+# consecutive flagged windows as (first, last) index pairs, a window follows
+# the one before when it starts where that ends so a gap ends an interval
+def intervals(start, end, flags):
+    flags = np.asarray(flags, dtype=bool)
+    if not flags.any():
+        return []
+
+    joined = np.r_[False, flags[1:] & flags[:-1] & np.isclose(start[1:], end[:-1])]
+    begins = np.flatnonzero(flags & ~joined)
+    ends = np.flatnonzero(flags & ~np.r_[joined[1:], False])
+
+    return list(zip(begins.tolist(), ends.tolist()))
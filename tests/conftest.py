@@ -0,0 +1,29 @@
+# the tests import mems from the checkout, run with python -m pytest from the
+# top of the repository or pytest from anywhere
+import os
+import sys
+
+import pytest
+
+import_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if import_root not in sys.path:
+    sys.path.insert(0, import_root)
+
+import mems.synthetic
+
+
+# a readmems log of a warm-up run with fault bits set half way through
+@pytest.fixture
+def readmems_log(tmp_path):
+    filepath = str(tmp_path / 'run.log')
+    mems.synthetic.SyntheticLog(3000, faults=['thermostat', 'coolant_temp_sensor_fault']).write_readmems(filepath)
+    return filepath
+
+
+# a mems-scan log of the same run. at 0.4 s a second of samples can span two
+# entries of the log index
+@pytest.fixture
+def memsscan_log(tmp_path):
+    filepath = str(tmp_path / 'run.csv')
+    mems.synthetic.SyntheticLog(7500, period=0.4, faults=['thermostat', 'coolant_temp_sensor_fault']).write_memsscan(filepath)
+    return filepath
@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+
+import mems.cache
+import mems.logreader
+import mems.synthetic
+
+
+def read(filepath, cache=None):
+    lr = mems.logreader.LogReader(cache=cache)
+    lr.read_logfile(filepath)
+    return lr.df
+
+
+# cached columns are memory maps, compared by value
+def assert_same_frame(df, expected):
+    assert list(df.columns) == list(expected.columns)
+    for column in expected.columns:
+        np.testing.assert_array_equal(np.asarray(df[column]), expected[column].to_numpy(), err_msg=column)
+
+
+def test_cached_log_matches_the_log(readmems_log, tmp_path):
+    cache = mems.cache.LogCache(str(tmp_path / 'cache'))
+
+    stored = read(readmems_log, cache)
+    assert len(cache.entries()) == 1
+
+    cached = read(readmems_log, cache)
+    assert len(cache.entries()) == 1
+    assert_same_frame(cached, stored)
+
+
+def test_stale_entry_is_rebuilt_when_the_log_changes(readmems_log, tmp_path):
+    cache = mems.cache.LogCache(str(tmp_path / 'cache'))
+    before = read(readmems_log, cache)
+
+    # another run of the same length, the size is unchanged and only the
+    # modification time and contents tell it apart
+    size = os.path.getsize(readmems_log)
+    mems.synthetic.SyntheticLog(3000, seed=1).write_readmems(readmems_log)
+    stat = os.stat(readmems_log)
+    os.utime(readmems_log, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert os.path.getsize(readmems_log) == size
+
+    after = read(readmems_log, cache)
+
+    assert len(cache.entries()) == 2
+    assert not after['engine_speed'].equals(before['engine_speed'])
+    assert_same_frame(after, read(readmems_log))
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+import mems.diagnostics
+import mems.logreader
+
+
+def load(filepath):
+    lr = mems.logreader.LogReader()
+    if filepath.endswith('.csv'):
+        lr.read_memsscanfile(filepath)
+    else:
+        lr.read_logfile(filepath)
+    return lr.df
+
+
+def assert_same_aggregates(incremental, whole):
+    assert incremental.keys() == whole.keys()
+    for name, value in whole.items():
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            assert incremental[name] is None or np.isnan(incremental[name]), name
+        else:
+            assert incremental[name] == pytest.approx(value, rel=1e-9, abs=1e-9), name
+
+
+@pytest.mark.parametrize('log', ['readmems_log', 'memsscan_log'])
+def test_incremental_matches_analyse_run(log, request):
+    df = load(request.getfixturevalue(log))
+
+    whole = mems.diagnostics.MemsDiagnostics()
+    whole.analyse_run(df)
+    assert whole.faults
+
+    # single samples, then chunks of an uneven size
+    incremental = mems.diagnostics.IncrementalMemsDiagnostics()
+    for _, sample in df.iloc[:5].iterrows():
+        incremental.update(sample)
+    for start in range(5, len(df), 997):
+        incremental.update(df.iloc[start:start + 997])
+
+    assert incremental.current_faults() == list(whole.faults)
+    assert_same_aggregates(incremental.current_aggregates(), whole.aggregates)
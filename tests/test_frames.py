@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+import mems.protocol.frames
+import mems.protocol.rosco
+import mems.synthetic
+
+
+# a readmems log damaged in the ways readmems logs are: truncated and
+# corrupted responses, merged lines and stray text
+@pytest.fixture
+def damaged_log(tmp_path):
+    filepath = tmp_path / 'damaged.log'
+    mems.synthetic.SyntheticLog(200).write_readmems(str(filepath))
+    lines = filepath.read_bytes().splitlines(keepends=True)
+
+    lines[10] = lines[10][:-7] + b'\n'
+    lines[21] = b'80: 00' + lines[21][6:]
+    lines[30] = lines[30].rstrip(b'\n')
+    lines[41] = b'garbage ' + lines[41]
+    lines[50:50] = [b'readmems: no response from ECU\n']
+    lines[61] = lines[61][:40] + b'\n'
+    lines[72] = lines[72].replace(b' ', b'', 3)
+
+    filepath.write_bytes(b''.join(lines))
+    return filepath.read_bytes()
+
+
+def decode(data, block_size):
+    decoder = mems.protocol.frames.ReadmemsDecoder(mems.protocol.rosco.Rosco())
+    for start in range(0, len(data), block_size):
+        decoder.feed(data[start:start + block_size])
+    decoder.finish()
+    return decoder
+
+
+def test_damaged_log_is_decoded_around_the_damage(damaged_log):
+    decoder = decode(damaged_log, len(damaged_log))
+
+    assert decoder.version == '99 00 02 03'
+    assert decoder.stats['malformed'] > 0
+    assert decoder.stats['unpaired'] > 0
+    assert decoder.stats['resynced'] > 0
+    assert 180 < decoder.stats['samples'] < 200
+
+
+@pytest.mark.parametrize('block_size', [1, 2, 3, 7, 64, 100, 1000, 4096])
+def test_block_size_does_not_change_the_frames(damaged_log, block_size):
+    whole = decode(damaged_log, len(damaged_log))
+    blocks = decode(damaged_log, block_size)
+
+    assert blocks.stats == whole.stats
+    assert blocks.version == whole.version
+    np.testing.assert_array_equal(blocks.sample_ends(), whole.sample_ends())
+    for command, block in whole.frame_blocks().items():
+        np.testing.assert_array_equal(blocks.frame_blocks()[command], block)
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import mems.logindex
+import mems.logreader
+
+
+def elapsed(df):
+    timestamps = df['timestamp']
+    if pd.api.types.is_datetime64_any_dtype(timestamps):
+        return ((timestamps - timestamps.iloc[0]).dt.total_seconds()).to_numpy()
+    return timestamps.to_numpy(dtype=np.float64)
+
+
+def window_bounds(filepath):
+    # the start of every index entry, where a window can lose the rows of
+    # the second before it, and windows within and across entries
+    times = mems.logindex.LogIndex.load_or_build(filepath, save=False).times
+    bounds = [(start, start + 60) for start in times.tolist()]
+    bounds += [(None, 100), (250.5, None), (100, 1100), (1023, 1025), (3, 3)]
+    return bounds
+
+
+@pytest.mark.parametrize('log', ['readmems_log', 'memsscan_log'])
+def test_window_matches_filtered_full_load(log, request):
+    filepath = request.getfixturevalue(log)
+    full = mems.logreader.LogReader().load(filepath)
+    seconds = elapsed(full)
+
+    for start, end in window_bounds(filepath):
+        window = mems.logreader.LogReader().load(filepath, start=start, end=end)
+
+        selected = np.ones(len(full), dtype=bool)
+        if start is not None:
+            selected &= seconds >= start
+        if end is not None:
+            selected &= seconds <= end
+
+        assert len(window) == selected.sum(), (start, end)
+        pd.testing.assert_frame_equal(window.reset_index(drop=True), full[selected].reset_index(drop=True))
+
+
+def test_window_columns(memsscan_log):
+    window = mems.logreader.LogReader().load(memsscan_log, columns=['engine_speed'], start=10, end=20)
+    assert list(window.columns) == ['timestamp', 'engine_speed']